@@ -0,0 +1,45 @@
+"""Client-side batching: msgs/sec and latency for bursts of small messages, per batch window.
+
+    python bench/bench_batching.py --messages 20000 --windows off,0.001,0.005,0.02 --batch-size 64
+"""
+import argparse, asyncio, json, time
+from common import ServerProcess, BenchClient, make_identity, percentiles
+
+async def burst(server, identity, window, batch_size, messages, size):
+    a = await BenchClient(server.url, server.server_pub, identity, batch_window=window, batch_size=batch_size).connect()
+    b = await BenchClient(server.url, server.server_pub, identity).connect()
+    pad = "x" * size
+    latencies = []
+
+    async def receive():
+        while len(latencies) < messages:
+            _, text = await asyncio.wait_for(b.recv(), 10)
+            latencies.append((time.perf_counter() - float(text.split("|", 1)[0])) * 1000)
+
+    receiver = asyncio.create_task(receive())
+    start = time.perf_counter()
+    for _ in range(messages):
+        await a.send(b.client_id, f"{time.perf_counter()}|{pad}")
+    await a.channel.flush()
+    try:
+        await receiver
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+    await a.close()
+    await b.close()
+    return {"window": window, "batch_size": batch_size if window is not None else None, "received": len(latencies),
+            "msgs_per_sec": round(len(latencies) / elapsed), "latency_ms": {k: v and round(v, 2) for k, v in percentiles(latencies).items()}}
+
+async def run(args):
+    with ServerProcess(outbound_queue_size=args.messages) as server:
+        identity = make_identity()
+        return [await burst(server, identity, w, args.batch_size, args.messages, args.size) for w in args.windows]
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=10000)
+    ap.add_argument("--size", type=int, default=32, help="message text bytes")
+    ap.add_argument("--windows", type=lambda s: [None if w == "off" else float(w) for w in s.split(",")], default=[None, 0.001, 0.005, 0.02])
+    ap.add_argument("--batch-size", type=int, default=64)
+    print(json.dumps(asyncio.run(run(ap.parse_args())), indent=2))
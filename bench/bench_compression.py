@@ -0,0 +1,76 @@
+"""Bandwidth and CPU cost of payload compression, per codec, on this project's message shapes.
+
+    python bench/bench_compression.py [--iterations 2000] [--min-size 128]
+
+For every shape, framing and codec it prints the sealed frame size, what
+websocket permessage-deflate would make of that frame, and the seal and open
+time per message. "-" is no compression; codecs whose module is not
+installed are skipped. Sizes below --min-size go out uncompressed, as they
+would on a live session.
+"""
+import argparse, os, random, sys, time, uuid, zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from modules.crypto_utils import AESHandler
+from modules.compression import Compressor, CODECS
+from modules.session import Session, FRAMINGS
+
+WORDS = ("the of and to in is you that it he was for on are as with his they at be this from have or by one had not but what all "
+         "were when we there can an your which their said if do will each about how up out them then she many some so these would "
+         "other into has more her two like him see time could no make than first been its who now people my made over did down only "
+         "way find use may water long little very after words called just where most know ok thanks sure tomorrow meeting later").split()
+
+def text(rng, n):
+    out = []
+    while sum(map(len, out)) + len(out) < n:
+        out.append(rng.choice(WORDS))
+    return " ".join(out)[:n]
+
+def shapes():
+    rng = random.Random(7)
+    peers = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(8)]
+    relay = lambda n: {"text": text(rng, n), "sender": rng.choice(peers)}
+    return {
+        "chat 40B": {"target": peers[0], "text": text(rng, 40)},
+        "chat 300B": {"target": peers[0], "text": text(rng, 300)},
+        "chat 2KB": {"target": peers[0], "text": text(rng, 2000)},
+        "relayed 40B": relay(40),
+        "batch 64x40B": {"type": "batch", "items": [relay(40) for _ in range(64)]},
+        "mail 32x100B": {"type": "batch", "items": [{**relay(100), "ts": time.time() + i} for i in range(32)]},
+        "multi 50 targets": {"targets": peers * 6 + peers[:2], "text": text(rng, 80)},
+        "file offer": {"type": "file", "op": "offer", "stream": rng.getrandbits(32), "target": peers[1], "file": os.urandom(16).hex(),
+                       "name": "holiday photos.zip", "size": 48_000_000, "chunk": 65536, "window": 32, "key": os.urandom(32).hex()},
+    }
+
+def measure(session, payload, iterations):
+    frame = session.seal(payload)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        session.seal(payload)
+    seal = (time.perf_counter() - start) / iterations
+    start = time.perf_counter()
+    for _ in range(iterations):
+        session.open(frame)
+    opened = (time.perf_counter() - start) / iterations
+    raw = frame.encode() if isinstance(frame, str) else frame
+    deflate = zlib.compressobj(wbits=-15)
+    return len(raw), len(deflate.compress(raw) + deflate.flush(zlib.Z_SYNC_FLUSH)) - 4, seal, opened
+
+def main(args):
+    aesgcm = AESHandler.make(os.urandom(32))
+    codecs = [None] + list(CODECS)
+    print(f"{'shape':<18} {'framing':<7} {'codec':<5} {'plain':>7} {'frame':>7} {'ratio':>6} {'+deflate':>9} {'seal us':>8} {'open us':>8}")
+    for name, payload in shapes().items():
+        for framing in FRAMINGS.values():
+            plain = len(framing.encode(payload))
+            for codec in codecs:
+                session = Session(aesgcm, framing, compressor=codec and Compressor(codec, min_size=args.min_size))
+                size, deflated, seal, opened = measure(session, payload, args.iterations)
+                print(f"{name:<18} {framing.name:<7} {codec or '-':<5} {plain:>7} {size:>7} {size / plain:>6.2f} {deflated:>9} "
+                      f"{seal * 1e6:>8.1f} {opened * 1e6:>8.1f}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--iterations", type=int, default=2000)
+    ap.add_argument("--min-size", type=int, default=128, help="COMPRESS_MIN_SIZE")
+    main(ap.parse_args())
@@ -0,0 +1,81 @@
+"""Server-side cost of delivering one message to a group, from 10 to 10k members.
+
+    python bench/bench_fanout.py [--sizes 10,100,1000,10000] [--messages 20]
+
+"per-target" is the old way: the sender seals one frame per member and the
+server opens, encodes and seals each of them. "group" is one inbound frame
+fanned out by WebSocketServer.fan_out: one open, one encode per framing, one
+seal per member. Both include the writer tasks draining the outbound queues.
+"""
+import argparse, asyncio, os, sys, tempfile, time, types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from main import WebSocketServer
+from modules.crypto_utils import AESHandler
+from modules.outbound import OutboundQueue
+from modules.session import Session, BinaryFraming
+
+class NullWS:
+    async def send(self, frame):
+        pass
+
+    async def close(self, *args):
+        pass
+
+def make_server(members):
+    server = WebSocketServer("127.0.0.1", 0, None, 15, client_keys_file=os.path.join(tempfile.mkdtemp(), "keys.json"),
+                             metrics_port=None, log_level="off", outbound_queue_size=1_000_000, group_max_members=members + 1)
+    sender = Session(AESHandler.make(os.urandom(32)), BinaryFraming)
+    inbound = Session(sender.aesgcm, BinaryFraming)
+    for i in range(members):
+        conn = types.SimpleNamespace(session=Session(AESHandler.make(os.urandom(32)), BinaryFraming), outbound=OutboundQueue(NullWS(), 1_000_000))
+        conn.outbound.start()
+        server.clients_map[f"member-{i}"] = conn
+        server.groups.join("bench", f"member-{i}")
+    server.groups.join("bench", "sender")
+    return server, sender, inbound
+
+async def drain(server):
+    for conn in server.clients_map.values():
+        while conn.outbound.queue:
+            await asyncio.sleep(0)
+
+async def run_size(members, messages, text):
+    server, sender, inbound = make_server(members)
+    ids = list(server.clients_map)
+
+    frames = [[sender.seal({"target": cid, "text": text}) for cid in ids] for _ in range(messages)]
+    start = time.perf_counter()
+    for batch in frames:
+        for frame in batch:
+            payload = inbound.open(frame)
+            server.deliver(payload["target"], {"text": payload["text"], "sender": "sender"})
+        await drain(server)
+    per_target = (time.perf_counter() - start) / messages
+
+    frames = [sender.seal({"group": "bench", "text": text}) for _ in range(messages)]
+    start = time.perf_counter()
+    for frame in frames:
+        payload = inbound.open(frame)
+        server.deliver_group(payload["group"], "sender", payload["text"])
+        await drain(server)
+    group = (time.perf_counter() - start) / messages
+
+    for conn in server.clients_map.values():
+        await conn.outbound.stop()
+    server.crypto_pool.shutdown()
+    return per_target, group
+
+async def main(args):
+    text = "x" * args.size
+    print(f"{'members':>8} {'per-target ms':>14} {'group ms':>9} {'us/member':>10} {'speedup':>8}")
+    for members in args.sizes:
+        per_target, group = await run_size(members, args.messages, text)
+        print(f"{members:>8} {per_target * 1000:>14.2f} {group * 1000:>9.2f} {group / members * 1e6:>10.2f} {per_target / group:>7.1f}x")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[10, 100, 1000, 10000])
+    ap.add_argument("--messages", type=int, default=20, help="messages per group size")
+    ap.add_argument("--size", type=int, default=100, help="message text bytes")
+    asyncio.run(main(ap.parse_args()))
@@ -0,0 +1,41 @@
+"""Bytes on the wire and CPU per relayed message: JSON+hex framing vs binary framing.
+
+    python bench/bench_framing.py [iterations]
+"""
+import os, sys, time, uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "client"))
+from modules.crypto_utils import AESHandler
+from modules.session import Session, FRAMINGS
+
+SHAPES = {
+    "short": "ok, see you at 5",
+    "chat": "Did you get a chance to look at the deploy notes from this morning? The rollout looked fine to me.",
+    "1k": "lorem ipsum dolor sit amet " * 38,
+}
+
+def relay_once(sender, server_in, server_out, receiver, sender_id, target_id, text):
+    """client -> server -> client, exactly what a relayed chat message costs"""
+    up = sender.seal({"target": target_id, "text": text})
+    payload = server_in.open(up)
+    down = server_out.seal({"text": payload["text"], "sender": sender_id})
+    receiver.open(down)
+    return len(up), len(down)
+
+def run(iterations):
+    k1, k2 = AESHandler.make(os.urandom(32)), AESHandler.make(os.urandom(32))
+    sender_id, target_id = str(uuid.uuid4()), str(uuid.uuid4())
+    print(f"{'shape':>6} {'framing':>8} {'up B':>6} {'down B':>7} {'us/msg':>8}")
+    for shape, text in SHAPES.items():
+        for name, framing in FRAMINGS.items():
+            a, s1 = Session(k1, framing), Session(k1, framing)
+            s2, b = Session(k2, framing), Session(k2, framing)
+            up, down = relay_once(a, s1, s2, b, sender_id, target_id, text)
+            start = time.perf_counter()
+            for _ in range(iterations):
+                relay_once(a, s1, s2, b, sender_id, target_id, text)
+            us = (time.perf_counter() - start) / iterations * 1e6
+            print(f"{shape:>6} {name:>8} {up:>6} {down:>7} {us:>8.2f}")
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,80 @@
+"""Relay latency between two established clients, before and during a handshake storm.
+
+    python bench/bench_handshake_storm.py --storm 500 --concurrency 200 --config '{"crypto_pool_kind": "process"}'
+"""
+import argparse, asyncio, json, multiprocessing, time
+from common import ServerProcess, BenchClient, make_identity, percentiles
+
+async def storm_clients(url, server_pub, n, concurrency):
+    identity = make_identity()
+    slots = asyncio.Semaphore(concurrency)
+    ok = 0
+
+    async def one():
+        nonlocal ok
+        async with slots:
+            c = BenchClient(url, server_pub, identity)
+            try:
+                await c.connect()
+                ok += 1
+            except Exception:
+                pass
+            finally:
+                await c.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(n)))
+    return ok, time.perf_counter() - start
+
+def storm_worker(url, server_pub, n, concurrency, out):
+    out.put(asyncio.run(storm_clients(url, server_pub, n, concurrency)))
+
+async def measure(a, b, seconds, interval):
+    samples = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        await a.send(b.client_id, repr(time.perf_counter()))
+        _, text = await asyncio.wait_for(b.recv(), 10)
+        samples.append((time.perf_counter() - float(text)) * 1000)
+        await asyncio.sleep(interval)
+    return samples
+
+async def run(args):
+    with ServerProcess(**json.loads(args.config)) as server:
+        identity = make_identity()
+        a = await BenchClient(server.url, server.server_pub, identity).connect()
+        b = await BenchClient(server.url, server.server_pub, identity).connect()
+
+        idle = await measure(a, b, args.seconds, args.interval)
+
+        ctx = multiprocessing.get_context("spawn")
+        out = ctx.Queue()
+        procs = [ctx.Process(target=storm_worker, args=(server.url, server.server_pub, args.storm // args.procs, args.concurrency, out))
+                 for _ in range(args.procs)]
+        for p in procs:
+            p.start()
+        during = []
+        while any(p.is_alive() for p in procs) and out.qsize() < len(procs):
+            during += await measure(a, b, 0.5, args.interval)
+        results = [out.get() for _ in procs]
+        for p in procs:
+            p.join()
+
+        await a.close()
+        await b.close()
+        return {
+            "config": json.loads(args.config),
+            "storm": {"handshakes": sum(r[0] for r in results), "seconds": max(r[1] for r in results)},
+            "relay_ms_idle": {"n": len(idle), **percentiles(idle)},
+            "relay_ms_storm": {"n": len(during), **percentiles(during)},
+        }
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--storm", type=int, default=300, help="handshakes in the storm")
+    ap.add_argument("--procs", type=int, default=2, help="storm client processes")
+    ap.add_argument("--concurrency", type=int, default=100, help="in-flight handshakes per storm process")
+    ap.add_argument("--seconds", type=float, default=2.0, help="idle measurement window")
+    ap.add_argument("--interval", type=float, default=0.01)
+    ap.add_argument("--config", default="{}", help="JSON kwargs for WebSocketServer")
+    print(json.dumps(asyncio.run(run(ap.parse_args())), indent=2))
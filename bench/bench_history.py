@@ -0,0 +1,77 @@
+"""Client history store: writes, scrollback paging and search on a large history.
+
+    python bench/bench_history.py [--messages 200000] [--chats 50]
+
+Fills a scratch MessageStore with --messages messages spread over --chats
+chats, then reports the write rate (batched, one transaction per flush,
+against one transaction per message), the time to load a page of
+scrollback near the newest message and deep in a chat, and search times
+for a rare word, a common word and a two-word query.
+"""
+import argparse, asyncio, os, random, shutil, sys, tempfile, time
+from common import BENCH_DIR
+
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "client"))
+from history import MessageStore
+
+WORDS = "the of and to in is you that it was for on are as with they at be this from have or by one had not but what all".split()
+
+def text(rng, i):
+    words = [rng.choice(WORDS) for _ in range(rng.choice((3, 6, 12, 40)))]
+    if i % 10000 == 0:
+        words.append("zephyr")  # the rare word
+    return "peer: " + " ".join(words)
+
+async def timed(label, n, fn):
+    start = time.perf_counter()
+    for _ in range(n):
+        result = await fn()
+    elapsed = (time.perf_counter() - start) / n
+    rows = len(result[0] if isinstance(result, tuple) else result)
+    print(f"{label:<28} {elapsed * 1e3:>10.2f} ms {rows:>8} rows")
+
+async def main(args):
+    rng = random.Random(5)
+    tmp = tempfile.mkdtemp(prefix="shieldchat-history-")
+    try:
+        store = MessageStore(os.path.join(tmp, "history.db"), os.urandom(32))
+        chats = [f"chat-{i}" for i in range(args.chats)]
+        start = time.perf_counter()
+        for i in range(args.messages):
+            store.add(chats[i % args.chats], text(rng, i), 2)
+            if len(store.pending) >= args.batch:
+                await store.flush()
+        await store.flush()
+        elapsed = time.perf_counter() - start
+        print(f"{'batched writes':<28} {args.messages / elapsed:>10.0f} msg/s")
+
+        n = min(2000, args.messages)
+        start = time.perf_counter()
+        for i in range(n):
+            store.add(chats[0], text(rng, i + 1), 2)
+            await store.flush()
+        print(f"{'one commit per message':<28} {n / (time.perf_counter() - start):>10.0f} msg/s")
+        size = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp))
+        print(f"{'on disk':<28} {size / args.messages:>10.0f} B/msg")
+
+        chat = chats[1]
+        rows, _ = await store.page(chat)
+        await timed("latest page", 20, lambda: store.page(chat))
+        await timed("page before newest", 20, lambda: store.page(chat, before=rows[0][0]))
+        deep = args.messages // 2
+        await timed("page deep in chat", 20, lambda: store.page(chat, before=deep))
+        await timed("page after, deep", 20, lambda: store.page(chat, after=deep))
+        await timed("search rare word", 20, lambda: store.search("zephyr"))
+        await timed("search common word", 20, lambda: store.search("the"))
+        await timed("search two words", 20, lambda: store.search("zephyr the"))
+        await timed("search common, one chat", 20, lambda: store.search("the", chat))
+        await store.close()
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=200000)
+    ap.add_argument("--chats", type=int, default=50)
+    ap.add_argument("--batch", type=int, default=500, help="messages per flush while filling")
+    asyncio.run(main(ap.parse_args()))
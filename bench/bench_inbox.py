@@ -0,0 +1,63 @@
+"""Client inbox cost: storing, re-flowing and showing a busy chat.
+
+    python bench/bench_inbox.py [--messages 20000] [--size 1000]
+
+Compares ChatBuffer (ring of raw messages, wrapped lazily per width) with
+the list of lines wrapped on arrival that the client used to keep: time
+per append, time to re-flow for a narrower terminal (the old list cannot),
+time per bottom-of-chat viewport, and memory held.
+"""
+import argparse, os, random, sys, textwrap, time, tracemalloc
+from common import BENCH_DIR
+
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "client"))
+from inbox import ChatBuffer
+
+WORDS = "the of and to in is you that it was for on are as with they at be this from have or by one had not but what all".split()
+
+def messages(n, seed=3):
+    rng = random.Random(seed)
+    for _ in range(n):
+        yield f"peer: {' '.join(rng.choice(WORDS) for _ in range(rng.choice((3, 6, 12, 40))))}"
+
+def measure(label, store, add, view, args):
+    """add(store, text) per message; view(store, width) -> lines, or None when the store cannot re-flow"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    for text in messages(args.messages):
+        add(store, text)
+    append = (time.perf_counter() - start) / args.messages
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    lines = view(store, args.width - 31)
+    resize = "-" if lines is None else f"{(time.perf_counter() - start) * 1e3:.2f}"
+    if lines is None:
+        lines = view(store, args.width)
+    start = time.perf_counter()
+    for _ in range(1000):
+        lines[len(lines) - args.visible:]
+    frame = (time.perf_counter() - start) / 1000
+    print(f"{label:<10} {append * 1e6:>10.2f} {resize:>10} {frame * 1e6:>10.2f} {memory / 1024:>10.0f} {len(lines):>8}")
+
+def main(args):
+    def add_wrapped(lines, text):
+        lines.extend((line, 2) for line in textwrap.wrap(text, args.width))
+
+    def add_ring(buffer, text):
+        buffer.append(text, 2)
+
+    ring = ChatBuffer(args.size)
+    ring.lines(args.width)
+    print(f"{'store':<10} {'append us':>10} {'resize ms':>10} {'view us':>10} {'KiB held':>10} {'lines':>8}")
+    # Lines wrapped on arrival cannot be re-flowed: the raw text is gone
+    measure("wrapped", [], add_wrapped, lambda lines, width: lines if width == args.width else None, args)
+    measure("ring", ring, add_ring, lambda buffer, width: buffer.lines(width), args)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=20000)
+    ap.add_argument("--size", type=int, default=1000, help="ChatBuffer size (INBOX_SIZE)")
+    ap.add_argument("--width", type=int, default=112, help="text width before the resize")
+    ap.add_argument("--visible", type=int, default=33, help="viewport rows")
+    main(ap.parse_args())
@@ -0,0 +1,74 @@
+"""Presence pushes during a mass reconnect, with and without coalescing.
+
+    python bench/bench_presence.py [--clients 2000,10000] [--contacts 50] [--window 0.5]
+
+Every client watches --contacts random others. All of them drop and come
+back one after another over --spread seconds (a server restart, a network
+blip), then the bench waits for the last window to close. "immediate"
+pushes each change to every watcher as it happens (PRESENCE_WINDOW = 0),
+"coalesced" collects changes over --window. Reports the payloads pushed,
+per client, and the server time spent sealing and queueing them.
+"""
+import argparse, asyncio, os, random, sys, tempfile, time, types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from main import WebSocketServer
+from modules.crypto_utils import AESHandler
+from modules.session import Session, BinaryFraming
+
+class NullQueue:
+    def put(self, frame):
+        pass
+
+def make_server(clients, contacts, window):
+    server = WebSocketServer("127.0.0.1", 0, None, 15, client_keys_file=os.path.join(tempfile.mkdtemp(), "keys.json"),
+                             metrics_port=None, log_level="off", presence_window=window)
+    conns = {f"client-{i}": types.SimpleNamespace(session=Session(AESHandler.make(os.urandom(32)), BinaryFraming), outbound=NullQueue())
+             for i in range(clients)}
+    server.clients_map.update(conns)
+    rng = random.Random(7)
+    ids = list(conns)
+    for cid in ids:
+        server.presence.subscribe(cid, rng.sample(ids, contacts))
+    return server, conns
+
+async def run(clients, contacts, window, spread):
+    server, conns = make_server(clients, contacts, window)
+    ids = list(conns)
+    busy = 0.0
+    step = spread / clients
+    for cid in ids:
+        start = time.perf_counter()
+        del server.clients_map[cid]
+        server.presence.changed(cid, False)
+        busy += time.perf_counter() - start
+        await asyncio.sleep(0)
+    for cid in ids:
+        start = time.perf_counter()
+        server.clients_map[cid] = conns[cid]
+        server.presence.changed(cid, True)
+        busy += time.perf_counter() - start
+        await asyncio.sleep(step)
+    # What the last window still holds
+    start = time.perf_counter()
+    server.presence.flush()
+    busy += time.perf_counter() - start
+    pushed = server.metrics.presence_pushed.value
+    server.presence.close()
+    server.crypto_pool.shutdown()
+    return pushed, busy
+
+async def main(args):
+    print(f"{'clients':>8} {'mode':<10} {'pushed':>10} {'per client':>11} {'server ms':>10}")
+    for clients in args.clients:
+        for mode, window in (("immediate", 0), ("coalesced", args.window)):
+            pushed, busy = await run(clients, args.contacts, window, args.spread)
+            print(f"{clients:>8} {mode:<10} {pushed:>10.0f} {pushed / clients:>11.1f} {busy * 1e3:>10.1f}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=lambda s: [int(x) for x in s.split(",")], default=[2000, 10000])
+    ap.add_argument("--contacts", type=int, default=50, help="clients each client watches")
+    ap.add_argument("--window", type=float, default=0.5, help="PRESENCE_WINDOW for the coalesced run")
+    ap.add_argument("--spread", type=float, default=2.0, help="seconds over which the clients come back")
+    asyncio.run(main(ap.parse_args()))
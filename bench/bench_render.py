@@ -0,0 +1,118 @@
+"""Terminal output of the curses client per incoming message.
+
+    python bench/bench_render.py [--rows 40 --cols 120] [--messages 200] [--burst 2000]
+
+Runs client/main.py's ClientApp in a pseudo-terminal with a chat open and
+feeds messages into its inbox (no server involved), then counts the bytes
+curses wrote to the terminal. "trickle" delivers them --interval apart,
+so each gets its own frame; "burst" delivers them all at once; "scrolled"
+is a trickle while the user has scrolled back to the middle of the chat,
+which should cost nothing.
+"""
+import argparse, asyncio, fcntl, json, os, pty, select, struct, sys, tempfile, termios
+from common import BENCH_DIR
+
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "client"))
+PEER = "00000000-0000-4000-8000-000000000001"
+
+def child(args, marks):
+    import curses
+    from main import ClientApp
+
+    fcntl.ioctl(0, termios.TIOCSWINSZ, struct.pack("HHHH", args.rows, args.cols, 0, 0))
+    os.chdir(tempfile.mkdtemp(prefix="shieldchat-render-"))
+
+    def mark(phase, n):
+        os.write(marks, f"{phase} {n}\n".encode())
+
+    async def feed(app, n, interval):
+        for i in range(n):
+            app.client.inbox.put_nowait((PEER, f"message {i}: " + "lorem ipsum dolor sit amet " * (1 + i % 4), None))
+            await asyncio.sleep(interval)
+        await asyncio.sleep(0.3)
+
+    async def scenario(app):
+        app.contacts[PEER] = "peer"
+        app.selected_chat = PEER
+        app.display(prompt=True)
+        receiver = asyncio.create_task(app.receive_messages())
+        await asyncio.sleep(0.3)
+        mark("setup", 1)
+        await feed(app, args.messages, args.interval)
+        mark("trickle", args.messages)
+        await feed(app, args.burst, 0)
+        mark("burst", args.burst)
+        app.scroll_offset = len(app.inbox[PEER].lines(app.renderer.text_width())) // 2
+        app.display()
+        await asyncio.sleep(0.3)
+        mark("scroll", 1)
+        await feed(app, args.messages, args.interval)
+        mark("scrolled", args.messages)
+        receiver.cancel()
+        os.write(marks, (json.dumps(app.renderer.stats) + "\n").encode())
+
+    def run(stdscr):
+        asyncio.run(scenario(ClientApp(stdscr)))
+
+    os.environ["TERM"] = args.term
+    curses.wrapper(run)
+
+def main(args):
+    marks_r, marks_w = os.pipe()
+    pid, master = pty.fork()
+    if pid == 0:
+        os.close(marks_r)
+        try:
+            child(args, marks_w)
+        finally:
+            os._exit(0)
+    os.close(marks_w)
+    written = 0
+    pending = b""
+    results = []
+    open_fds = {master, marks_r}
+    while open_fds:
+        ready, _, _ = select.select(list(open_fds), [], [], 30)
+        if not ready:
+            break
+        if master in ready:
+            try:
+                data = os.read(master, 65536)
+            except OSError:
+                data = b""
+            written += len(data)
+            if not data:
+                open_fds.discard(master)
+        if marks_r in ready:
+            # Everything written before the mark is already readable on the master
+            while select.select([master], [], [], 0)[0] and master in open_fds:
+                data = os.read(master, 65536)
+                written += len(data)
+                if not data:
+                    break
+            chunk = os.read(marks_r, 4096)
+            if not chunk:
+                open_fds.discard(marks_r)
+            pending += chunk
+            while b"\n" in pending:
+                line, pending = pending.split(b"\n", 1)
+                results.append((line.decode(), written))
+                written = 0
+    os.waitpid(pid, 0)
+    print(f"{'phase':<10} {'messages':>8} {'bytes':>9} {'bytes/msg':>10}")
+    for line, nbytes in results:
+        if line.startswith("{"):
+            print("renderer:", line)
+            continue
+        phase, n = line.split()
+        print(f"{phase:<10} {n:>8} {nbytes:>9} {nbytes / int(n):>10.1f}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=40)
+    ap.add_argument("--cols", type=int, default=120)
+    ap.add_argument("--messages", type=int, default=200, help="messages per trickle phase")
+    ap.add_argument("--interval", type=float, default=0.02, help="seconds between trickled messages")
+    ap.add_argument("--burst", type=int, default=2000, help="messages delivered at once")
+    ap.add_argument("--term", default="xterm-256color")
+    main(ap.parse_args())
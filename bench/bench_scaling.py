@@ -0,0 +1,66 @@
+"""Relay throughput (messages/sec) as the server scales from 1 to N worker processes.
+
+    python bench/bench_scaling.py --max-workers 4 --loaders 4 --pairs 16 --messages 2000
+"""
+import argparse, asyncio, json, multiprocessing, time
+from common import ServerProcess, BenchClient, make_identity
+
+async def load(url, server_pub, pairs, messages, size, start_at):
+    identity = make_identity()
+    clients = [await BenchClient(url, server_pub, identity).connect() for _ in range(pairs * 2)]
+    senders, receivers = clients[::2], clients[1::2]
+    text = "x" * size
+    await asyncio.sleep(max(0, start_at - time.time()))
+
+    async def blast(a, b):
+        for _ in range(messages):
+            await a.send(b.client_id, text)
+
+    async def drain(b):
+        got = 0
+        try:
+            while got < messages:
+                await asyncio.wait_for(b.recv(), 5)
+                got += 1
+        except asyncio.TimeoutError:
+            pass
+        return got
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(blast(a, b) for a, b in zip(senders, receivers)),
+                                   *(drain(b) for b in receivers))
+    elapsed = time.perf_counter() - start
+    for c in clients:
+        await c.close()
+    return sum(r for r in results if r), elapsed
+
+def loader(url, server_pub, pairs, messages, size, start_at, out):
+    out.put(asyncio.run(load(url, server_pub, pairs, messages, size, start_at)))
+
+def run_point(workers, args):
+    with ServerProcess(workers=workers) as server:
+        time.sleep(0.5)
+        ctx = multiprocessing.get_context("spawn")
+        out = ctx.Queue()
+        start_at = time.time() + 3 + 0.2 * args.pairs
+        procs = [ctx.Process(target=loader, args=(server.url, server.server_pub, args.pairs, args.messages, args.size, start_at, out))
+                 for _ in range(args.loaders)]
+        for p in procs:
+            p.start()
+        results = [out.get() for _ in procs]
+        for p in procs:
+            p.join()
+    received = sum(r[0] for r in results)
+    elapsed = max(r[1] for r in results)
+    return {"workers": workers, "received": received, "expected": args.loaders * args.pairs * args.messages,
+            "seconds": round(elapsed, 3), "msgs_per_sec": round(received / elapsed)}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--max-workers", type=int, default=multiprocessing.cpu_count())
+    ap.add_argument("--loaders", type=int, default=2, help="client processes generating load")
+    ap.add_argument("--pairs", type=int, default=8, help="sender/receiver pairs per loader")
+    ap.add_argument("--messages", type=int, default=1000, help="messages per sender")
+    ap.add_argument("--size", type=int, default=64, help="message text bytes")
+    args = ap.parse_args()
+    print(json.dumps([run_point(n, args) for n in range(1, args.max_workers + 1)], indent=2))
@@ -0,0 +1,85 @@
+"""Client startup cost: importing the client, loading an identity, and connecting, per key type.
+
+    python bench/bench_startup.py [--clients 200] [--iterations 200]
+
+"import" times `import connection` in a fresh interpreter and scratch
+storage directory (no key is generated there any more). The identity table
+times generating a key, loading it from disk, and the signatures of a full
+handshake on both ends. The connect table opens --clients connections one
+after another against a scratch server, either sharing one identity or,
+with "fresh", generating one per client the way a first run does.
+"""
+import argparse, asyncio, json, os, shutil, subprocess, sys, tempfile, time
+from common import ServerProcess, BenchClient, make_identity, BENCH_DIR
+from modules.keys import Identity
+from modules.crypto_utils import signer
+
+CLIENT_DIR = os.path.join(BENCH_DIR, "..", "client")
+KINDS = ("rsa", "ed25519")
+
+def import_time(runs):
+    """Seconds for `import connection`, median of runs, and whether it wrote anything"""
+    times, wrote = [], False
+    for _ in range(runs):
+        scratch = tempfile.mkdtemp(prefix="shieldchat-import-")
+        try:
+            code = "import time; t = time.perf_counter(); import connection; print(time.perf_counter() - t)"
+            out = subprocess.run([sys.executable, "-c", code], cwd=scratch, env={**os.environ, "PYTHONPATH": CLIENT_DIR},
+                                 capture_output=True, text=True, check=True).stdout
+            times.append(float(out))
+            wrote = wrote or bool(os.listdir(scratch))
+        finally:
+            shutil.rmtree(scratch)
+    return sorted(times)[len(times) // 2], wrote
+
+def timed(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+def identity_costs(kind, iterations):
+    key_dir = tempfile.mkdtemp(prefix="shieldchat-keys-")
+    try:
+        generate = timed(lambda: Identity.generate(kind).priv, max(1, iterations // 20 if kind == "rsa" else iterations))
+        Identity(key_dir, kind).priv
+        load = timed(lambda: Identity(key_dir, kind).priv, iterations)
+        identity = Identity(key_dir, kind)
+        pub = identity.priv.public_key()
+        sig = identity.sign(b"challenge")
+        sign = timed(lambda: identity.sign(b"challenge"), iterations)
+        verify = timed(lambda: signer(pub).verify(pub, b"challenge", sig), iterations)
+        return {"generate_ms": generate * 1e3, "load_ms": load * 1e3, "sign_us": sign * 1e6, "verify_us": verify * 1e6,
+                "pub_pem_bytes": len(identity.pub_pem)}
+    finally:
+        shutil.rmtree(key_dir)
+
+async def connect_rate(server, kind, clients, fresh):
+    shared = make_identity(kind)
+    start = time.perf_counter()
+    for _ in range(clients):
+        c = await BenchClient(server.url, server.server_pub, make_identity(kind) if fresh else shared).connect()
+        await c.close()
+    return clients / (time.perf_counter() - start)
+
+async def run(args):
+    median, wrote = import_time(args.imports)
+    print(f"import connection: {median * 1e3:.1f} ms (median of {args.imports}), wrote files: {wrote}")
+    print(f"\n{'identity':<8} {'generate ms':>12} {'load ms':>8} {'sign us':>8} {'verify us':>10} {'pub PEM':>8}")
+    for kind in KINDS:
+        r = identity_costs(kind, args.iterations)
+        print(f"{kind:<8} {r['generate_ms']:>12.2f} {r['load_ms']:>8.3f} {r['sign_us']:>8.1f} {r['verify_us']:>10.1f} {r['pub_pem_bytes']:>8}")
+    print(f"\n{'identity':<8} {'keys':<7} {'connects/s':>10}")
+    with ServerProcess(**json.loads(args.config)) as server:
+        for kind in KINDS:
+            for fresh in (False, True):
+                rate = await connect_rate(server, kind, args.clients, fresh)
+                print(f"{kind:<8} {'fresh' if fresh else 'shared':<7} {rate:>10.1f}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=200, help="sequential connections per row")
+    ap.add_argument("--iterations", type=int, default=200)
+    ap.add_argument("--imports", type=int, default=5, help="fresh interpreters to time the import in")
+    ap.add_argument("--config", default="{}", help="JSON kwargs for WebSocketServer")
+    asyncio.run(run(ap.parse_args()))
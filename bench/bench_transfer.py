@@ -0,0 +1,40 @@
+"""File transfer throughput through the relay, per chunk size and window.
+
+    python bench/bench_transfer.py --mb 64 --chunks 16384,65536,262144 --windows 8,32
+"""
+import argparse, asyncio, filecmp, json, os, tempfile, time
+from common import ServerProcess, BenchClient, make_identity
+
+async def transfer(server, identity, path, chunk, window):
+    a = await BenchClient(server.url, server.server_pub, identity).connect()
+    b = await BenchClient(server.url, server.server_pub, identity).connect()
+    a.transfers.chunk_size, a.transfers.window = chunk, window
+    start = time.perf_counter()
+    await a.send_file(path, b.client_id)
+    _, received = await asyncio.wait_for(b.received_files.get(), 60)
+    elapsed = time.perf_counter() - start
+    ok = filecmp.cmp(path, received, shallow=False)
+    os.remove(received)
+    await a.close()
+    await b.close()
+    size = os.path.getsize(path)
+    return {"chunk": chunk, "window": window, "bytes": size, "seconds": round(elapsed, 3),
+            "mb_per_sec": round(size / elapsed / 1e6, 1), "intact": ok}
+
+async def run(args):
+    path = os.path.join(tempfile.mkdtemp(), "payload.bin")
+    with open(path, "wb") as f:
+        for _ in range(args.mb):
+            f.write(os.urandom(1024 * 1024))
+    with ServerProcess() as server:
+        identity = make_identity()
+        results = [await transfer(server, identity, path, c, w) for c in args.chunks for w in args.windows]
+        relay = {k: v for k, v in server.scrape().items() if k.startswith(("shieldchat_frames", "shieldchat_bytes", "shieldchat_deliveries"))}
+        return {"results": results, "server": relay}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mb", type=int, default=32, help="file size in MiB")
+    ap.add_argument("--chunks", type=lambda s: [int(x) for x in s.split(",")], default=[16384, 65536, 262144])
+    ap.add_argument("--windows", type=lambda s: [int(x) for x in s.split(",")], default=[8, 32])
+    print(json.dumps(asyncio.run(run(ap.parse_args())), indent=2))
@@ -0,0 +1,216 @@
+"""Shared helpers for the benchmarks: a scratch server process and a headless client."""
+import asyncio, json, os, socket, subprocess, sys, tempfile, time, uuid
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "client"))
+
+from channel import Channel
+from transfer import Transfers
+from modules.keys import Identity
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class ServerProcess:
+    """server/main.py running in its own process and scratch storage directory"""
+
+    def __init__(self, port=None, workdir=None, **config):
+        self.port = port or free_port()
+        self.workdir = workdir or tempfile.mkdtemp(prefix="shieldchat-bench-")
+        self.config = config
+        self.config.setdefault("metrics_port", free_port())
+        # Every bench client comes from one IP and some send as fast as they can
+        for limit in ("max_connections", "max_pending_handshakes", "ip_connect_rate", "client_message_rate", "client_byte_rate"):
+            self.config.setdefault(limit, None)
+        self.proc = None
+        self.server_pub = None
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self.port}"
+
+    def start(self, timeout=20):
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.join(BENCH_DIR, "serve.py"), "--dir", self.workdir,
+             "--port", str(self.port), "--config", json.dumps(self.config)],
+            stdout=subprocess.DEVNULL
+        )
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), 0.2).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            self.stop()
+            raise RuntimeError("Server did not start")
+        with open(os.path.join(self.workdir, "storage", "keys", "rsa_public.pem"), "rb") as f:
+            self.server_pub = f.read()
+        return self
+
+    def pids(self):
+        """The server process and its workers"""
+        parents = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        parents.setdefault(int(f.read().rsplit(")", 1)[1].split()[1]), []).append(int(entry))
+                except OSError:
+                    pass
+        pids, todo = [], [self.proc.pid]
+        while todo:
+            pid = todo.pop()
+            pids.append(pid)
+            todo += parents.get(pid, [])
+        return pids
+
+    def rss_kb(self):
+        """Resident memory summed over the server process tree"""
+        total = 0
+        for pid in self.pids():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    total += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+            except (OSError, StopIteration):
+                pass
+        return total
+
+    def scrape(self):
+        """Metrics from every worker's /metrics endpoint, identical samples summed"""
+        import urllib.request
+        samples = {}
+        for worker in range(self.config.get("workers", 1)):
+            url = f"http://127.0.0.1:{self.config['metrics_port'] + worker}/metrics"
+            with urllib.request.urlopen(url, timeout=5) as response:
+                for line in response.read().decode().splitlines():
+                    if line and not line.startswith("#"):
+                        sample, value = line.rsplit(" ", 1)
+                        samples[sample] = samples.get(sample, 0) + float(value)
+        return samples
+
+    def stop(self):
+        if self.proc:
+            self.proc.terminate()
+            self.proc.wait()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def raise_nofile():
+    """Thousands of sockets need more than the usual 1024 descriptors"""
+    import resource
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def make_identity(kind="rsa"):
+    """In-memory client identity; share one across clients to skip key generation"""
+    return Identity.generate(kind)
+
+READY = "\0ready"
+
+class BenchClient:
+    """Headless equivalent of client/connection.py's ClientConnection"""
+
+    def __init__(self, url, server_pub, identity, client_id=None, framings=("binary", "json"), batch_window=None, batch_size=64, download_dir=None):
+        self.url = url
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.server_pub = server_pub
+        self.identity = identity
+        self.client_id = client_id or str(uuid.uuid4())
+        self.framings = framings
+        self.ws = None
+        self.channel = None
+        self.inbox = asyncio.Queue()
+        self.receive_task = None
+        self.ready = asyncio.Event()
+        self.ticket = None
+        self.group_events = asyncio.Queue()
+        self.download_dir = download_dir or tempfile.mkdtemp(prefix="bench-dl-")
+        self.transfers = None
+        self.received_files = asyncio.Queue()
+
+    async def connect(self, resume=False):
+        """Full handshake, or ticket resumption when resume is set and we hold a ticket"""
+        ticket, self.ticket = (self.ticket if resume else None), None
+        self.ready.clear()
+        self.channel = Channel(None, self.server_pub, self.framings, ticket=ticket, batch_window=self.batch_window, batch_size=self.batch_size)
+        self.ws = await self.channel.connect(self.url, max_queue=None)
+        if not self.channel.resumed:
+            await self.authenticate()
+        self.transfers = Transfers(self.channel, self.download_dir, on_received=lambda sender, path: self.received_files.put_nowait((sender, path)),
+                                   accept=lambda sender, offer: True)
+        self.receive_task = asyncio.create_task(self.channel.receive_loop(self.on_message, lambda: None, self.transfers.on_chunk))
+        # The server registers us only after checking the challenge; a self-echo confirms we are routable
+        await self.send(self.client_id, READY)
+        await self.ready.wait()
+        return self
+
+    async def authenticate(self):
+        sig = self.identity.sign_id(self.client_id)
+        await self.channel.send_now({"client_id": self.client_id, "signature": sig.hex(), "pub_key": self.identity.pub_pem,
+                                     "features": ["batch", "resume", "files"]})
+        challenge = bytes.fromhex((await self.channel.recv_bytes()).decode())
+        await self.channel.send_bytes(self.identity.sign(challenge).hex().encode())
+
+    def on_message(self, payload):
+        if payload.get("type") == "batch":
+            for item in payload["items"]:
+                self.on_message(item)
+            return
+        if payload.get("type") == "ticket":
+            self.ticket = payload
+            return
+        if payload.get("type") == "file":
+            self.transfers.on_control(payload)
+            return
+        if payload.get("type") == "group":
+            self.group_events.put_nowait(payload)
+            return
+        if payload.get("sender") == self.client_id and payload.get("text") == READY:
+            self.ready.set()
+            return
+        self.inbox.put_nowait((payload.get("sender"), payload.get("text")))
+
+    async def send(self, target_id, text):
+        await self.channel.send({"target": target_id, "text": text})
+
+    async def send_many(self, target_ids, text):
+        await self.channel.send({"targets": list(target_ids), "text": text})
+
+    async def join(self, group_id):
+        """Join and wait for the server's answer"""
+        await self.channel.send({"type": "join", "group": group_id})
+        return await self.group_events.get()
+
+    async def send_group(self, group_id, text):
+        await self.channel.send({"group": group_id, "text": text})
+
+    async def send_file(self, path, target_id):
+        return await self.transfers.send_file(path, target_id)
+
+    async def recv(self):
+        return await self.inbox.get()
+
+    async def close(self):
+        if self.channel and self.ws:
+            try: await self.channel.flush()
+            except Exception: pass
+        if self.receive_task:
+            self.receive_task.cancel()
+        if self.ws:
+            await self.ws.close()
+
+def percentiles(samples, points=(50, 99, 99.9)):
+    if not samples:
+        return {f"p{p:g}": None for p in points}
+    ordered = sorted(samples)
+    return {f"p{p:g}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
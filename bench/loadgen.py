@@ -0,0 +1,227 @@
+"""Load generator: thousands of real clients against a local server, results as JSON.
+
+    python bench/loadgen.py --clients 2000 --procs 4 --sizes 64,1024 --pattern fanout --fanout 4 --out results.json
+    python bench/loadgen.py --url ws://127.0.0.1:8765 --server-pub server/storage/keys/rsa_public.pem
+
+Every client does the full handshake (plus a ticket resumption with --resume),
+then all clients send for --seconds per message size. Reports handshake rate,
+relay throughput, p50/p99/p99.9 end-to-end latency and server RSS.
+"""
+import argparse, asyncio, json, multiprocessing, os, platform, queue, random, subprocess, time, uuid
+from common import ServerProcess, BenchClient, make_identity, percentiles, raise_nofile
+
+PATTERNS = ("pairs", "ring", "random", "fanout")
+
+def targets_for(pattern, index, total, fanout):
+    """Who client `index` sends each message to"""
+    if pattern == "pairs":
+        return [index ^ 1 if index ^ 1 < total else index - 1]
+    if pattern == "ring":
+        return [(index + 1) % total]
+    if pattern == "random":
+        other = random.randrange(total - 1)
+        return [other + (other >= index)]
+    return [(index + k) % total for k in range(1, min(fanout, total - 1) + 1)]
+
+async def connect_all(clients, concurrency, resume=False):
+    slots = asyncio.Semaphore(concurrency)
+    times = []
+
+    async def one(client):
+        async with slots:
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(client.connect(resume=resume), 60)
+            except Exception:
+                return False
+            times.append((time.perf_counter() - start) * 1000)
+            return True
+
+    start = time.time()
+    ok = await asyncio.gather(*(one(c) for c in clients))
+    return {"ok": sum(ok), "failed": len(ok) - sum(ok), "start": start, "end": time.time(), "ms": times}
+
+async def run_phases(clients, indices, ids, args, start_at):
+    """Send for args.seconds per size; receive until the drain window of each phase closes"""
+    window = args.seconds + args.drain
+    stats = [{"sent": 0, "expected": 0, "received": 0, "bytes": 0, "ms": []} for _ in args.sizes]
+
+    async def receiver(client):
+        while True:
+            _, text = await client.recv()
+            now = time.time()
+            phase, sent_at, _ = text.split("|", 2)
+            entry = stats[int(phase)]
+            entry["received"] += 1
+            entry["bytes"] += len(text)
+            entry["ms"].append((now - float(sent_at)) * 1000)
+
+    async def sender(client, index, phase, size, deadline):
+        interval = 1 / args.rate if args.rate else 0
+        entry = stats[phase]
+        while time.time() < deadline:
+            text = f"{phase}|{time.time():.6f}|"
+            text += "x" * max(0, size - len(text))
+            targets = targets_for(args.pattern, index, len(ids), args.fanout)
+            if args.multi:
+                await client.send_many([ids[t] for t in targets], text)
+            else:
+                for target in targets:
+                    await client.send(ids[target], text)
+            entry["expected"] += len(targets)
+            entry["sent"] += 1
+            await asyncio.sleep(interval)
+
+    receivers = [asyncio.create_task(receiver(c)) for c in clients if c.ready.is_set()]
+    for phase, size in enumerate(args.sizes):
+        begin = start_at + phase * window
+        await asyncio.sleep(max(0, begin - time.time()))
+        await asyncio.gather(*(sender(c, i, phase, size, begin + args.seconds) for c, i in zip(clients, indices) if c.ready.is_set()),
+                             return_exceptions=True)
+    await asyncio.sleep(max(0, start_at + len(args.sizes) * window - time.time()))
+    for task in receivers:
+        task.cancel()
+    return stats
+
+async def worker_main(url, server_pub, ids, indices, args, go, out):
+    raise_nofile()
+    identity = make_identity(args.identity)
+    clients = [BenchClient(url, server_pub, identity, ids[i]) for i in indices]
+    report = {"handshake": await connect_all(clients, args.connect_concurrency)}
+    if args.resume:
+        for c in clients:
+            await c.close()
+        await asyncio.sleep(1)
+        report["resume"] = await connect_all(clients, args.connect_concurrency, resume=True)
+        report["resumed"] = sum(1 for c in clients if c.ready.is_set() and c.channel.resumed)
+    out.put(report)
+    start_at = await asyncio.get_running_loop().run_in_executor(None, go.get)
+    report = await run_phases(clients, indices, ids, args, start_at)
+    for c in clients:
+        await c.close()
+    out.put(report)
+
+def worker(url, server_pub, ids, indices, args, go, out):
+    asyncio.run(worker_main(url, server_pub, ids, indices, args, go, out))
+
+def summarize_connects(reports):
+    ms = [t for r in reports for t in r["ms"]]
+    ok = sum(r["ok"] for r in reports)
+    seconds = max(r["end"] for r in reports) - min(r["start"] for r in reports)
+    return {"ok": ok, "failed": sum(r["failed"] for r in reports), "seconds": round(seconds, 3),
+            "per_sec": round(ok / seconds, 1) if seconds else None, "ms": {k: v and round(v, 2) for k, v in percentiles(ms).items()}}
+
+def summarize_phase(size, entries, args):
+    ms = [t for e in entries for t in e["ms"]]
+    received = sum(e["received"] for e in entries)
+    expected = sum(e["expected"] for e in entries)
+    return {"size": size, "sent": sum(e["sent"] for e in entries), "expected": expected, "received": received,
+            "lost": expected - received, "msgs_per_sec": round(received / args.seconds, 1),
+            "mb_per_sec": round(sum(e["bytes"] for e in entries) / args.seconds / 1e6, 3),
+            "latency_ms": {k: v and round(v, 2) for k, v in percentiles(ms).items()}}
+
+def summarize_metrics(samples):
+    """The server's own view: handshake phase means and error counters"""
+    phases = {}
+    for phase in ("rsa", "x25519", "io"):
+        count = samples.get(f'shieldchat_handshake_phase_seconds_count{{phase="{phase}"}}', 0)
+        total = samples.get(f'shieldchat_handshake_phase_seconds_sum{{phase="{phase}"}}', 0)
+        phases[phase] = round(total / count * 1000, 3) if count else None
+    return {"handshake_phase_mean_ms": phases,
+            **{name: samples.get(f"shieldchat_{name}_total", 0) for name in ("handshake_failures", "decrypt_failures", "replay_rejections")},
+            "deliveries": {route: samples.get(f'shieldchat_deliveries_total{{route="{route}"}}', 0) for route in ("local", "forwarded", "mailbox", "dropped")},
+            "outbound_dropped": samples.get("shieldchat_outbound_dropped", 0)}
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args, url, server_pub, server=None):
+    run_id = uuid.uuid4().hex[:8]
+    ids = [f"loadgen-{run_id}-{i}" for i in range(args.clients)]
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    gos = [ctx.Queue() for _ in range(args.procs)]
+    procs = [ctx.Process(target=worker, args=(url, server_pub, ids, list(range(p, args.clients, args.procs)), args, gos[p], out))
+             for p in range(args.procs)]
+    for p in procs:
+        p.start()
+    rss = []
+
+    def collect():
+        reports = []
+        while len(reports) < len(procs):
+            try:
+                reports.append(out.get(timeout=0.5))
+            except queue.Empty:
+                pass
+            if server:
+                rss.append(server.rss_kb())
+            if any(p.exitcode for p in procs):
+                raise RuntimeError("A load generator process died")
+        return reports
+
+    ready = collect()
+    rss_connected = server.rss_kb() if server else None
+    start_at = time.time() + 1
+    for go in gos:
+        go.put(start_at)
+    done = collect()
+    for p in procs:
+        p.join()
+
+    result = {
+        "meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git": git_revision(), "python": platform.python_version(),
+                 "cpus": os.cpu_count(), "args": {k: v for k, v in vars(args).items() if k not in ("out",)}},
+        "handshake": summarize_connects([r["handshake"] for r in ready]),
+        "phases": [summarize_phase(size, [d[i] for d in done], args) for i, size in enumerate(args.sizes)],
+    }
+    if args.resume:
+        result["resume"] = {**summarize_connects([r["resume"] for r in ready]), "resumed": sum(r["resumed"] for r in ready)}
+    if server:
+        result["server_rss_kb"] = {"connected": rss_connected, "peak": max(rss, default=None), "end": server.rss_kb()}
+        result["server_metrics"] = summarize_metrics(server.scrape())
+    return result
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=1000)
+    ap.add_argument("--procs", type=int, default=max(1, multiprocessing.cpu_count()), help="load generator processes")
+    ap.add_argument("--connect-concurrency", type=int, default=50, help="in-flight handshakes per process")
+    ap.add_argument("--identity", choices=("rsa", "ed25519"), default="rsa", help="client key type")
+    ap.add_argument("--resume", action="store_true", help="also reconnect every client with its session ticket")
+    ap.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[64], help="message text bytes, one phase each")
+    ap.add_argument("--pattern", choices=PATTERNS, default="pairs")
+    ap.add_argument("--fanout", type=int, default=4, help="recipients per message with --pattern fanout")
+    ap.add_argument("--multi", action="store_true", help="send each message as one multi-target frame")
+    ap.add_argument("--rate", type=float, default=5, help="messages/sec per client, 0 for as fast as possible")
+    ap.add_argument("--seconds", type=float, default=10, help="send window per phase")
+    ap.add_argument("--drain", type=float, default=3, help="extra receive time after each send window")
+    ap.add_argument("--url", help="use a running server instead of starting one")
+    ap.add_argument("--server-pub", help="server RSA public key PEM, with --url")
+    ap.add_argument("--config", default="{}", help="JSON kwargs for WebSocketServer, plus \"workers\"")
+    ap.add_argument("--out", help="write the JSON here as well as to stdout")
+    args = ap.parse_args()
+    if args.pattern == "pairs" and args.clients % 2:
+        ap.error("--pattern pairs needs an even --clients")
+
+    if args.url:
+        if not args.server_pub:
+            ap.error("--url needs --server-pub")
+        with open(args.server_pub, "rb") as f:
+            result = run(args, args.url, f.read())
+    else:
+        raise_nofile()
+        with ServerProcess(**json.loads(args.config)) as server:
+            time.sleep(0.5)
+            result = run(args, server.url, server.server_pub, server)
+        result["server_config"] = json.loads(args.config)
+
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
@@ -0,0 +1,35 @@
+"""Run server/main.py in a scratch directory for benchmarks.
+
+    python bench/serve.py --dir /tmp/run --port 8765 --config '{"workers": 4, "max_concurrent_handshakes": 32}'
+"""
+import argparse, json, os, resource, sys
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dir", required=True)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--config", default="{}", help="JSON kwargs for WebSocketServer, plus \"workers\"")
+    args = ap.parse_args()
+
+    # common.py puts the client package on sys.path, so raise the fd limit here directly
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    sys.path.insert(0, os.path.abspath(SERVER_DIR))
+    os.makedirs(args.dir, exist_ok=True)
+    os.chdir(args.dir)
+    import main
+    from modules.keys import RSAKey
+
+    config = json.loads(args.config)
+    main.run(
+        config.pop("workers", 1),
+        server_rsa=RSAKey(main.KEY_DIR),
+        host=args.host,
+        port=args.port,
+        keepalive=main.KEEPALIVE_INTERVAL,
+        **config
+    )
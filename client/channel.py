@@ -1,37 +1,134 @@
-import json
+import asyncio, logging, websockets
 from modules.keys import ServerRSA
-from modules.protocol import Handshake
-from modules.crypto_utils import AESHandler
+from modules.protocol import Handshake, RESUME_HEADER
+from modules.session import is_chunk, REKEY_FRAMES, REKEY_SECONDS
+from modules.compression import CODECS
+
+log = logging.getLogger("shieldchat.channel")
 
 class Channel:
-    def __init__(self, ws, server_pub):
+    """Encrypted websocket to the server.
+
+    With a batch_window (seconds), send() coalesces payloads: they are held
+    until the window closes or batch_size are pending, then sealed together
+    as one {"type": "batch"} frame. Larger windows trade latency for
+    throughput. Only used when the server announces "batch" support.
+
+    compression lists the codecs we accept, most preferred first; payloads are
+    compressed before sealing, so websocket-level deflate (which would only
+    see ciphertext) is not offered. nonces lists the nonce modes we accept;
+    under "ratchet" our sending key is replaced in-session every rekey_frames
+    frames or rekey_seconds, whichever comes first.
+    """
+
+    def __init__(self, ws, server_pub, framings=("binary", "json"), ticket=None, batch_window=None, batch_size=64,
+                 compression=tuple(CODECS), nonces=("ratchet", "counter"),
+                 rekey_frames=REKEY_FRAMES, rekey_seconds=REKEY_SECONDS):
         self.ws = ws
         self.server_rsa = ServerRSA(server_pub)
-        self.aesgcm = None
+        self.framings = framings
+        self.ticket = ticket
+        self.session = None
+        self.resumed = False
+        self.server_features = set()
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.compression = compression
+        self.nonces = nonces
+        self.rekey_frames = rekey_frames
+        self.rekey_seconds = rekey_seconds
+        self.pending = []
+        self.flush_task = None
 
-    async def handshake(self):
-        handshake = Handshake(
+    def make_handshake(self):
+        return Handshake(
             self.ws,
             rsa_priv=None,
             rsa_pub=None,
             peer_rsa_pub=self.server_rsa.get_pub(),
-            is_server=False
+            is_server=False,
+            framings=self.framings,
+            ticket=self.ticket,
+            compression=self.compression,
+            nonces=self.nonces,
+            rekey_frames=self.rekey_frames,
+            rekey_seconds=self.rekey_seconds
         )
-        self.aesgcm = await handshake.run()
 
-    async def send(self, text):
-        nonce, ct = AESHandler.encrypt(self.aesgcm, text)
-        await self.ws.send(json.dumps({"nonce": nonce.hex(), "ciphertext": ct.hex()}))
+    async def connect(self, url, **kwargs):
+        """Open the websocket and handshake, resuming with self.ticket when we have one"""
+        handshake = self.make_handshake()
+        headers = {RESUME_HEADER: handshake.resume_request()} if self.ticket else None
+        self.ws = handshake.ws = await websockets.connect(url, additional_headers=headers, **{"compression": None, **kwargs})
+        self.session = await handshake.run()
+        self.resumed = bool(handshake.resumed)
+        self.server_features = handshake.peer_features
+        return self.ws
+
+    async def handshake(self):
+        handshake = self.make_handshake()
+        self.session = await handshake.run()
+        self.server_features = handshake.peer_features
+
+    @property
+    def batching(self):
+        return self.batch_window is not None and "batch" in self.server_features
+
+    async def send(self, payload: dict):
+        if not self.batching:
+            await self.send_now(payload)
+            return
+        self.pending.append(payload)
+        if len(self.pending) >= self.batch_size:
+            await self.flush()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_later())
+
+    async def send_now(self, payload: dict):
+        await self.ws.send(self.session.seal(payload))
+
+    async def flush_later(self):
+        await asyncio.sleep(self.batch_window)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """Send everything pending now, as one frame"""
+        if self.flush_task and self.flush_task is not asyncio.current_task():
+            self.flush_task.cancel()
+            self.flush_task = None
+        items, self.pending = self.pending, []
+        if items:
+            try:
+                await self.send_now(items[0] if len(items) == 1 else {"type": "batch", "items": items})
+            except BaseException:
+                # Not sent: keep them ahead of anything queued meanwhile, for a retry or a new connection
+                self.pending[:0] = items
+                raise
+
+    async def send_raw(self, frame: bytes):
+        """An already sealed frame, e.g. a file chunk"""
+        await self.ws.send(frame)
+
+    async def send_bytes(self, data: bytes):
+        await self.ws.send(self.session.seal_bytes(data))
+
+    async def recv_bytes(self) -> bytes:
+        return self.session.open_bytes(await self.ws.recv())
 
-    async def receive_loop(self, on_message, on_disconnect):
+    async def receive_loop(self, on_message, on_disconnect, on_chunk=None):
+        """Dispatch incoming frames until the socket closes, cleanly or not, then call on_disconnect"""
         try:
             async for msg in self.ws:
-                data = json.loads(msg)
-                plaintext = AESHandler.decrypt(
-                    self.aesgcm,
-                    bytes.fromhex(data["nonce"]),
-                    bytes.fromhex(data["ciphertext"])
-                )
-                on_message(plaintext)
-        except:
+                try:
+                    if on_chunk and is_chunk(msg):
+                        on_chunk(msg)
+                        continue
+                    on_message(self.session.open(msg))
+                except Exception as e:
+                    # One bad frame, or a handler bug, is not a dropped connection
+                    log.warning("Dropped an incoming frame: %r", e)
+        except Exception:
+            pass
+        finally:
             on_disconnect()
@@ -1,108 +1,281 @@
-import asyncio, websockets, json, os, uuid
+import asyncio, websockets, os, random, time, uuid
+from collections import deque
+from functools import lru_cache
 from channel import Channel
-from modules.crypto_utils import AESHandler
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
-from cryptography.hazmat.primitives import serialization, hashes
+from transfer import Transfers
+from modules.keys import Identity
 
 HOST, PORT = "127.0.0.1", 8765
 ID_FILE = "./storage/client_id"
 KEY_DIR = "./storage/keys"
-os.makedirs(KEY_DIR, exist_ok=True)
-
-PRIV_FILE = f"{KEY_DIR}/client_rsa_private.pem"
-PUB_FILE = f"{KEY_DIR}/client_rsa_public.pem"
-
-if not os.path.exists(PRIV_FILE):
-    priv = rsa.generate_private_key(65537, 2048)
-    pub = priv.public_key()
-    with open(PRIV_FILE, "wb") as f: f.write(priv.private_bytes(
-        serialization.Encoding.PEM,
-        serialization.PrivateFormat.PKCS8,
-        serialization.NoEncryption()
-    ))
-    with open(PUB_FILE, "wb") as f: f.write(pub.public_bytes(
-        serialization.Encoding.PEM,
-        serialization.PublicFormat.SubjectPublicKeyInfo
-    ))
-
-with open(PRIV_FILE, "rb") as f: CLIENT_PRIV = serialization.load_pem_private_key(f.read(), None)
-
+DOWNLOAD_DIR = "./storage/downloads"
 SERVER_PUB_FILE = f"{KEY_DIR}/server_rsa_public.pem"
-with open(SERVER_PUB_FILE, "rb") as f: SERVER_PUB = f.read()
+IDENTITY_KIND = "ed25519"  # key type a first run generates, when the server accepts it ("rsa" otherwise)
+RECONNECT_MIN, RECONNECT_MAX = 0.5, 30.0  # seconds, bounds of the reconnect backoff
+RECONNECT_STABLE = 10.0  # seconds a connection must last for the backoff to start over
+OUTBOX_SIZE = 1000  # payloads held while offline
+
+@lru_cache(maxsize=1)
+def default_identity():
+    return Identity(KEY_DIR, IDENTITY_KIND)
+
+@lru_cache(maxsize=1)
+def server_pub():
+    with open(SERVER_PUB_FILE, "rb") as f:
+        return f.read()
+
+class OutboxFull(Exception):
+    pass
 
 class ClientConnection:
-    def __init__(self):
+    """Our session with the server, kept up across dropped sockets.
+
+    Sends only queue a payload for the writer task, which sends them in
+    order whenever we are connected. When the socket drops, a supervisor
+    reconnects after a jittered, exponentially growing delay (resuming with
+    our ticket when it is still good), rejoins our groups and lets the
+    writer carry on with whatever queued up meanwhile. on_status, when set,
+    hears "connected", "reconnecting" and "closed".
+
+    presence maps the clients we watch to whether they are online, as
+    the server last told us; on_presence, when set, hears each change.
+    Incoming files are refused unless accept_file(sender, offer) is set and
+    returns True.
+    """
+
+    def __init__(self, batch_window=None, batch_size=64, identity=None, reconnect=True, outbox_size=OUTBOX_SIZE):
+        self.batch_window = batch_window  # seconds to coalesce sends for (bots); None sends each message at once
+        self.batch_size = batch_size
         self.ws = None
         self.channel = None
         self.client_id = None
         self.inbox = asyncio.Queue()
         self.receive_task = None
+        self.ticket = None
+        self.groups = {}  # group id -> member count when we joined
+        self.transfers = None
+        self.identity = identity or default_identity()
+        self.reconnect = reconnect
+        self.outbox = deque()  # payloads for the writer, oldest first
+        self.outbox_size = outbox_size
+        self.outbox_ready = asyncio.Event()
+        self.outbox_empty = asyncio.Event()
+        self.outbox_empty.set()
+        self.connected = asyncio.Event()
+        self.writer_task = None
+        self.supervisor = None
+        self.backoff = RECONNECT_MIN
+        self.connected_at = 0.0
+        self.joined = set()  # groups to rejoin after a reconnect
+        self.presence = {}  # watched client id -> online
+        self.on_presence = None
+        self.closing = False
+        self.on_status = None
+        self.accept_file = None
+
+    def take_ticket(self):
+        """The resumption ticket from our last session, if still valid (tickets are single-use)"""
+        ticket, self.ticket = self.ticket, None
+        if ticket and ticket["expires"] > time.time():
+            return ticket
+        return None
 
     async def connect(self):
-        self.ws = await websockets.connect(f"ws://{HOST}:{PORT}")
-        self.channel = Channel(self.ws, SERVER_PUB)
-        await self.channel.handshake()
+        old = self.channel
+        channel = Channel(None, server_pub(), ticket=self.take_ticket(), batch_window=self.batch_window, batch_size=self.batch_size)
+        ws = await channel.connect(f"ws://{HOST}:{PORT}")
+        self.ws, self.channel = ws, channel
+        if old and old.pending:
+            # Batched on the socket that dropped: still ahead of everything queued since
+            self.outbox.extendleft(reversed(old.pending))
+            old.pending = []
+            self.outbox_empty.clear()
+            self.outbox_ready.set()
+
+        if self.client_id is None:
+            self.client_id = self.load_client_id()
+
+        if not self.channel.resumed:
+            try:
+                await self.authenticate()
+            except BaseException:
+                await ws.close()
+                raise
+
+        self.transfers = Transfers(self.channel, DOWNLOAD_DIR, on_received=lambda sender, path: self.inbox.put_nowait((sender, f"[file] {path}", None)),
+                                   accept=lambda sender, offer: self.accept_file is not None and self.accept_file(sender, offer))
+        self.receive_task = asyncio.create_task(self.channel.receive_loop(self.on_message, self.on_disconnect, self.transfers.on_chunk))
+        for group_id in self.joined:
+            await self.channel.send({"type": "join", "group": group_id})
+        if self.presence:
+            await self.channel.send({"type": "presence", "op": "subscribe", "ids": list(self.presence)})
+        self.connected_at = time.monotonic()
+        self.connected.set()
+        if self.writer_task is None:
+            self.writer_task = asyncio.create_task(self.write_loop())
+            print(f"[*] Connected as {self.client_id}")
+        self.set_status("connected")
+
+    def set_status(self, status):
+        if self.on_status:
+            self.on_status(status)
+
+    def on_disconnect(self):
+        self.connected.clear()
+        if self.closing or not self.reconnect or self.supervisor is not None:
+            return
+        if time.monotonic() - self.connected_at > RECONNECT_STABLE:
+            self.backoff = RECONNECT_MIN
+        self.supervisor = asyncio.create_task(self.reconnect_loop())
+
+    async def reconnect_loop(self):
+        self.set_status("reconnecting")
+        try:
+            # The receive loop may have stopped on a socket that is still open: the server
+            # would keep that session registered and refuse our client ID until it closes
+            try: await self.ws.close()
+            except Exception: pass
+            while not self.closing:
+                # Full jitter: clients dropped together come back spread over the whole delay
+                await asyncio.sleep(random.uniform(0, self.backoff))
+                self.backoff = min(RECONNECT_MAX, self.backoff * 2)
+                try:
+                    await self.connect()
+                    return
+                except Exception:
+                    pass
+        finally:
+            self.supervisor = None
 
+    def queue(self, payload):
+        if len(self.outbox) >= self.outbox_size:
+            raise OutboxFull(f"{len(self.outbox)} messages already waiting to be sent")
+        self.outbox.append(payload)
+        self.outbox_empty.clear()
+        self.outbox_ready.set()
+
+    async def write_loop(self):
+        while True:
+            if not self.outbox:
+                self.outbox_ready.clear()
+                self.outbox_empty.set()
+                await self.outbox_ready.wait()
+                continue
+            await self.connected.wait()
+            channel = self.channel
+            try:
+                await channel.send(self.outbox[0])
+            except websockets.ConnectionClosed:
+                # The receive loop starts the reconnect
+                self.connected.clear()
+                if not channel.batching:
+                    continue  # kept for the next connection
+                # A batching channel took it into its pending batch, which connect() hands back
+            except Exception:
+                pass  # a payload that cannot be sent at all is dropped
+            self.outbox.popleft()
+
+    @staticmethod
+    def load_client_id():
         if os.path.exists(ID_FILE):
-            self.client_id = open(ID_FILE).read().strip()
-        else:
-            self.client_id = str(uuid.uuid4())
-            with open(ID_FILE,"w") as f:
-                f.write(self.client_id)
-        
-        pub_bytes = CLIENT_PRIV.public_key().public_bytes(
-            serialization.Encoding.PEM,
-            serialization.PublicFormat.SubjectPublicKeyInfo
-        ).decode()
-
-        signature = CLIENT_PRIV.sign(
-            self.client_id.encode(),
-            padding.PSS(padding.MGF1(hashes.SHA256()), padding.PSS.MAX_LENGTH),
-            hashes.SHA256()
-        )
-
-        payload = {"client_id": self.client_id, "signature": signature.hex(), "pub_key": pub_bytes}
-        n, c = AESHandler.encrypt(self.channel.aesgcm, json.dumps(payload))
-        await self.ws.send(json.dumps({"nonce": n.hex(), "ciphertext": c.hex()}))
+            return open(ID_FILE).read().strip()
+        client_id = str(uuid.uuid4())
+        os.makedirs(os.path.dirname(ID_FILE), exist_ok=True)
+        with open(ID_FILE, "w") as f:
+            f.write(client_id)
+        return client_id
 
-        # Challenge-response dal server
-        challenge_msg = await self.ws.recv()
-        challenge_data = json.loads(challenge_msg)
-        challenge = AESHandler.decrypt(
-            self.channel.aesgcm,
-            bytes.fromhex(challenge_data["nonce"]),
-            bytes.fromhex(challenge_data["ciphertext"])
-        )
-        challenge_bytes = bytes.fromhex(challenge)
-
-        sig = CLIENT_PRIV.sign(
-            challenge_bytes,
-            padding.PSS(padding.MGF1(hashes.SHA256()), padding.PSS.MAX_LENGTH),
-            hashes.SHA256()
-        )
-        n, c = AESHandler.encrypt(self.channel.aesgcm, sig.hex())
-        await self.ws.send(json.dumps({"nonce": n.hex(), "ciphertext": c.hex()}))
-
-        self.receive_task = asyncio.create_task(self.channel.receive_loop(self.on_message, self.on_disconnect))
-        print(f"[*] Connected as {self.client_id}")
+    async def authenticate(self):
+        if "ed25519" not in self.channel.server_features:
+            self.identity.prefer("rsa")
+        payload = {"client_id": self.client_id, "signature": self.identity.sign_id(self.client_id).hex(), "pub_key": self.identity.pub_pem,
+                   "features": ["batch", "resume", "files"]}
+        await self.channel.send_now(payload)
 
+        # Challenge-response dal server
+        challenge_bytes = bytes.fromhex((await self.channel.recv_bytes()).decode())
+        await self.channel.send_bytes(self.identity.sign(challenge_bytes).hex().encode())
 
     async def send_message_to(self, target_id, text):
-        msg = {"target": target_id, "text": text}
-        await self.channel.send(json.dumps(msg))
+        self.queue({"target": target_id, "text": text})
+
+    async def send_message_to_many(self, target_ids, text):
+        """One frame to several recipients; the server fans it out"""
+        self.queue({"targets": list(target_ids), "text": text})
+
+    async def join_group(self, group_id):
+        self.joined.add(group_id)
+        self.queue({"type": "join", "group": group_id})
+
+    async def leave_group(self, group_id):
+        self.joined.discard(group_id)
+        self.queue({"type": "leave", "group": group_id})
+
+    async def send_to_group(self, group_id, text):
+        self.queue({"group": group_id, "text": text})
+
+    async def watch(self, client_ids):
+        """Follow whether client_ids are online (see presence)"""
+        client_ids = [c for c in client_ids if c not in self.presence]
+        if client_ids:
+            self.presence.update(dict.fromkeys(client_ids, False))
+            self.queue({"type": "presence", "op": "subscribe", "ids": client_ids})
+
+    async def unwatch(self, client_ids):
+        client_ids = [c for c in client_ids if self.presence.pop(c, None) is not None]
+        if client_ids:
+            self.queue({"type": "presence", "op": "unsubscribe", "ids": client_ids})
+
+    async def drain(self, timeout=None):
+        """Wait until the writer has sent everything queued"""
+        await asyncio.wait_for(self.outbox_empty.wait(), timeout)
+
+    async def send_file(self, path, target_id):
+        """Stream a file to target_id; returns once it has all of it"""
+        return await self.transfers.send_file(path, target_id)
 
     async def receive_message(self):
         return await self.inbox.get()
 
-    def on_message(self, message):
-        try:
-            data = json.loads(message)
-            self.inbox.put_nowait((data.get("sender", "unknown"), data.get("text", message)))
-        except: print(message)
-
-    def on_disconnect(self): print("[*] Disconnected from server")
+    def on_message(self, payload):
+        if payload.get("type") == "batch":
+            for item in payload.get("items", []):
+                self.on_message(item)
+            return
+        if payload.get("type") == "ticket":
+            self.ticket = {"id": payload["id"], "secret": payload["secret"], "expires": time.time() + payload.get("ttl", 0)}
+            return
+        if payload.get("type") == "file":
+            self.transfers.on_control(payload)
+            return
+        if payload.get("type") == "group":
+            if payload.get("event") == "joined":
+                self.groups[payload["group"]] = payload.get("members", 0)
+            else:
+                self.groups.pop(payload["group"], None)
+            return
+        if payload.get("type") == "presence":
+            for key, online in (("off", False), ("on", True)):
+                for client_id in payload.get(key, ()):
+                    if client_id in self.presence:
+                        self.presence[client_id] = online
+            if self.on_presence:
+                self.on_presence(payload)
+            return
+        self.inbox.put_nowait((payload.get("sender", "unknown"), payload.get("text", ""), payload.get("group")))
 
-    async def close(self):
+    async def close(self, timeout=2.0):
+        if self.connected.is_set():
+            try: await self.drain(timeout)
+            except asyncio.TimeoutError: pass
+        self.closing = True
+        for task in (self.supervisor, self.writer_task):
+            if task:
+                task.cancel()
+        if self.channel and self.ws:
+            try: await self.channel.flush()
+            except Exception: pass
+        self.set_status("closed")
         if self.receive_task:
             self.receive_task.cancel()
             try: await self.receive_task
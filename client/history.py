@@ -0,0 +1,196 @@
+import asyncio, hashlib, hmac, json, os, re, sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from modules.crypto_utils import AESHandler
+
+PAGE_SIZE = 200  # messages loaded per scrollback step
+SEARCH_LIMIT = 50
+FLUSH_DELAY = 0.2  # seconds new messages wait to share a write transaction
+TOKEN_SIZE = 8  # bytes of each search token kept
+WORD = re.compile(r"\w+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS contacts (tag BLOB PRIMARY KEY, body BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, chat BLOB NOT NULL, body BLOB NOT NULL);
+CREATE INDEX IF NOT EXISTS messages_chat ON messages (chat, id);
+CREATE TABLE IF NOT EXISTS terms (token BLOB NOT NULL, id INTEGER NOT NULL, PRIMARY KEY (token, id)) WITHOUT ROWID;
+"""
+CHECK = b"shield-chat history"
+
+class MessageStore:
+    """Chat history and contacts in SQLite, encrypted at rest.
+
+    Message and contact bodies are AES-GCM sealed (random nonce, bound to
+    their chat as associated data). Chats are stored under an HMAC tag of
+    their ID, and full-text search goes through an index of HMAC tokens of
+    each word, so lookups are B-tree probes however large the history
+    grows. What stays visible on disk is which messages share a chat and
+    which share a word, not what either is.
+
+    All database work runs on one thread: add() and save_contact() only
+    queue, and queued rows are written in one transaction FLUSH_DELAY later.
+    """
+
+    def __init__(self, path, secret: bytes, flush_delay=FLUSH_DELAY):
+        self.path = path
+        self.aesgcm = AESHandler.make(AESHandler.derive_key(secret, info=b"shield-chat history"))
+        self.mac_key = AESHandler.derive_key(secret, info=b"shield-chat history index")
+        self.flush_delay = flush_delay
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="history")
+        self.pending = []
+        self.writing = []  # batches handed to the thread and not yet committed
+        self.flush_handle = None
+        self.chats = {}  # tag -> chat id, for everything we stored or read
+        self.db = self.connect()
+        self.next_id = (self.db.execute("SELECT MAX(id) FROM messages").fetchone()[0] or 0) + 1
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(SCHEMA)
+        row = db.execute("SELECT value FROM meta WHERE key = 'check'").fetchone()
+        if row is None:
+            with db:
+                db.execute("INSERT INTO meta VALUES ('check', ?)", (self.seal(CHECK, b"check"),))
+        elif self.unseal(row[0], b"check") != CHECK:
+            # Written under another identity key: keep it aside and start over
+            db.close()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.path + suffix):
+                    os.replace(self.path + suffix, f"{self.path}.undecryptable{suffix}")
+            return self.connect()
+        return db
+
+    def tag(self, value: str, kind=b"chat") -> bytes:
+        return hmac.new(self.mac_key, kind + b"\0" + value.encode(), hashlib.sha256).digest()[:16]
+
+    def tokens(self, text):
+        return {self.tag(word, b"word")[:TOKEN_SIZE] for word in WORD.findall(text.lower())}
+
+    def seal(self, data: bytes, aad: bytes) -> bytes:
+        nonce = os.urandom(12)
+        return nonce + AESHandler.encrypt_at(self.aesgcm, nonce, data, aad)
+
+    def unseal(self, blob: bytes, aad: bytes):
+        try:
+            return AESHandler.decrypt_at(self.aesgcm, blob[:12], blob[12:], aad)
+        except Exception:
+            return None
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def contacts(self) -> dict:
+        """chat id -> name, in the order they were added"""
+        out = {}
+        for tag, body in self.db.execute("SELECT tag, body FROM contacts ORDER BY rowid"):
+            data = self.unseal(body, b"contact")
+            if data is not None:
+                chat, name = json.loads(data)
+                out[chat] = name
+                self.chats[tag] = chat
+        return out
+
+    def save_contact(self, chat, name):
+        self.queue(("contact", chat, name))
+
+    def add(self, chat, text, color) -> int:
+        """Queue a message; returns its ID, usable for paging at once"""
+        msg_id = self.next_id
+        self.next_id += 1
+        self.queue(("message", msg_id, chat, text, color))
+        return msg_id
+
+    def queue(self, op):
+        self.pending.append(op)
+        if self.flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self.flush_handle = loop.call_later(self.flush_delay, lambda: loop.create_task(self.flush()))
+
+    async def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        if batch:
+            self.writing.append(batch)
+            try:
+                await self.run(self.write, batch)
+            finally:
+                self.writing.remove(batch)
+
+    def write(self, batch):
+        contacts, messages, terms = [], [], []
+        for op in batch:
+            if op[0] == "contact":
+                _, chat, name = op
+                contacts.append((self.tag(chat), self.seal(json.dumps([chat, name]).encode(), b"contact")))
+            else:
+                _, msg_id, chat, text, color = op
+                tag = self.tag(chat)
+                self.chats[tag] = chat
+                messages.append((msg_id, tag, self.seal(bytes((color,)) + text.encode(), tag)))
+                terms.extend((token, msg_id) for token in self.tokens(text))
+        with self.db:
+            self.db.executemany("INSERT INTO contacts (tag, body) VALUES (?, ?) ON CONFLICT (tag) DO UPDATE SET body = excluded.body", contacts)
+            self.db.executemany("INSERT INTO messages (id, chat, body) VALUES (?, ?, ?)", messages)
+            self.db.executemany("INSERT OR IGNORE INTO terms (token, id) VALUES (?, ?)", terms)
+
+    def decode(self, rows):
+        """(id, chat tag, body) rows -> (id, chat, text, color), skipping any that do not decrypt"""
+        out = []
+        for msg_id, tag, body in rows:
+            data = self.unseal(body, tag)
+            if data is not None:
+                out.append((msg_id, self.chats.get(tag), data[1:].decode(), data[0]))
+        return out
+
+    async def page(self, chat, before=None, after=None, limit=PAGE_SIZE) -> tuple[list, bool]:
+        """A chat's newest messages, or those just before/after an ID, oldest first.
+
+        Returns (rows, more): more says whether the chat goes on past the
+        page in the direction read. Pages reaching the newest message include
+        any added while they were being read.
+        """
+        await self.flush()
+        rows = await self.run(self.read_page, self.tag(chat), before, after, limit)
+        more = len(rows) == limit
+        if before is None and (after is None or not more):
+            # Not on disk when we read, so newer than everything that was
+            newest = rows[-1][0] if rows else after or 0
+            rows += [(op[1], chat, op[3], op[4]) for batch in (*self.writing, self.pending) for op in batch
+                     if op[0] == "message" and op[2] == chat and op[1] > newest]
+        return rows, more
+
+    def read_page(self, tag, before, after, limit):
+        if after is not None:
+            rows = self.db.execute("SELECT id, chat, body FROM messages WHERE chat = ? AND id > ? ORDER BY id LIMIT ?",
+                                   (tag, after, limit)).fetchall()
+        else:
+            rows = self.db.execute("SELECT id, chat, body FROM messages WHERE chat = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                                   (tag, before if before is not None else self.next_id, limit)).fetchall()
+            rows.reverse()
+        return self.decode(rows)
+
+    async def search(self, query, chat=None, limit=SEARCH_LIMIT) -> list:
+        """Newest messages containing every word of query, in one chat or all of them"""
+        tokens = sorted(self.tokens(query))
+        if not tokens:
+            return []
+        await self.flush()
+        return await self.run(self.read_search, tokens, chat and self.tag(chat), limit)
+
+    def read_search(self, tokens, tag, limit):
+        # Walk the first word's postings newest first and probe the rest by primary key
+        joins = "".join(f" JOIN terms t{i} ON t{i}.token = ? AND t{i}.id = t0.id" for i in range(1, len(tokens)))
+        where = " AND m.chat = ?" if tag else ""
+        sql = (f"SELECT m.id, m.chat, m.body FROM terms t0{joins} JOIN messages m ON m.id = t0.id "
+               f"WHERE t0.token = ?{where} ORDER BY t0.id DESC LIMIT ?")
+        return self.decode(self.db.execute(sql, (*tokens[1:], tokens[0], *([tag] if tag else ()), limit)).fetchall())
+
+    async def close(self):
+        await self.flush()
+        await self.run(self.db.close)
+        self.executor.shutdown()
@@ -0,0 +1,133 @@
+import textwrap
+from collections import OrderedDict, deque
+
+MESSAGES_PER_CHAT = 1000
+WIDTHS_CACHED = 2  # the current layout and the one before a resize
+
+class WrappedLines:
+    """A ChatBuffer seen as screen lines of at most `width` characters.
+
+    Behaves like the list of wrapped (line, color) tuples the renderer draws
+    from, but wraps a message only when one of its lines is asked for: the
+    total length needs just a line count per message, and short single-line
+    messages (most of them) never go through textwrap at all.
+    """
+
+    def __init__(self, messages, width):
+        self.width = width
+        self.counts = deque((self.count(text) for text, _ in messages), maxlen=messages.maxlen)
+        self.wrapped = deque([None] * len(messages), maxlen=messages.maxlen)  # per message, once wrapped
+        self.total = sum(self.counts)
+        self.start = 0  # position of the first line, moved by evictions and prepends, for callers holding one
+        self.messages = messages
+
+    def count(self, text) -> int:
+        if len(text) <= self.width and text.isprintable():
+            return 1
+        return len(textwrap.wrap(text, self.width)) or 1
+
+    def appended(self, text, evicted):
+        if evicted:
+            self.total -= self.counts[0]
+            self.start += self.counts[0]
+        n = self.count(text)
+        self.counts.append(n)
+        self.wrapped.append(None)
+        self.total += n
+
+    def prepended(self, text, evicted):
+        if evicted:
+            self.total -= self.counts[-1]
+        n = self.count(text)
+        self.counts.appendleft(n)
+        self.wrapped.appendleft(None)
+        self.total += n
+        self.start -= n
+
+    def __len__(self):
+        return self.total
+
+    def lines_of(self, i):
+        lines = self.wrapped[i]
+        if lines is None:
+            text, color = self.messages[i]
+            if len(text) <= self.width and text.isprintable():
+                lines = ((text, color),)
+            else:
+                lines = tuple((line, color) for line in textwrap.wrap(text, self.width) or ("",))
+            self.wrapped[i] = lines
+        return lines
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError("WrappedLines only supports slicing")
+        start, stop, _ = index.indices(self.total)
+        if start >= stop:
+            return []
+        # Find the message holding line `start`, walking in from the nearer end
+        if start < self.total - stop:
+            i, first = 0, 0
+            while first + self.counts[i] <= start:
+                first += self.counts[i]
+                i += 1
+        else:
+            i, first = len(self.counts), self.total
+            while first > start:
+                i -= 1
+                first -= self.counts[i]
+        out = []
+        skip = start - first
+        while len(out) < stop - start:
+            out.extend(self.lines_of(i)[skip:])
+            skip = 0
+            i += 1
+        return out[:stop - start]
+
+class ChatBuffer:
+    """One chat's messages, oldest dropped past `size`, kept unwrapped.
+
+    lines(width) gives the wrapped view for a width; views for the last
+    WIDTHS_CACHED widths are kept up to date on append, so switching back
+    after a resize costs nothing and a new width only counts lines. Pages
+    read back from history go in at either end; `older` and `live` say
+    whether history has more beyond the front and the back.
+    """
+
+    def __init__(self, size=MESSAGES_PER_CHAT):
+        self.messages = deque(maxlen=size)
+        self.ids = deque(maxlen=size)  # history ID of each message, None when not stored
+        self.views = OrderedDict()  # width -> WrappedLines
+        self.older = True  # whether there may be older messages than those held, in history
+        self.live = True  # whether the newest message is held, so new ones belong at the end
+
+    def __len__(self):
+        return len(self.messages)
+
+    def append(self, text, color, msg_id=None):
+        evicted = len(self.messages) == self.messages.maxlen
+        if evicted:
+            self.older = True
+        self.messages.append((text, color))
+        self.ids.append(msg_id)
+        for view in self.views.values():
+            view.appended(text, evicted)
+
+    def prepend(self, text, color, msg_id=None):
+        """Add an older message at the front, dropping the newest when full"""
+        evicted = len(self.messages) == self.messages.maxlen
+        if evicted:
+            self.live = False
+        self.messages.appendleft((text, color))
+        self.ids.appendleft(msg_id)
+        for view in self.views.values():
+            view.prepended(text, evicted)
+
+    def lines(self, width) -> WrappedLines:
+        view = self.views.get(width)
+        if view is None:
+            view = self.views[width] = WrappedLines(self.messages, width)
+            while len(self.views) > WIDTHS_CACHED:
+                self.views.popitem(last=False)
+        else:
+            self.views.move_to_end(width)
+        return view
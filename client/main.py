@@ -1,125 +1,190 @@
 import asyncio
 import curses
 import json
+import logging
 import os
-from connection import ClientConnection
-import textwrap
+from connection import ClientConnection, OutboxFull
+from render import ChatRenderer
+from inbox import ChatBuffer
+from history import MessageStore, PAGE_SIZE
 
-CONTACTS_FILE = "./storage/contacts.json"
+CONTACTS_FILE = "./storage/contacts.json"  # read once, into history, then renamed
+HISTORY_FILE = "./storage/history.db"
+LOG_FILE = "./storage/client.log"
 RECEIVED_COLOR = 2
 SENT_COLOR = 1
 INFO_COLOR = 4
+INBOX_SIZE = 1000  # messages kept per chat
+
+log = logging.getLogger("shieldchat.client")
 
 class ClientApp:
     def __init__(self, stdscr):
         self.stdscr = stdscr
         self.client = ClientConnection()
         self.client_id = None
+        self.status = None  # connection status shown in the title while not connected
         self.contacts = {}
         self.inbox = {}
+        self.history = None  # MessageStore, once connected (its key comes from our identity)
+        self.results = None  # (title, lines) of the last search, shown until the next input
         self.selected_chat = None
         self.running = True
         self.scroll_offset = 0
-        self.load_contacts()
+        self.renderer = ChatRenderer(stdscr, border_color=INFO_COLOR)
+        self.redraw = None  # pending throttled redraw
         curses.start_color()
         curses.use_default_colors()
         curses.init_pair(SENT_COLOR, curses.COLOR_CYAN, -1)
         curses.init_pair(RECEIVED_COLOR, curses.COLOR_YELLOW, -1)
         curses.init_pair(INFO_COLOR, curses.COLOR_WHITE, -1)
 
-    def load_contacts(self):
+    async def open_history(self):
+        self.history = MessageStore(HISTORY_FILE, self.client.identity.secret(b"shield-chat local storage"))
+        for cid, name in self.history.contacts().items():
+            self.contacts[cid] = name
+            self.inbox.setdefault(cid, ChatBuffer(INBOX_SIZE))
         if os.path.exists(CONTACTS_FILE):
             try:
                 with open(CONTACTS_FILE, "r") as f:
-                    self.contacts = json.load(f)
-                    for cid in self.contacts:
-                        self.inbox[cid] = []
-            except:
-                self.contacts = {}
+                    for cid, name in json.load(f).items():
+                        if cid not in self.contacts:
+                            self.add_contact(cid, name)
+                await self.history.flush()
+                # Kept aside rather than deleted, in case the migration has to be redone
+                os.replace(CONTACTS_FILE, f"{CONTACTS_FILE}.migrated")
+            except (OSError, ValueError, AttributeError) as e:
+                log.warning("Could not migrate %s: %r", CONTACTS_FILE, e)
 
-    def save_contacts(self):
-        try:
-            with open(CONTACTS_FILE, "w") as f:
-                json.dump(self.contacts, f)
-        except:
-            pass
+    def add_contact(self, cid, name):
+        self.contacts[cid] = name
+        self.inbox.setdefault(cid, ChatBuffer(INBOX_SIZE))
+        if self.history:
+            self.history.save_contact(cid, name)
 
-    async def display_box(self, title, lines):
-        self.stdscr.clear()
-        h, w = self.stdscr.getmaxyx()
-        box_height = h - 4
-        box_width = w - 4
-        start_y = 2
-        start_x = 2
-
-        self.stdscr.addstr(start_y, start_x, '┌' + '─' * (box_width - 2) + '┐', curses.color_pair(INFO_COLOR))
-        for y in range(1, box_height - 1):
-            self.stdscr.addstr(start_y + y, start_x, '│', curses.color_pair(INFO_COLOR))
-            self.stdscr.addstr(start_y + y, start_x + 1, ' ' * (box_width - 2))
-            self.stdscr.addstr(start_y + y, start_x + box_width - 1, '│', curses.color_pair(INFO_COLOR))
-        self.stdscr.addstr(start_y + box_height - 1, start_x, '└' + '─' * (box_width - 2) + '┘', curses.color_pair(INFO_COLOR))
+    def accept_file(self, sender, offer):
+        """Files are only taken from contacts we named, not from whoever wrote to us first"""
+        return self.contacts.get(sender, sender) != sender
 
-        display_title = f"{title} (ID: {self.client_id})" if self.client_id else title
-        self.stdscr.addstr(start_y, start_x + 2, f" {display_title} ", curses.color_pair(INFO_COLOR) | curses.A_BOLD)
+    def record(self, chat, text, color):
+        """Store a message, and show it unless the chat is paged back in history"""
+        buffer = self.inbox.setdefault(chat, ChatBuffer(INBOX_SIZE))
+        msg_id = self.history.add(chat, text, color) if self.history else None
+        if buffer.live:
+            buffer.append(text, color, msg_id)
 
-        visible_height = box_height - 3
-        max_scroll = max(0, len(lines) - visible_height)
-        self.scroll_offset = max(0, min(self.scroll_offset, max_scroll))
-        visible_lines = lines[self.scroll_offset:self.scroll_offset + visible_height]
+    async def load_older(self, chat) -> int:
+        """Page older messages in from history; returns the lines added above"""
+        buffer = self.inbox[chat]
+        if not self.history or not buffer.older:
+            return 0
+        rows, buffer.older = await self.history.page(chat, before=buffer.ids[0] if buffer.ids else None)
+        lines = buffer.lines(self.renderer.text_width())
+        start = lines.start
+        for msg_id, _, text, color in reversed(rows):
+            buffer.prepend(text, color, msg_id)
+        return start - lines.start
 
-        y_offset = start_y + 1
-        for line, color in visible_lines:
-            self.stdscr.addstr(y_offset, start_x + 2, line, curses.color_pair(color))
-            y_offset += 1
+    async def load_newer(self, chat):
+        """Page newer messages back in from history, moving the view with the lines dropped at the front"""
+        buffer = self.inbox[chat]
+        rows, more = await self.history.page(chat, after=buffer.ids[-1] if buffer.ids else 0)
+        lines = buffer.lines(self.renderer.text_width())
+        start = lines.start
+        for msg_id, _, text, color in rows:
+            buffer.append(text, color, msg_id)
+        buffer.live = not more
+        if self.selected_chat == chat:
+            self.scroll_offset = max(0, self.scroll_offset - (lines.start - start))
 
-        prompt_y = h - 2
-        self.stdscr.addstr(prompt_y, start_x, "> ", curses.color_pair(INFO_COLOR))
-        self.stdscr.move(prompt_y, start_x + 2)
-        self.stdscr.refresh()
+    async def open_chat(self, chat):
+        self.selected_chat = chat
+        buffer = self.inbox.setdefault(chat, ChatBuffer(INBOX_SIZE))
+        if not buffer.live:
+            # Paged back when last seen: start again from the newest messages
+            buffer = self.inbox[chat] = ChatBuffer(INBOX_SIZE)
+        if len(buffer) < PAGE_SIZE:
+            await self.load_older(chat)
+        self.scroll_offset = len(buffer.lines(self.renderer.text_width()))
+
+    async def search(self, query):
+        chat = self.selected_chat
+        rows = await self.history.search(query, chat) if self.history else []
+        lines = [(f"{self.contacts.get(cid, cid)} | {text}", color) for _, cid, text, color in rows] or [("No messages found", INFO_COLOR)]
+        self.results = (f"Search: {query}", lines)
+        self.scroll_offset = 0
+
+    def display_box(self, title, lines, prompt=False):
+        display_title = f"{title} (ID: {self.client_id})" if self.client_id else title
+        if self.status:
+            display_title = f"{display_title} [{self.status}]"
+        self.scroll_offset = self.renderer.draw(display_title, lines, self.scroll_offset, prompt)
 
+    def on_status(self, status):
+        self.status = None if status == "connected" else status
+        self.request_display()
 
-    async def display_contacts_box(self):
-        lines = [(f"{idx}. {name} ({cid})", RECEIVED_COLOR) for idx, (cid, name) in enumerate(self.contacts.items(), start=1)]
+    def request_display(self):
+        """Redraw soon; bursts of incoming messages share a frame"""
+        if self.redraw is None:
+            self.redraw = asyncio.get_running_loop().call_later(self.renderer.frame_delay(), self.display)
+
+    def display_contacts_box(self, prompt=False):
+        presence = self.client.presence
+        lines = [(f"{idx}. {name} ({cid}){' - online' if presence.get(cid) else ''}", RECEIVED_COLOR)
+                 for idx, (cid, name) in enumerate(self.contacts.items(), start=1)]
         if len(self.contacts) < 20:
             lines.append(("- Add contact (add)", INFO_COLOR))
-        await self.display_box("Contacts", lines)
+            lines.append(("- Join group (join)", INFO_COLOR))
+        self.display_box("Contacts", lines, prompt)
 
-    async def display_chat(self):
+    def display_chat(self, prompt=False):
         chat_name = self.contacts.get(self.selected_chat, self.selected_chat)
-        messages = self.inbox.get(self.selected_chat, [])
-        await self.display_box(f"Chat with {chat_name}", messages)
+        if self.selected_chat in self.client.presence:
+            chat_name += " (online)" if self.client.presence[self.selected_chat] else " (offline)"
+        messages = self.inbox.setdefault(self.selected_chat, ChatBuffer(INBOX_SIZE))
+        self.display_box(f"Chat with {chat_name}", messages.lines(self.renderer.text_width()), prompt)
 
-    async def display(self):
-        if self.selected_chat is None:
-            await self.display_contacts_box()
+    def display(self, prompt=False):
+        if self.redraw is not None:
+            self.redraw.cancel()
+            self.redraw = None
+        if self.results is not None:
+            self.display_box(*self.results, prompt)
+        elif self.selected_chat is None:
+            self.display_contacts_box(prompt)
         else:
-            await self.display_chat()
+            self.display_chat(prompt)
 
     async def receive_messages(self):
         while self.running:
             try:
-                sender, msg = await self.client.receive_message()
-                if sender not in self.inbox:
-                    self.inbox[sender] = []
-                if sender not in self.contacts:
-                    self.contacts[sender] = sender
-                    self.save_contacts()
-
-                h, w = self.stdscr.getmaxyx()
-                box_width = w - 4
-                wrapped_lines = textwrap.wrap(f"{self.contacts.get(sender, sender)}: {msg}", width=box_width-4)
-                for line in wrapped_lines:
-                    self.inbox[sender].append((line, RECEIVED_COLOR))
-
-                if self.selected_chat == sender:
-                    await self.display()
+                sender, msg, group = await self.client.receive_message()
+                chat = f"#{group}" if group else sender
+                if chat not in self.contacts:
+                    self.add_contact(chat, chat)
+                    if not group:
+                        await self.client.watch([chat])
+
+                lines = self.inbox.setdefault(chat, ChatBuffer(INBOX_SIZE)).lines(self.renderer.text_width())
+                follow = self.selected_chat == chat and self.renderer.following(lines)
+                start = lines.start
+                self.record(chat, f"{self.contacts.get(sender, sender)}: {msg}", RECEIVED_COLOR)
+
+                if self.selected_chat == chat:
+                    if follow:
+                        self.scroll_offset = len(lines)
+                    else:
+                        # Keep a scrolled-back view on the same lines while older ones are dropped
+                        self.scroll_offset = max(0, self.scroll_offset - (lines.start - start))
+                    self.request_display()
             except:
                 await asyncio.sleep(0.1)
 
     async def input_loop(self):
         curses.echo()
         while self.running:
-            await self.display()
+            self.display(prompt=True)
             h, w = self.stdscr.getmaxyx()
             prompt_y, prompt_x = h - 2, 2
             try:
@@ -133,34 +198,81 @@ class ClientApp:
                 self.running = False
                 break
             if msg.lower() == "up":
+                if self.scroll_offset == 0 and self.results is None and self.selected_chat is not None:
+                    self.scroll_offset += await self.load_older(self.selected_chat)
                 self.scroll_offset = max(0, self.scroll_offset - 1)
                 continue
             if msg.lower() == "down":
                 self.scroll_offset += 1
+                if self.results is None and self.selected_chat is not None and not self.inbox[self.selected_chat].live:
+                    lines = self.inbox[self.selected_chat].lines(self.renderer.text_width())
+                    if self.scroll_offset + len(self.renderer.rows) > len(lines):
+                        await self.load_newer(self.selected_chat)
+                continue
+            if self.results is not None:
+                self.results = None
+                if self.selected_chat is not None:
+                    self.scroll_offset = len(self.inbox[self.selected_chat].lines(self.renderer.text_width()))
+            if msg.startswith("/search "):
+                await self.search(msg[8:].strip())
                 continue
             if self.selected_chat is None:
                 if msg.lower() == "add":
                     new_id = await self.prompt_input("ID > ")
                     new_name = await self.prompt_input("Name > ")
-                    if new_id and new_name and new_id not in self.contacts:
-                        self.contacts[new_id] = new_name
-                        self.inbox[new_id] = []
-                        self.save_contacts()
+                    # A sender listed under its bare ID can be named, which also lets it send us files
+                    if new_id and new_name and self.contacts.get(new_id, new_id) == new_id:
+                        known = new_id in self.contacts
+                        self.add_contact(new_id, new_name)
+                        if not known and not new_id.startswith("#"):
+                            await self.client.watch([new_id])
+                    continue
+                if msg.lower() == "join":
+                    group = await self.prompt_input("Group > ")
+                    if group:
+                        if f"#{group}" not in self.contacts:
+                            self.add_contact(f"#{group}", f"#{group}")
+                        await self.client.join_group(group)
                     continue
                 selected = self.select_contact(msg)
                 if selected:
-                    self.selected_chat = selected
+                    await self.open_chat(selected)
                 continue
             await self.send_chat(msg)
 
     async def send_chat(self, msg):
-        h, w = self.stdscr.getmaxyx()
-        box_width = w - 4
-        wrapped_lines = textwrap.wrap(f"> {msg}", width=box_width-4)
-        for line in wrapped_lines:
-            self.inbox[self.selected_chat].append((line, SENT_COLOR))
-        await self.client.send_message_to(self.selected_chat, msg)
-        self.scroll_offset = max(0, len(self.inbox[self.selected_chat]) - 1)
+        if msg.startswith("/file "):
+            self.send_file(msg[6:].strip())
+            return
+        chat = self.selected_chat
+        try:
+            if chat.startswith("#"):
+                await self.client.send_to_group(chat[1:], msg)
+            else:
+                await self.client.send_message_to(chat, msg)
+            self.record(chat, f"> {msg}", SENT_COLOR)
+        except OutboxFull:
+            self.record(chat, f"Not sent, too many messages waiting for the connection: {msg}", INFO_COLOR)
+        if not self.inbox[chat].live:
+            await self.open_chat(chat)
+        self.scroll_offset = len(self.inbox[chat].lines(self.renderer.text_width()))
+
+    def send_file(self, path):
+        chat = self.selected_chat
+        if chat.startswith("#") or not os.path.isfile(path):
+            self.record(chat, f"Cannot send {path}", INFO_COLOR)
+            return
+        self.record(chat, f"Sending {os.path.basename(path)}...", INFO_COLOR)
+
+        async def run():
+            try:
+                await self.client.send_file(path, chat)
+                self.record(chat, f"Sent {os.path.basename(path)}", INFO_COLOR)
+            except Exception as e:
+                self.record(chat, f"Sending {os.path.basename(path)} failed: {e}", INFO_COLOR)
+            if self.selected_chat == chat:
+                self.request_display()
+        asyncio.create_task(run())
 
     async def prompt_input(self, prompt_text):
         h, w = self.stdscr.getmaxyx()
@@ -178,12 +290,23 @@ class ClientApp:
 
     async def main(self):
         await self.client.connect()
+        self.client.on_status = self.on_status
+        self.client.on_presence = lambda delta: self.request_display()
+        self.client.accept_file = self.accept_file
         self.client_id = self.client.client_id
+        await self.open_history()
+        for chat in self.contacts:
+            if chat.startswith("#"):
+                await self.client.join_group(chat[1:])
+        await self.client.watch([chat for chat in self.contacts if not chat.startswith("#")])
         asyncio.create_task(self.receive_messages())
         await self.input_loop()
+        await self.history.close()
         await self.client.close()
 
 def start(stdscr):
+    # Anything written to the terminal would land in the middle of the curses screen
+    logging.basicConfig(filename=LOG_FILE, level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     curses.curs_set(1)
     app = ClientApp(stdscr)
     asyncio.run(app.main())
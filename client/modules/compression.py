@@ -0,0 +1,115 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+RAW, COMPRESSED = b"\x00", b"\x01"
+MIN_SIZE = 128  # smaller plaintexts rarely shrink enough to pay for the CPU
+MAX_SIZE = 4 * 1024 * 1024  # largest plaintext we inflate, whatever the frame claims
+
+class CompressionError(ValueError):
+    pass
+
+class ZlibCodec:
+    name = "zlib"
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data, limit) -> bytes:
+        d = zlib.decompressobj()
+        out = d.decompress(data, limit)
+        if d.unconsumed_tail:
+            raise CompressionError("Decompressed payload too large")
+        if not d.eof:
+            raise CompressionError("Truncated compressed payload")
+        return out
+
+class ZstdCodec:
+    name = "zstd"
+
+    def __init__(self, level=3):
+        self.cctx = zstandard.ZstdCompressor(level=level)
+        self.dctx = zstandard.ZstdDecompressor()
+
+    def compress(self, data) -> bytes:
+        return self.cctx.compress(data)
+
+    def decompress(self, data, limit) -> bytes:
+        # decompress() allocates whatever the header claims, so check the claim first;
+        # our compress() always writes it
+        size = zstandard.frame_content_size(data)
+        if size < 0:
+            raise CompressionError("Compressed payload without a content size")
+        if size > limit:
+            raise CompressionError("Decompressed payload too large")
+        return self.dctx.decompress(data)
+
+class LZ4Codec:
+    name = "lz4"
+
+    def compress(self, data) -> bytes:
+        return lz4.frame.compress(data, store_size=False)
+
+    def decompress(self, data, limit) -> bytes:
+        d = lz4.frame.LZ4FrameDecompressor()
+        out = d.decompress(data, max_length=limit + 1)
+        if len(out) > limit:
+            raise CompressionError("Decompressed payload too large")
+        if not d.eof:
+            raise CompressionError("Truncated compressed payload")
+        return out
+
+# Preference order; codecs whose module is missing are simply not offered
+CODECS = {c.name: c for c in (zstandard and ZstdCodec, lz4 and LZ4Codec, ZlibCodec) if c}
+
+def available(names=None) -> list[str]:
+    return [n for n in (names if names is not None else CODECS) if n in CODECS]
+
+class Compressor:
+    """Per-session compression, applied to the plaintext before AES-GCM.
+
+    Every plaintext gets a one-byte flag (RAW or COMPRESSED) inside the
+    ciphertext, so small or incompressible payloads go out as they are and
+    the flag is authenticated with the rest.
+    """
+
+    def __init__(self, name, min_size=MIN_SIZE, max_size=MAX_SIZE):
+        self.name = name
+        self.codec = CODECS[name]()
+        self.min_size = min_size
+        self.max_size = max_size
+
+    def wrap(self, data) -> bytes:
+        if len(data) >= self.min_size:
+            packed = self.codec.compress(data)
+            if len(packed) < len(data):
+                return COMPRESSED + packed
+        return self.store(data)
+
+    @staticmethod
+    def store(data) -> bytes:
+        """Flagged as RAW without trying to compress"""
+        return RAW + data
+
+    def unwrap(self, data) -> bytes:
+        flag, body = data[:1], memoryview(data)[1:]
+        if flag == RAW:
+            return data[1:]
+        if flag == COMPRESSED:
+            try:
+                return self.codec.decompress(body, self.max_size)
+            except CompressionError:
+                raise
+            except Exception as e:
+                raise CompressionError(f"Corrupt compressed payload: {e}") from e
+        raise CompressionError("Unknown compression flag")
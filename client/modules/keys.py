@@ -1,12 +1,18 @@
 from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import rsa, ed25519
+from functools import lru_cache
+from .crypto_utils import AESHandler, key_kind, signer
 import os
 
+@lru_cache(maxsize=8)
+def load_pem_public(pem_bytes: bytes):
+    return serialization.load_pem_public_key(pem_bytes)
+
 class ServerRSA:
     """Client-side access to server's RSA public key"""
 
     def __init__(self, pem_bytes: bytes):
-        self.pub = serialization.load_pem_public_key(pem_bytes)
+        self.pub = load_pem_public(pem_bytes)
 
     def get_pub(self):
         return self.pub
@@ -49,4 +55,85 @@ class RSAKey:
             priv = serialization.load_pem_private_key(f.read(), password=None)
         with open(pub_path, "rb") as f:
             pub = serialization.load_pem_public_key(f.read())
-        return cls(priv, pub)
\ No newline at end of file
+        return cls(priv, pub)
+
+class Identity:
+    """The client's long-term signing key, read or created on first use.
+
+    A key already on disk is used whatever its kind, since the server has
+    bound our client_id to it; `kind` only picks what a first run generates.
+    Loading is deferred so that importing the client, or building a
+    connection that resumes with a ticket, touches neither the disk nor the
+    key generator, and one Identity can be shared by many connections.
+    """
+
+    def __init__(self, key_dir=None, kind="ed25519", priv=None):
+        self.key_dir = key_dir
+        self.kind = kind
+        self._priv = priv
+        self._pub_pem = None
+        self._id_sigs = {}
+
+    @classmethod
+    def generate(cls, kind="ed25519"):
+        """In-memory identity, never written to disk"""
+        priv = ed25519.Ed25519PrivateKey.generate() if kind == "ed25519" else rsa.generate_private_key(65537, 2048)
+        return cls(kind=kind, priv=priv)
+
+    def path(self, kind, part):
+        return os.path.join(self.key_dir, f"client_{kind}_{part}.pem")
+
+    @property
+    def priv(self):
+        if self._priv is None:
+            self._priv = self.load() or self.create(self.kind)
+        return self._priv
+
+    def load(self):
+        for kind in ("rsa", "ed25519"):
+            if os.path.exists(self.path(kind, "private")):
+                with open(self.path(kind, "private"), "rb") as f:
+                    # Our own key: the RSA consistency check would cost more than the rest of startup
+                    return serialization.load_pem_private_key(f.read(), None, unsafe_skip_rsa_key_validation=True)
+        return None
+
+    def create(self, kind):
+        priv = self.generate(kind)._priv
+        os.makedirs(self.key_dir, exist_ok=True)
+        with open(self.path(kind, "private"), "wb") as f:
+            f.write(priv.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+        with open(self.path(kind, "public"), "wb") as f:
+            f.write(priv.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo))
+        return priv
+
+    def prefer(self, kind):
+        """Generate `kind` if we get to generate at all (e.g. "rsa" for servers without Ed25519)"""
+        if self._priv is None:
+            self.kind = kind
+
+    @property
+    def key_kind(self):
+        return key_kind(self.priv)
+
+    @property
+    def pub_pem(self) -> str:
+        if self._pub_pem is None:
+            self._pub_pem = self.priv.public_key().public_bytes(
+                serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+            ).decode()
+        return self._pub_pem
+
+    def sign(self, data: bytes) -> bytes:
+        return signer(self.priv).sign(self.priv, data)
+
+    def secret(self, info: bytes) -> bytes:
+        """A key for local data (e.g. history), as safe as the identity key file it is derived from"""
+        der = self.priv.private_bytes(serialization.Encoding.DER, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+        return AESHandler.derive_key(der, info=info)
+
+    def sign_id(self, client_id: str) -> bytes:
+        """Signature over our client_id, the same for every connection (the challenge is what proves freshness)"""
+        sig = self._id_sigs.get(client_id)
+        if sig is None:
+            sig = self._id_sigs[client_id] = self.sign(client_id.encode())
+        return sig
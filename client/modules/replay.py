@@ -0,0 +1,56 @@
+from collections import deque
+
+class NonceHistory:
+    """Bounded replay window: O(1) membership over the last `size` nonces"""
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.seen = set()
+        self.order = deque()
+
+    def __contains__(self, nonce):
+        return nonce in self.seen
+
+    def __len__(self):
+        return len(self.order)
+
+    def add(self, nonce: bytes):
+        if nonce in self.seen:
+            return
+        if len(self.order) >= self.size:
+            self.seen.discard(self.order.popleft())
+        self.seen.add(nonce)
+        self.order.append(nonce)
+
+class SequenceWindow:
+    """Sliding bitmap over sequence numbers: the highest one seen plus `size` bits below it"""
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.highest = -1
+        self.bits = 0  # bit i set: highest - i was seen; bits past `size` are stale until trimmed
+        self.mask = (1 << size) - 1
+        self.slack = 0  # shifts since the last trim
+
+    def __contains__(self, seq):
+        """Seen, or too old to tell: either way it must be rejected"""
+        if seq > self.highest:
+            return False
+        offset = self.highest - seq
+        return offset >= self.size or bool(self.bits >> offset & 1)
+
+    def add(self, seq: int):
+        shift = seq - self.highest
+        if shift > 0:
+            if shift >= self.size:
+                self.bits = 1
+            else:
+                self.bits = self.bits << shift | 1
+                # Trimming every time would cost a full-width AND per frame
+                self.slack += shift
+                if self.slack > self.size:
+                    self.bits &= self.mask
+                    self.slack = 0
+            self.highest = seq
+        elif -shift < self.size:
+            self.bits |= 1 << -shift
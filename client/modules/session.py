@@ -0,0 +1,362 @@
+import json, struct, time
+from .crypto_utils import AESHandler
+from .replay import SequenceWindow
+
+FRAME_VERSION = 1
+FRAME_DATA = 1
+FRAME_CHUNK = 2  # file stream chunk, sealed end to end under the stream key
+FRAME_HEADER = struct.Struct("!BB12s")
+CHUNK_ID = struct.Struct("!IQ")  # stream id, chunk index: doubles as the chunk's nonce
+COUNTER_NONCE = struct.Struct("!IQ")  # direction, sequence number
+CLIENT_DIRECTION, SERVER_DIRECTION = 0, 1 << 31
+REPLAY_WINDOW = 1024  # sequence numbers tracked below the highest one seen
+EPOCH_MASK = 0xFFFF  # key epoch bits in a ratchet nonce's direction word
+REKEY_FRAMES = 100_000  # frames sent under one key before ratcheting
+REKEY_SECONDS = 3600  # age of a sending key before ratcheting
+MAX_EPOCH_SKIP = 16  # key epochs a receiver derives forward in one go
+
+class ReplayError(ValueError):
+    pass
+
+class JSONFraming:
+    """Original text framing: {"nonce": hex, "ciphertext": hex} around a JSON payload"""
+    name = "json"
+
+    @staticmethod
+    def pack(nonce: bytes, ct: bytes) -> str:
+        return json.dumps({"nonce": nonce.hex(), "ciphertext": ct.hex()})
+
+    @staticmethod
+    def unpack(message) -> tuple[bytes, bytes]:
+        data = json.loads(message)
+        return bytes.fromhex(data["nonce"]), bytes.fromhex(data["ciphertext"])
+
+    @staticmethod
+    def encode(payload: dict) -> bytes:
+        return json.dumps(payload).encode()
+
+    @staticmethod
+    def decode(raw: bytes) -> dict:
+        return json.loads(raw)
+
+class BinaryFraming:
+    """Binary websocket frames: version | type | 12-byte nonce | raw GCM ciphertext"""
+    name = "binary"
+
+    @staticmethod
+    def pack(nonce: bytes, ct: bytes, frame_type=FRAME_DATA) -> bytes:
+        return FRAME_HEADER.pack(FRAME_VERSION, frame_type, nonce) + ct
+
+    @staticmethod
+    def unpack(message) -> tuple[bytes, bytes]:
+        if not isinstance(message, bytes) or len(message) < FRAME_HEADER.size:
+            raise ValueError("Malformed binary frame")
+        version, frame_type, nonce = FRAME_HEADER.unpack_from(message)
+        if version != FRAME_VERSION or frame_type != FRAME_DATA:
+            raise ValueError(f"Unsupported frame {version}/{frame_type}")
+        return nonce, memoryview(message)[FRAME_HEADER.size:]
+
+    @staticmethod
+    def encode(payload: dict) -> bytes:
+        out = bytearray()
+        _pack_value(out, payload)
+        return bytes(out)
+
+    @staticmethod
+    def decode(raw: bytes) -> dict:
+        try:
+            value, end = _unpack_value(memoryview(raw), 0)
+        except (IndexError, struct.error, RecursionError) as e:
+            # Truncated, or claiming more than is there: every malformed payload is a ValueError
+            raise ValueError(f"Malformed payload: {e}") from None
+        if end != len(raw) or not isinstance(value, dict):
+            raise ValueError("Malformed payload")
+        return value
+
+FRAMINGS = {f.name: f for f in (BinaryFraming, JSONFraming)}
+
+class CounterNonces:
+    """Deterministic nonces: direction bit | 64-bit counter, unique per key by construction.
+
+    Each side counts its own frames from 0, so no randomness is needed, and
+    replay detection is a SequenceWindow instead of a store of past nonces.
+    Frames carrying our own direction (reflected back at us) are rejected.
+    """
+    name = "counter"
+    epoch_mask = 0  # no key epochs: the direction word is the direction alone
+
+    def __init__(self, is_server, window=REPLAY_WINDOW):
+        self.send_direction = SERVER_DIRECTION if is_server else CLIENT_DIRECTION
+        self.recv_direction = CLIENT_DIRECTION if is_server else SERVER_DIRECTION
+        self.counter = 0
+        self.window = SequenceWindow(window)
+
+    def next(self) -> bytes:
+        nonce = COUNTER_NONCE.pack(self.send_direction, self.counter)
+        self.counter += 1
+        return nonce
+
+    def sequence(self, nonce) -> int:
+        """Sequence number of an incoming nonce; ReplayError if it may not be accepted"""
+        try:
+            direction, seq = COUNTER_NONCE.unpack(nonce)
+        except struct.error:
+            raise ValueError("Malformed nonce") from None
+        if direction & ~self.epoch_mask != self.recv_direction:
+            raise ReplayError("Nonce from the wrong direction")
+        if seq in self.window:
+            raise ReplayError("Replayed sequence number")
+        return seq
+
+    def seal_key(self, aesgcm):
+        return aesgcm
+
+    def open_key(self, nonce, aesgcm):
+        """(key for this nonce, state for accept())"""
+        return aesgcm, None
+
+    def accept(self, seq, pending):
+        """The frame authenticated: record it"""
+        self.window.add(seq)
+
+def ratchet_secret(secret: bytes, direction: int) -> bytes:
+    return AESHandler.derive_key(secret, info=b"shield-chat rekey " + (b"s2c" if direction else b"c2s"))
+
+class RatchetNonces(CounterNonces):
+    """Counter nonces plus in-session rekeying, one HKDF chain per direction.
+
+    The sender moves to the next key after rekey_frames frames or
+    rekey_seconds and carries the key epoch in the low bits of the nonce's
+    direction word. The receiver derives forward when a frame from a newer
+    epoch authenticates, and keeps the previous key for frames still in
+    flight. Nothing is exchanged, so rotation never waits on the peer, and
+    dropped keys cannot be recomputed from the current one. The ratchet owns
+    every key of the session: the handshake key is only held as epoch 0 of
+    each chain and is dropped like any other.
+    """
+    name = "ratchet"
+    epoch_mask = EPOCH_MASK
+
+    def __init__(self, is_server, key, rekey_frames=REKEY_FRAMES, rekey_seconds=REKEY_SECONDS, window=REPLAY_WINDOW):
+        super().__init__(is_server, window)
+        self.rekey_frames = rekey_frames
+        self.rekey_seconds = rekey_seconds
+        self.send_secret = self.recv_secret = key
+        self.send_aesgcm = self.recv_aesgcm = AESHandler.make(key)
+        self.send_epoch = self.recv_epoch = 0
+        self.recv_tag = bytes(2)  # recv_epoch as it appears in nonce[2:4]
+        self.prev_aesgcm = None
+        self.sent = 0
+        self.rotated_at = time.monotonic()
+
+    def rotate(self):
+        self.send_secret = ratchet_secret(self.send_secret, self.send_direction)
+        self.send_aesgcm = AESHandler.make(self.send_secret)
+        self.send_epoch += 1
+        self.sent = 0
+        self.rotated_at = time.monotonic()
+
+    def next(self) -> bytes:
+        if self.sent >= self.rekey_frames or time.monotonic() - self.rotated_at >= self.rekey_seconds:
+            self.rotate()
+        self.sent += 1
+        nonce = COUNTER_NONCE.pack(self.send_direction | self.send_epoch & EPOCH_MASK, self.counter)
+        self.counter += 1
+        return nonce
+
+    def seal_key(self, aesgcm):
+        return self.send_aesgcm
+
+    def open_key(self, nonce, aesgcm):
+        if nonce[2:4] == self.recv_tag:
+            return self.recv_aesgcm, None
+        ahead = (int.from_bytes(nonce[2:4], "big") - self.recv_epoch) & EPOCH_MASK
+        if ahead == EPOCH_MASK:
+            if self.prev_aesgcm is None:
+                raise ReplayError("Frame from a discarded key epoch")
+            return self.prev_aesgcm, None
+        if ahead > MAX_EPOCH_SKIP:
+            raise ValueError("Unknown key epoch")
+        # Only a frame that authenticates under the derived key moves us forward
+        secret = self.recv_secret
+        for _ in range(ahead):
+            secret = ratchet_secret(secret, self.recv_direction)
+        candidate = AESHandler.make(secret)
+        return candidate, (ahead, secret, candidate)
+
+    def accept(self, seq, pending):
+        self.window.add(seq)
+        if pending:
+            ahead, self.recv_secret, key = pending
+            self.prev_aesgcm = self.recv_aesgcm if ahead == 1 else None
+            self.recv_aesgcm = key
+            self.recv_epoch += ahead
+            self.recv_tag = (self.recv_epoch & EPOCH_MASK).to_bytes(2, "big")
+
+NONCE_MODES = {n.name: n for n in (RatchetNonces, CounterNonces)}
+
+def is_chunk(message) -> bool:
+    return isinstance(message, bytes) and len(message) > FRAME_HEADER.size and message[0] == FRAME_VERSION and message[1] == FRAME_CHUNK
+
+def chunk_id(message) -> tuple[int, int]:
+    """(stream id, index) of a chunk frame, readable without its key"""
+    return CHUNK_ID.unpack_from(message, 2)
+
+def seal_chunk(aesgcm, stream_id: int, index: int, data) -> bytes:
+    """Chunk frame: the header is the AAD, the nonce comes from the stream counter"""
+    header = FRAME_HEADER.pack(FRAME_VERSION, FRAME_CHUNK, CHUNK_ID.pack(stream_id, index))
+    return header + AESHandler.encrypt_at(aesgcm, header[2:], data, header)
+
+def open_chunk(aesgcm, message) -> bytes:
+    view = memoryview(message)
+    header = view[:FRAME_HEADER.size]
+    return AESHandler.decrypt_at(aesgcm, header[2:], view[FRAME_HEADER.size:], header)
+
+# Compact payload encoding: one tag byte per value, lowercase tags carry a
+# 1-byte length/count, uppercase ones a 4-byte length/count.
+_U8, _U32, _I64, _F64 = struct.Struct("!B"), struct.Struct("!I"), struct.Struct("!q"), struct.Struct("!d")
+
+def _pack_len(out, tag, n):
+    if n < 256:
+        out += tag.lower()
+        out += _U8.pack(n)
+    else:
+        out += tag
+        out += _U32.pack(n)
+
+def _pack_value(out, value):
+    if isinstance(value, str):
+        raw = value.encode()
+        _pack_len(out, b"S", len(raw))
+        out += raw
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        _pack_len(out, b"B", len(value))
+        out += value
+    elif value is None:
+        out += b"N"
+    elif value is True:
+        out += b"T"
+    elif value is False:
+        out += b"F"
+    elif isinstance(value, int):
+        out += b"I"
+        out += _I64.pack(value)
+    elif isinstance(value, float):
+        out += b"D"
+        out += _F64.pack(value)
+    elif isinstance(value, dict):
+        _pack_len(out, b"M", len(value))
+        for k, v in value.items():
+            raw = k.encode()
+            out += _U8.pack(len(raw))
+            out += raw
+            _pack_value(out, v)
+    elif isinstance(value, (list, tuple)):
+        _pack_len(out, b"L", len(value))
+        for v in value:
+            _pack_value(out, v)
+    else:
+        raise TypeError(f"Cannot encode {type(value).__name__}")
+
+def _unpack_len(buf, pos, tag):
+    if tag.islower():
+        return buf[pos], pos + 1
+    return _U32.unpack_from(buf, pos)[0], pos + 4
+
+def _unpack_value(buf, pos):
+    tag = chr(buf[pos])
+    pos += 1
+    if tag in "sS":
+        n, pos = _unpack_len(buf, pos, tag)
+        return str(buf[pos:pos + n], "utf-8"), pos + n
+    if tag in "bB":
+        n, pos = _unpack_len(buf, pos, tag)
+        return bytes(buf[pos:pos + n]), pos + n
+    if tag == "N":
+        return None, pos
+    if tag == "T":
+        return True, pos
+    if tag == "F":
+        return False, pos
+    if tag == "I":
+        return _I64.unpack_from(buf, pos)[0], pos + 8
+    if tag == "D":
+        return _F64.unpack_from(buf, pos)[0], pos + 8
+    if tag in "mM":
+        n, pos = _unpack_len(buf, pos, tag)
+        result = {}
+        for _ in range(n):
+            klen = buf[pos]
+            key = str(buf[pos + 1:pos + 1 + klen], "utf-8")
+            result[key], pos = _unpack_value(buf, pos + 1 + klen)
+        return result, pos
+    if tag in "lL":
+        n, pos = _unpack_len(buf, pos, tag)
+        result = []
+        for _ in range(n):
+            value, pos = _unpack_value(buf, pos)
+            result.append(value)
+        return result, pos
+    raise ValueError(f"Unknown payload tag {tag!r}")
+
+class Session:
+    """Established AES-GCM session: seals/opens payloads in the negotiated framing and compression"""
+
+    def __init__(self, aesgcm, framing=JSONFraming, replay=None, compressor=None, nonces=None):
+        self.aesgcm = aesgcm  # None under RatchetNonces, which keeps the keys itself
+        self.framing = framing
+        self.replay = replay  # random nonces: NonceHistory, if the caller wants replays caught
+        self.compressor = compressor
+        self.nonces = nonces  # CounterNonces or RatchetNonces, when negotiated
+
+    @property
+    def encoding(self):
+        """Sessions with equal encodings share prepare() output"""
+        return self.framing, self.compressor.name if self.compressor else None
+
+    def prepare(self, payload: dict) -> bytes:
+        """Plaintext ready for seal_prepared: encoded, then compressed"""
+        return self.compress(self.framing.encode(payload))
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.wrap(data) if self.compressor else data
+
+    def seal_prepared(self, data: bytes):
+        if self.nonces is not None:
+            nonce = self.nonces.next()
+            return self.framing.pack(nonce, AESHandler.encrypt_at(self.nonces.seal_key(self.aesgcm), nonce, data))
+        nonce, ct = AESHandler.encrypt_bytes(self.aesgcm, data)
+        return self.framing.pack(nonce, ct)
+
+    def seal_bytes(self, data: bytes):
+        return self.seal_prepared(self.compress(data))
+
+    def open_bytes(self, message) -> bytes:
+        nonce, ct = self.framing.unpack(message)
+        if self.nonces is not None:
+            seq = self.nonces.sequence(nonce)
+            key, pending = self.nonces.open_key(nonce, self.aesgcm)
+            data = AESHandler.decrypt_at(key, nonce, ct)
+            self.nonces.accept(seq, pending)
+        else:
+            if self.replay is not None and nonce in self.replay:
+                raise ReplayError("Replayed nonce")
+            data = AESHandler.decrypt_bytes(self.aesgcm, nonce, ct)
+            if self.replay is not None:
+                self.replay.add(nonce)
+        return self.compressor.unwrap(data) if self.compressor else data
+
+    def encode(self, payload: dict) -> bytes:
+        return self.framing.encode(payload)
+
+    def seal(self, payload: dict):
+        return self.seal_prepared(self.prepare(payload))
+
+    def seal_mixed(self, payload: dict):
+        """Seal a payload carrying several senders' plaintext, uncompressed: compressed together,
+        the frame length would tell one sender how much its text shares with another's"""
+        data = self.framing.encode(payload)
+        return self.seal_prepared(self.compressor.store(data) if self.compressor else data)
+
+    def open(self, message) -> dict:
+        return self.framing.decode(self.open_bytes(message))
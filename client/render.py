@@ -0,0 +1,106 @@
+import curses, time
+
+MAX_FPS = 30  # redraws per second at most while messages pour in
+BORDER_COLOR = 4
+
+class ChatRenderer:
+    """Draws the boxed screen of main.py, repainting only what changed.
+
+    The border, title and prompt are drawn on stdscr once per layout (size
+    and title); message rows live in their own window. Each frame compares
+    the rows it would show with the rows on screen and rewrites only those
+    that differ. When the same list is scrolled (new messages pushing it up,
+    or up/down) the window is scrolled, so curses can emit a terminal scroll
+    and paint just the uncovered rows. The cursor stays wherever the prompt
+    reader left it, so half-typed input survives incoming messages.
+    """
+
+    def __init__(self, stdscr, max_fps=MAX_FPS, border_color=BORDER_COLOR):
+        self.stdscr = stdscr
+        self.max_fps = max_fps
+        self.border_color = border_color
+        self.layout = None  # (height, width, title) the frame was drawn for
+        self.body = None
+        self.rows = []  # (text, color) on each body row, None when blank
+        self.lines = None  # the list those rows came from
+        self.top = 0  # and the position of its first shown line, counting lines dropped from or added at its front
+        self.last_frame = 0.0
+        self.stats = {"frames": 0, "layouts": 0, "rows": 0, "scrolls": 0}
+
+    def frame_delay(self) -> float:
+        """Seconds until the next frame is allowed"""
+        return max(0.0, self.last_frame + 1 / self.max_fps - time.monotonic())
+
+    def text_width(self) -> int:
+        """Characters a message line may use, inside the box and its margin"""
+        return max(1, self.stdscr.getmaxyx()[1] - 8)
+
+    def following(self, lines) -> bool:
+        """Whether lines is on screen down to its last line, so appends should scroll it"""
+        return lines is self.lines and self.top - getattr(lines, "start", 0) + len(self.rows) >= len(lines)
+
+    def draw(self, title, lines, offset, prompt=False) -> int:
+        """Show lines[offset:] under title; returns the offset clamped to what fits. prompt resets the input line."""
+        h, w = self.stdscr.getmaxyx()
+        if self.layout != (h, w, title):
+            self.draw_frame(h, w, title)
+            prompt = True
+        visible = len(self.rows)
+        offset = max(0, min(offset, len(lines) - visible))
+        self.draw_rows(lines, offset)
+        self.body.noutrefresh()
+        if prompt:
+            self.stdscr.move(h - 2, 2)
+            self.stdscr.clrtoeol()
+            self.stdscr.addstr(h - 2, 2, "> ", curses.color_pair(self.border_color))
+        # Untouched, stdscr only contributes the cursor position
+        self.stdscr.noutrefresh()
+        curses.doupdate()
+        self.last_frame = time.monotonic()
+        self.stats["frames"] += 1
+        return offset
+
+    def draw_frame(self, h, w, title):
+        box_height, box_width = h - 4, w - 4
+        start_y = start_x = 2
+        attr = curses.color_pair(self.border_color)
+        scr = self.stdscr
+        scr.erase()
+        scr.addstr(start_y, start_x, '┌' + '─' * (box_width - 2) + '┐', attr)
+        for y in range(1, box_height - 1):
+            scr.addstr(start_y + y, start_x, '│', attr)
+            scr.addstr(start_y + y, start_x + box_width - 1, '│', attr)
+        scr.addstr(start_y + box_height - 1, start_x, '└' + '─' * (box_width - 2) + '┘', attr)
+        scr.addstr(start_y, start_x + 2, f" {title} ", attr | curses.A_BOLD)
+        scr.noutrefresh()
+        visible = max(1, box_height - 3)
+        self.body = curses.newwin(visible, max(2, box_width - 3), start_y + 1, start_x + 2)
+        self.body.scrollok(True)
+        self.body.idlok(True)
+        self.rows = [None] * visible
+        self.lines = None
+        self.layout = (h, w, title)
+        self.stats["layouts"] += 1
+
+    def draw_rows(self, lines, offset):
+        body, rows = self.body, self.rows
+        visible = len(rows)
+        # Lines evicted from or added at the front (ChatBuffer) move every index; compare absolute positions
+        top = offset + getattr(lines, "start", 0)
+        shift = top - self.top if lines is self.lines else 0
+        if shift and abs(shift) < visible:
+            body.scroll(shift)
+            rows[:] = rows[shift:] + [None] * shift if shift > 0 else [None] * -shift + rows[:shift]
+            self.stats["scrolls"] += 1
+        width = body.getmaxyx()[1] - 1  # never write the last column, which would wrap
+        shown = lines[offset:offset + visible]
+        for y in range(visible):
+            line = shown[y] if y < len(shown) else None
+            if line != rows[y]:
+                body.move(y, 0)
+                body.clrtoeol()
+                if line:
+                    body.addstr(y, 0, line[0][:width], curses.color_pair(line[1]))
+                rows[y] = line
+                self.stats["rows"] += 1
+        self.lines, self.top = lines, top
@@ -0,0 +1,228 @@
+import asyncio, hashlib, os, random
+from modules.crypto_utils import AESHandler
+from modules.session import BinaryFraming, seal_chunk, open_chunk, chunk_id
+
+CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+WINDOW = 32  # chunks in flight before waiting for an ack
+ACCEPT_TIMEOUT = 30
+ACK_TIMEOUT = 5  # seconds without progress before resending from the last ack
+MAX_FILE_SIZE = 4 * 1024 ** 3
+
+class TransferError(Exception):
+    pass
+
+class OutgoingFile:
+    def __init__(self, path, target, stream_id, chunk_size):
+        st = os.stat(path)
+        self.path = path
+        self.target = target
+        self.stream_id = stream_id
+        self.chunk_size = chunk_size
+        self.size = st.st_size
+        self.chunks = -(-self.size // chunk_size)
+        # Same file, same id: lets the recipient resume a partial download
+        self.file_id = hashlib.sha256(f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}".encode()).hexdigest()[:32]
+        self.key = os.urandom(32)
+        self.aesgcm = AESHandler.make(self.key)
+        self.acked = 0  # the recipient holds every chunk below this
+        self.next = 0
+        self.sealed = {}  # index -> chunk frame, until acked: a resend must not reseal what may have changed on disk
+        self.accepted = asyncio.get_running_loop().create_future()
+        self.progress = asyncio.Event()
+
+class IncomingFile:
+    def __init__(self, sender, offer, directory):
+        if not (all(isinstance(offer[k], str) for k in ("file", "name", "key"))
+                and all(isinstance(offer.get(k, WINDOW), int) for k in ("size", "chunk", "window"))):
+            raise TransferError("Malformed offer")
+        if not all(c in "0123456789abcdef" for c in offer["file"]) or not 0 < offer["chunk"] <= MAX_CHUNK_SIZE:
+            raise TransferError("Malformed offer")
+        self.sender = sender
+        self.name = os.path.basename(offer["name"].replace("\\", "/")) or "file"
+        self.size = offer["size"]
+        self.chunk_size = offer["chunk"]
+        self.ack_every = max(1, offer.get("window", WINDOW) // 2)
+        self.aesgcm = AESHandler.make(bytes.fromhex(offer["key"]))
+        self.directory = directory
+        self.part_path = os.path.join(directory, f".{hashlib.sha256(sender.encode()).hexdigest()[:16]}-{offer['file']}.part")
+        self.file = open(self.part_path, "ab")
+        # Resume after the last whole chunk we already have
+        self.expected = min(self.file.tell(), self.size) // self.chunk_size
+        self.file.truncate(self.expected * self.chunk_size)
+        self.file.seek(self.expected * self.chunk_size)
+        self.received = self.expected * self.chunk_size
+        self.nacked = None
+
+    def finish(self):
+        self.file.close()
+        base, ext = os.path.splitext(self.name)
+        path, n = os.path.join(self.directory, self.name), 1
+        while os.path.exists(path):
+            path, n = os.path.join(self.directory, f"{base} ({n}){ext}"), n + 1
+        os.replace(self.part_path, path)
+        return path
+
+class Transfers:
+    """File streams over a Channel.
+
+    The sender offers a file with a fresh stream key; chunks are then sealed
+    under that key with the (stream id, index) counter as nonce and relayed by
+    the server untouched. Resends reuse the frames sealed the first time, so a
+    nonce never covers two plaintexts. The recipient acks every half window,
+    nacks gaps, and resumes partial downloads of the same file from the last
+    whole chunk. Offers are only taken when accept(sender, offer) says so.
+    """
+
+    def __init__(self, channel, directory, on_received=None, chunk_size=CHUNK_SIZE, window=WINDOW, max_size=MAX_FILE_SIZE, accept=None):
+        self.channel = channel
+        self.directory = directory
+        self.on_received = on_received
+        self.accept = accept
+        self.chunk_size = chunk_size
+        self.window = window
+        self.max_size = max_size
+        self.outgoing = {}
+        self.incoming = {}
+        self.completed = {}  # finished downloads, kept to re-ack until the sender says done
+
+    def control(self, payload):
+        asyncio.create_task(self.channel.send_now({"type": "file", **payload}))
+
+    async def send_file(self, path, target):
+        """Stream path to target; returns once the recipient has all of it"""
+        if self.channel.session.framing is not BinaryFraming:
+            raise TransferError("File transfer needs the binary framing")
+        stream_id = random.getrandbits(32)
+        while stream_id in self.outgoing:
+            stream_id = random.getrandbits(32)
+        f = self.outgoing[stream_id] = OutgoingFile(path, target, stream_id, self.chunk_size)
+        try:
+            await self.channel.send_now({"type": "file", "op": "offer", "stream": stream_id, "target": target, "file": f.file_id,
+                                         "name": os.path.basename(path), "size": f.size, "chunk": f.chunk_size,
+                                         "window": self.window, "key": f.key.hex()})
+            f.acked = f.next = await asyncio.wait_for(f.accepted, ACCEPT_TIMEOUT)
+            buf = bytearray(f.chunk_size)
+            view = memoryview(buf)
+            with open(path, "rb") as fh:
+                while f.acked < f.chunks:
+                    if f.next < min(f.chunks, f.acked + self.window):
+                        frame = f.sealed.get(f.next)
+                        if frame is None:
+                            fh.seek(f.next * f.chunk_size)
+                            n = fh.readinto(buf)
+                            if n != min(f.chunk_size, f.size - f.next * f.chunk_size):
+                                raise TransferError("File changed while sending")
+                            frame = f.sealed[f.next] = seal_chunk(f.aesgcm, stream_id, f.next, view[:n])
+                        await self.channel.send_raw(frame)
+                        f.next += 1
+                        continue
+                    f.progress.clear()
+                    try:
+                        await asyncio.wait_for(f.progress.wait(), ACK_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        f.next = f.acked  # resend whatever was never acknowledged
+            await self.channel.send_now({"type": "file", "op": "done", "stream": stream_id, "target": target})
+        except BaseException:
+            try: await self.channel.send_now({"type": "file", "op": "cancel", "stream": stream_id, "target": target})
+            except Exception: pass
+            raise
+        finally:
+            del self.outgoing[stream_id]
+        return f
+
+    def on_control(self, payload):
+        # Peers write these: a malformed one must not take our receive loop down with it
+        try:
+            self.handle_control(payload)
+        except Exception:
+            pass
+
+    def handle_control(self, payload):
+        op, stream_id, sender = payload.get("op"), payload.get("stream"), payload.get("sender")
+        if op == "offer":
+            self.on_offer(sender, payload)
+            return
+        f = self.outgoing.get(stream_id)
+        if f is not None and f.target == sender:
+            position = payload.get("from" if op == "accept" else "next", 0)
+            if not isinstance(position, int):
+                return
+            if op == "accept" and not f.accepted.done():
+                f.accepted.set_result(max(0, min(position, f.chunks)))
+            elif op == "reject" and not f.accepted.done():
+                f.accepted.set_exception(TransferError(payload.get("reason", "Rejected")))
+            elif op in ("ack", "nack"):
+                # Both mean "I hold everything below next"; a nack also asks to resend from there
+                acked = max(f.acked, min(position, f.chunks))
+                for index in range(f.acked, acked):
+                    f.sealed.pop(index, None)
+                f.acked = acked
+                f.next = f.acked if op == "nack" else max(f.next, f.acked)
+                f.progress.set()
+            return
+        if op in ("done", "cancel"):
+            if stream_id in self.completed and self.completed[stream_id].sender == sender:
+                del self.completed[stream_id]
+            incoming = self.incoming.get(stream_id)
+            if incoming is not None and incoming.sender == sender:
+                incoming.file.close()  # on cancel the .part file stays for a later resume
+                del self.incoming[stream_id]
+
+    def on_offer(self, sender, offer):
+        stream_id = offer.get("stream")
+        if not isinstance(stream_id, int) or not isinstance(sender, str):
+            return
+        try:
+            if self.accept is None or not self.accept(sender, offer):
+                raise TransferError("Not accepted")
+            if stream_id in self.incoming:
+                raise TransferError("Stream id in use")
+            if not isinstance(offer["size"], int):
+                raise TransferError("Malformed offer")
+            if not 0 <= offer["size"] <= self.max_size:
+                raise TransferError("File too large")
+            os.makedirs(self.directory, exist_ok=True)
+            f = IncomingFile(sender, offer, self.directory)
+        except (TransferError, KeyError, TypeError, ValueError, AttributeError, OSError) as e:
+            self.control({"op": "reject", "stream": stream_id, "target": sender, "reason": str(e)})
+            return
+        self.incoming[stream_id] = f
+        self.control({"op": "accept", "stream": stream_id, "target": sender, "from": f.expected})
+        if f.received >= f.size:
+            self.complete(stream_id, f)
+
+    def on_chunk(self, frame):
+        stream_id, index = chunk_id(frame)
+        f = self.incoming.get(stream_id)
+        if f is None:
+            done = self.completed.get(stream_id)
+            if done is not None:  # our final ack was lost
+                self.control({"op": "ack", "stream": stream_id, "target": done.sender, "next": done.expected})
+            return
+        if index != f.expected:
+            if index > f.expected and f.nacked != f.expected:
+                f.nacked = f.expected
+                self.control({"op": "nack", "stream": stream_id, "target": f.sender, "next": f.expected})
+            return
+        try:
+            data = open_chunk(f.aesgcm, frame)
+        except Exception:
+            return  # treated as lost: the next chunk triggers a nack
+        if f.received + len(data) > f.size:
+            return
+        f.file.write(data)
+        f.received += len(data)
+        f.expected += 1
+        if f.received >= f.size:
+            self.complete(stream_id, f)
+        elif f.expected % f.ack_every == 0:
+            self.control({"op": "ack", "stream": stream_id, "target": f.sender, "next": f.expected})
+
+    def complete(self, stream_id, f):
+        path = f.finish()
+        self.control({"op": "ack", "stream": stream_id, "target": f.sender, "next": f.expected})
+        self.incoming.pop(stream_id, None)
+        self.completed[stream_id] = f
+        if self.on_received:
+            self.on_received(f.sender, path)
@@ -1,102 +1,338 @@
-import asyncio, json, uuid
+import asyncio, struct, time
 from collections import deque
-from modules.crypto_utils import AESHandler, RSAHandler
+from modules.log import log
+from modules.replay import NonceHistory
+from modules.session import ReplayError, BinaryFraming, is_chunk, chunk_id
+from modules.outbound import OutboundQueue
+from modules.crypto_utils import key_kind
 from cryptography.hazmat.primitives import serialization
 import os
 
-CLIENT_KEYS_FILE = "./storage/client_keys.json"
-
 class ServerConnection:
-    def __init__(self, ws, server_rsa, clients_map):
+    def __init__(self, ws, server):
         self.ws = ws
-        self.server_rsa = server_rsa
-        self.aesgcm = None
-        self.clients_map = clients_map
+        self.server = server
+        self.server_rsa = server.server_rsa
+        self.session = None
+        self.clients_map = server.clients_map
         self.client_id = None
         self.client_pub = None
-        self.used_nonces = []
-        self.client_keys = self.load_client_keys()
+        self.features = set()
+        self.streams = {}  # file stream id -> recipient, for chunk frames we relay
+        self.client_keys = server.client_keys
+        self.crypto_pool = server.crypto_pool
+        self.outbound = OutboundQueue(ws, server.outbound_queue_size, server.outbound_policy, server.outbound_spill_limit, server.metrics)
+        self.backlog = deque()  # mail still to deliver, encoded
+        self.backlog_task = None
 
-    def load_client_keys(self):
-        if os.path.exists(CLIENT_KEYS_FILE):
-            with open(CLIENT_KEYS_FILE, "r") as f:
-                return json.load(f)
-        return {}
+    async def handshake(self):
+        from modules.protocol import Handshake, RESUME_HEADER
 
-    def save_client_keys(self):
-        os.makedirs(os.path.dirname(CLIENT_KEYS_FILE), exist_ok=True)
-        with open(CLIENT_KEYS_FILE, "w") as f:
-            json.dump(self.client_keys, f)
+        start = time.perf_counter()
+        request = getattr(self.ws, "request", None)
+        h = Handshake(self.ws, rsa_priv=self.server_rsa.priv, rsa_pub=self.server_rsa.pub, is_server=True, crypto_pool=self.crypto_pool,
+                      tickets=self.server.tickets, resume_request=request.headers.get(RESUME_HEADER) if request else None,
+                      features=("batch", "ed25519") if self.server.ed25519_identities else ("batch",), compression=self.server.compression,
+                      compress_min=self.server.compress_min_size, decompress_max=self.server.decompress_max_size,
+                      nonces=("ratchet", "counter") if self.server.counter_nonces else (),
+                      rekey_frames=self.server.rekey_frames, rekey_seconds=self.server.rekey_seconds, key_pool=self.server.key_pool)
+        self.session = await h.run()
+        if self.session.nonces is None:
+            # Random nonces: remember recent ones to catch replays (counter nonces carry their own window)
+            self.session.replay = NonceHistory(self.server.nonce_history_size)
 
-    async def handshake(self):
-        from modules.protocol import Handshake
+        if h.resumed:
+            proposed_id = h.resumed.client_id
+            self.features = set(h.resumed.features)
+            if proposed_id in self.clients_map or self.server.router.lookup(proposed_id) is not None:
+                raise ValueError("Client ID already in use!")
+        else:
+            proposed_id = await self.authenticate(h)
 
-        h = Handshake(self.ws, rsa_priv=self.server_rsa.priv, rsa_pub=self.server_rsa.pub, is_server=True)
-        self.aesgcm = await h.run()
+        self.client_id = proposed_id
+        self.clients_map[self.client_id] = self
+        self.server.router.register(self.client_id)
+        self.server.presence.changed(self.client_id, True)
+        self.outbound.start()
+        if "resume" in self.features:
+            self.issue_ticket()
+        if self.server.mailbox is not None:
+            backlog = self.server.mailbox.take(self.client_id)
+            if backlog:
+                self.queue_backlog(backlog)
+        self.record_handshake(h, time.perf_counter() - start)
+        log.info("handshake", client_id=self.client_id, resumed=bool(h.resumed))
 
-        msg = await self.ws.recv()
-        data = json.loads(msg)
-        payload = json.loads(AESHandler.decrypt(self.aesgcm, bytes.fromhex(data["nonce"]), bytes.fromhex(data["ciphertext"])))
+    def record_handshake(self, h, elapsed):
+        metrics = self.server.metrics
+        (metrics.handshakes_resumed if h.resumed else metrics.handshakes_full).inc()
+        if not h.resumed:
+            metrics.handshake_keys["pool" if h.pooled else "inline"].inc()
+        metrics.handshake_seconds.observe(elapsed)
+        metrics.handshake_phase["rsa"].observe(h.timings["rsa"])
+        metrics.handshake_phase["x25519"].observe(h.timings["x25519"])
+        metrics.handshake_phase["io"].observe(max(0.0, elapsed - h.timings["rsa"] - h.timings["x25519"]))
+
+    async def authenticate(self, h):
+        """Full authentication: signed client_id, then an RSA challenge-response"""
+        payload = self.session.open(await self.ws.recv())
         proposed_id = payload["client_id"]
         signature = bytes.fromhex(payload["signature"])
         pub_key_str = payload["pub_key"]
+        self.features = set(payload.get("features", ()))
 
-        if proposed_id in self.client_keys:
-            self.client_pub = serialization.load_pem_public_key(self.client_keys[proposed_id].encode())
-        else:
+        self.client_pub = await self.client_keys.lookup(proposed_id)
+        if self.client_pub is None:
             self.client_pub = serialization.load_pem_public_key(pub_key_str.encode())
-            self.client_keys[proposed_id] = pub_key_str
-            self.save_client_keys()
+            kind = key_kind(self.client_pub)
+            if kind is None or (kind == "ed25519" and not self.server.ed25519_identities):
+                raise ValueError("Unsupported client key type!")
 
-        if not RSAHandler.verify(self.client_pub, proposed_id.encode(), signature):
+        with h.timed("rsa"):
+            valid = await self.crypto_pool.verify(self.client_pub, proposed_id.encode(), signature)
+        if not valid:
             raise ValueError("Invalid client signature!")
 
-        if proposed_id in self.clients_map:
+        if proposed_id in self.clients_map or self.server.router.lookup(proposed_id) is not None:
             raise ValueError("Client ID already in use!")
 
         challenge = os.urandom(16)
-        n, c = AESHandler.encrypt(self.aesgcm, challenge.hex())
-        await self.ws.send(json.dumps({"nonce": n.hex(), "ciphertext": c.hex()}))
+        await self.ws.send(self.session.seal_bytes(challenge.hex().encode()))
 
-        resp_msg = await self.ws.recv()
-        resp_data = json.loads(resp_msg)
-        resp_plain = AESHandler.decrypt(self.aesgcm, bytes.fromhex(resp_data["nonce"]), bytes.fromhex(resp_data["ciphertext"]))
-        resp_sig = bytes.fromhex(resp_plain)
+        resp_sig = bytes.fromhex(self.session.open_bytes(await self.ws.recv()).decode())
 
-        if not RSAHandler.verify(self.client_pub, challenge, resp_sig):
+        with h.timed("rsa"):
+            valid = await self.crypto_pool.verify(self.client_pub, challenge, resp_sig)
+        if not valid:
             raise ValueError("Challenge failed! Invalid client signature.")
 
-        self.client_id = proposed_id
-        self.clients_map[self.client_id] = self
-        print(f"[*] Handshake complete, client_id: {self.client_id}")
+        if proposed_id not in self.client_keys:
+            if self.client_keys.register(proposed_id, pub_key_str, self.client_pub) is not self.client_pub:
+                raise ValueError("Client ID registered concurrently with another key!")
+        return proposed_id
+
+    def issue_ticket(self):
+        ticket_id, secret = self.server.tickets.issue(self.client_id, self.features, self.session.encoding[1],
+                                                   self.session.nonces and self.session.nonces.name)
+        self.outbound.put(self.session.seal({"type": "ticket", "id": ticket_id.hex(), "secret": secret.hex(), "ttl": self.server.tickets.ttl}))
+
+    def queue_backlog(self, backlog):
+        """Deliver mail in the background, after any still being delivered"""
+        self.backlog.extend(backlog)
+        if self.backlog_task is None or self.backlog_task.done():
+            self.backlog_task = asyncio.create_task(self.deliver_backlog())
+            self.backlog_task.add_done_callback(self.backlog_done)
 
+    def backlog_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            log.warning("backlog_failed", client_id=self.client_id, error=task.exception())
+
+    async def deliver_backlog(self):
+        """Flush mail held while offline, many payloads per frame for clients that batch.
+
+        Whatever the client does not take before it drops goes back to the mailbox.
+        """
+        size = self.server.mailbox_batch if "batch" in self.features else 1
+        backlog = self.backlog
+        try:
+            while backlog:
+                raws = [backlog.popleft() for _ in range(min(size, len(backlog)))]
+                items = []
+                for raw in raws:
+                    try:
+                        items.append(BinaryFraming.decode(raw))
+                    except Exception as e:
+                        log.warning("backlog_failed", client_id=self.client_id, error=e)
+                if not items:
+                    continue
+                if "batch" in self.features:
+                    # Mail from different senders: never compressed together
+                    frame = self.session.seal_mixed({"type": "batch", "items": items})
+                else:
+                    frame = self.session.seal(items[0])
+                if not await self.outbound.put_wait(frame):
+                    backlog.extendleft(reversed(raws))
+                    return
+        finally:
+            while backlog:
+                self.server.mailbox.put(self.client_id, backlog.popleft())
 
     async def handle_messages(self):
         try:
             async for msg in self.ws:
                 await self.process_message(msg)
-        except Exception as e: print(f"[!] Error {self.client_id}: {e}")
+        except Exception as e: log.warning("connection_error", client_id=self.client_id, error=e)
         finally:
-            if self.client_id in self.clients_map: del self.clients_map[self.client_id]
+            if self.clients_map.get(self.client_id) is self:
+                del self.clients_map[self.client_id]
+                self.server.router.unregister(self.client_id)
+                self.server.presence.drop(self.client_id)
+                self.server.presence.changed(self.client_id, False)
+            await self.outbound.stop()
             await self.ws.close()
-            print(f"[*] Client {self.client_id} disconnected")
+            log.info("disconnect", client_id=self.client_id)
 
     async def process_message(self, message):
+        server = self.server
+        metrics = server.metrics
+        metrics.frames_in.inc()
+        metrics.bytes_in.inc(len(message))
+        # Rate limits come before any crypto. Over the byte rate we stop reading, which
+        # pushes back through TCP without losing file chunks; over the message rate we drop.
+        if server.byte_limits is not None:
+            delay = server.byte_limits.delay(self.client_id, len(message))
+            if delay:
+                metrics.rate_limited["bytes"].inc()
+                await asyncio.sleep(delay)
+        start = time.perf_counter()
+        if is_chunk(message):
+            self.relay_chunk(message)
+            return
+        if server.message_limits is not None and not server.message_limits.allow(self.client_id):
+            self.rate_limited("messages")
+            return
+        try:
+            payload = self.session.open(message)
+        except ReplayError:
+            metrics.replays.inc()
+            return
+        except Exception as e:
+            metrics.decrypt_failures.inc()
+            log.warning("decrypt_failed", client_id=self.client_id, error=e)
+            return
+        if not isinstance(payload, dict):
+            log.warning("relay_failed", client_id=self.client_id, error="payload is not an object")
+            return
+        if payload.get("type") == "batch":
+            items = payload.get("items", ())
+            if not isinstance(items, list):
+                log.warning("relay_failed", client_id=self.client_id, error="batch items are not a list")
+                return
+            items = items[:server.client_batch_max]
+            if server.message_limits is not None and len(items) > 1:
+                # The frame paid for the first item
+                allowed = 1 + server.message_limits.allow_up_to(self.client_id, len(items) - 1)
+                if allowed < len(items):
+                    self.rate_limited("messages", len(items) - allowed)
+                    items = items[:allowed]
+            self.route_batch(items)
+        else:
+            self.route(payload)
+        metrics.relay_seconds.observe(time.perf_counter() - start)
+
+    def rate_limited(self, limit, n=1):
+        self.server.metrics.rate_limited[limit].inc(n)
+        log.warning("rate_limited", client_id=self.client_id, limit=limit)
+
+    def recipients_allowed(self, n) -> int:
+        """The message paid for one recipient: charge the rest of a fan-out, and say how many it may reach"""
+        limits = self.server.message_limits
+        if limits is None or n <= 1:
+            return n
+        allowed = 1 + limits.allow_up_to(self.client_id, n - 1)
+        if allowed < n:
+            self.rate_limited("messages", n - allowed)
+        return allowed
+
+    def route_batch(self, items):
+        """Route a client batch; direct messages to the same local recipient that batches go out as one frame"""
+        coalesced = {}
+        for item in items:
+            if not isinstance(item, dict) or item.get("type") == "batch":
+                continue
+            target = item.get("target")
+            conn = self.clients_map.get(target) if isinstance(target, str) and item.keys() <= {"target", "text"} and self.encodable(item) else None
+            if conn is not None and "batch" in conn.features:
+                coalesced.setdefault(conn, []).append({"text": item.get("text"), "sender": self.client_id})
+            else:
+                self.route(item)
+        for conn, payloads in coalesced.items():
+            conn.outbound.put(conn.session.seal(payloads[0] if len(payloads) == 1 else {"type": "batch", "items": payloads}))
+            self.server.metrics.delivered["local"].inc(len(payloads))
+
+    def encodable(self, payload) -> bool:
+        """Whether the binary codec (other workers, the mailbox, binary sessions) can carry what a JSON client sent"""
+        if self.session.framing is BinaryFraming:
+            return True
+        try:
+            BinaryFraming.encode(payload)
+        except (struct.error, ValueError, TypeError):
+            return False
+        return True
+
+    def route(self, payload):
+        if not self.encodable(payload):
+            log.warning("relay_failed", client_id=self.client_id, error="payload cannot be encoded")
+            return
         try:
-            data = json.loads(message)
-            nonce, ct = bytes.fromhex(data.get("nonce", "")), bytes.fromhex(data.get("ciphertext", ""))
-            if (self.client_id, nonce) in self.used_nonces: 
+            kind = payload.get("type")
+            if kind == "join":
+                try:
+                    reply = {"event": "joined", "members": self.server.join_group(payload["group"], self.client_id)}
+                except ValueError as e:
+                    reply = {"event": "error", "error": str(e)}
+                self.outbound.put(self.session.seal({"type": "group", "group": payload["group"], **reply}))
+            elif kind == "leave":
+                self.server.leave_group(payload["group"], self.client_id)
+                self.outbound.put(self.session.seal({"type": "group", "group": payload["group"], "event": "left"}))
+            elif kind == "file":
+                self.route_file(payload)
+            elif kind == "presence":
+                self.route_presence(payload)
+            elif "group" in payload:
+                self.server.deliver_group(payload["group"], self.client_id, payload.get("text"), self.recipients_allowed)
+            elif "targets" in payload:
+                self.server.deliver_many(payload["targets"], {"text": payload.get("text"), "sender": self.client_id}, self.recipients_allowed)
+            else:
+                target_id, text = payload.get("target"), payload.get("text")
+
+                self.server.deliver(target_id, {"text": text, "sender": self.client_id})
+        except Exception as e:
+            log.warning("relay_failed", client_id=self.client_id, error=e)
+
+    def route_presence(self, payload):
+        """Watch or stop watching clients; a subscription is answered with their current state"""
+        ids = payload.get("ids")
+        if not isinstance(ids, list):
+            raise ValueError("Malformed presence message")
+        server = self.server
+        if payload.get("op") == "unsubscribe":
+            server.presence.unsubscribe(self.client_id, ids)
+            return
+        accepted = server.presence.subscribe(self.client_id, ids)
+        reply = {"type": "presence", "on": [], "off": []}
+        for client_id in accepted:
+            reply["on" if server.is_online(client_id) else "off"].append(client_id)
+        if len(accepted) < len(ids) and len(server.presence.watching.get(self.client_id, ())) >= server.presence.max_subscriptions:
+            reply["error"] = "Too many subscriptions"
+        self.outbound.put(self.session.seal(reply))
+
+    def route_file(self, payload):
+        """File stream control: remember the route of an offer, then pass it on like a message"""
+        op, stream_id, target = payload.get("op"), payload.get("stream"), payload.get("target")
+        if not isinstance(stream_id, int) or not isinstance(target, str):
+            raise ValueError("Malformed file message")
+        if op == "offer":
+            reason = None
+            conn = self.clients_map.get(target)
+            if len(self.streams) >= self.server.max_streams and stream_id not in self.streams:
+                reason = "Too many transfers"
+            elif conn is not None and "files" not in conn.features:
+                reason = "Recipient cannot receive files"
+            elif conn is None and self.server.router.lookup(target) is None:
+                reason = "Recipient is offline"
+            if reason:
+                self.outbound.put(self.session.seal({"type": "file", "op": "reject", "stream": stream_id, "sender": target, "reason": reason}))
                 return
-            self.used_nonces.append((self.client_id, nonce))
-
-            plaintext = AESHandler.decrypt(self.aesgcm, nonce, ct)
-            payload = json.loads(plaintext)
-            target_id, text = payload.get("target"), payload.get("text")
-
-            if target_id in self.clients_map:
-                tconn = self.clients_map[target_id]
-                n, c = AESHandler.encrypt(tconn.aesgcm, json.dumps({"text": text, "sender": self.client_id}))
-                await tconn.ws.send(json.dumps({"nonce": n.hex(), "ciphertext": c.hex()}))
-        except Exception as e: 
-            print(f"[!] Error {self.client_id}: {e}")
-            
\ No newline at end of file
+            self.streams[stream_id] = target
+        elif op in ("done", "cancel") and self.streams.get(stream_id) == target:
+            del self.streams[stream_id]
+        self.server.deliver(target, {**{k: v for k, v in payload.items() if k != "target"}, "sender": self.client_id})
+
+    def relay_chunk(self, frame):
+        """Chunks are sealed under the stream key: pass them through untouched"""
+        target = self.streams.get(chunk_id(frame)[0])
+        if target is None:
+            self.server.metrics.delivered["dropped"].inc()
+            return
+        self.server.deliver_frame(target, frame)
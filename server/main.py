@@ -1,43 +1,385 @@
-import asyncio
+import asyncio, http, multiprocessing, os, signal, time
 import websockets
 from connection import ServerConnection
 from modules.keys import RSAKey
+from modules.registry import ClientKeyRegistry
+from modules.crypto_utils import CryptoPool
+from modules.mailbox import OfflineMailbox
+from modules.router import LocalRouter, UnixSocketRouter
+from modules.session import BinaryFraming
+from modules.tickets import TicketCache
+from modules.groups import GroupRegistry
+from modules.presence import PresenceRegistry
+from modules.admission import AdmissionController, RateLimiter
+from modules.keypool import HandshakeKeyPool
+from modules.log import log
+from modules.metrics import ServerMetrics, serve_metrics
 from cryptography.hazmat.primitives import serialization
 
 HOST = "0.0.0.0"
 PORT = 8765
 KEY_DIR = "./storage/keys"
+RUN_DIR = "./storage/run"  # worker IPC sockets
+WORKERS = 1  # >1: processes sharing the port via SO_REUSEPORT
+CLIENT_KEYS_FILE = "./storage/client_keys.json"
 KEEPALIVE_INTERVAL = 15
-NONCE_HISTORY_SIZE = 1000
+NONCE_HISTORY_SIZE = 1000  # replay window for clients using random nonces
+COUNTER_NONCES = True  # offer counter nonces with a sequence-window replay check, and in-session rekeying
+REKEY_FRAMES = 100_000  # frames we send under one session key before ratcheting it
+REKEY_SECONDS = 3600  # or once it is this old
+CRYPTO_POOL_KIND = "thread"  # "thread" or "process"
+CRYPTO_WORKERS = None  # executor default
+MAX_CONCURRENT_HANDSHAKES = 64
+ED25519_IDENTITIES = True  # accept Ed25519 client keys as well as RSA (announced in the hello)
+HANDSHAKE_KEY_POOL = 64  # pre-signed ephemeral keys kept ready per worker (0 = sign during each handshake)
+HANDSHAKE_KEY_TTL = 300  # seconds a pre-signed key may wait before it is discarded unused
+MAX_PENDING_HANDSHAKES = 256  # handshakes running or waiting for a slot; more are refused at the HTTP upgrade
+MAX_CONNECTIONS = 10_000  # open sockets per worker
+IP_CONNECT_RATE = 20  # new connections/sec per remote IP (None = unlimited)
+IP_CONNECT_BURST = 100
+CLIENT_MESSAGE_RATE = 500  # payloads/sec per client_id (None = unlimited)
+CLIENT_MESSAGE_BURST = 2000
+CLIENT_BYTE_RATE = 16 * 1024 * 1024  # bytes/sec per client_id, file chunks included (None = unlimited)
+CLIENT_BYTE_BURST = 32 * 1024 * 1024
+RATE_TABLE_SIZE = 100_000  # IPs / client_ids whose buckets we remember
+HANDSHAKE_TIMEOUT = 10
+OUTBOUND_QUEUE_SIZE = 1024  # frames buffered per recipient
+OUTBOUND_POLICY = "drop"  # on overflow: "drop", "disconnect" or "spill"
+OUTBOUND_SPILL_LIMIT = 64 * 1024 * 1024  # bytes per recipient when spilling
+MAILBOX_ENABLED = False  # hold messages for offline clients (opt-in)
+MAILBOX_DIR = None  # e.g. "./storage/mailbox" to keep mail across restarts
+MAILBOX_PER_CLIENT = 1000
+MAILBOX_TOTAL = 100_000
+MAILBOX_TTL = 7 * 86400
+MAILBOX_BATCH = 100  # stored messages per frame when flushing
+TICKET_CACHE_SIZE = 100_000  # outstanding session resumption tickets
+TICKET_TTL = 24 * 3600
+GROUP_MAX_MEMBERS = 10_000
+GROUPS_PER_CLIENT = 256
+MAX_TARGETS = 1000  # recipients of one multi-target message
+PRESENCE_WINDOW = 0.5  # seconds presence changes are collected before being pushed (0 = push each at once)
+PRESENCE_MAX_SUBSCRIPTIONS = 1000  # clients one client may watch
+CLIENT_BATCH_MAX = 256  # payloads honoured from one client batch frame
+MAX_STREAMS = 16  # concurrent outgoing file transfers per client
+COMPRESSION = ("zstd", "lz4", "zlib")  # payload codecs offered to clients, preferred first; missing modules are skipped
+COMPRESS_MIN_SIZE = 128  # bytes; smaller payloads are sent uncompressed
+DECOMPRESS_MAX_SIZE = 4 * 1024 * 1024  # bytes a compressed payload may inflate to
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9765  # GET /metrics (Prometheus text); worker N listens on METRICS_PORT + N; None disables
+LOG_LEVEL = "info"  # "debug", "info", "warning", "error" or "off"
+LOG_RATE = 20  # lines/sec per event before suppression; 0 = unlimited
 
 class WebSocketServer:
-    def __init__(self, host, port, server_rsa, keepalive, nonce_history_size=1000):
+    def __init__(self, host, port, server_rsa, keepalive, nonce_history_size=1000, counter_nonces=COUNTER_NONCES,
+                 rekey_frames=REKEY_FRAMES, rekey_seconds=REKEY_SECONDS, client_keys_file=CLIENT_KEYS_FILE,
+                 crypto_pool_kind=CRYPTO_POOL_KIND, crypto_workers=CRYPTO_WORKERS,
+                 max_concurrent_handshakes=MAX_CONCURRENT_HANDSHAKES, handshake_timeout=HANDSHAKE_TIMEOUT,
+                 ed25519_identities=ED25519_IDENTITIES, handshake_key_pool=HANDSHAKE_KEY_POOL, handshake_key_ttl=HANDSHAKE_KEY_TTL,
+                 max_pending_handshakes=MAX_PENDING_HANDSHAKES, max_connections=MAX_CONNECTIONS,
+                 ip_connect_rate=IP_CONNECT_RATE, ip_connect_burst=IP_CONNECT_BURST,
+                 client_message_rate=CLIENT_MESSAGE_RATE, client_message_burst=CLIENT_MESSAGE_BURST,
+                 client_byte_rate=CLIENT_BYTE_RATE, client_byte_burst=CLIENT_BYTE_BURST, rate_table_size=RATE_TABLE_SIZE,
+                 outbound_queue_size=OUTBOUND_QUEUE_SIZE, outbound_policy=OUTBOUND_POLICY, outbound_spill_limit=OUTBOUND_SPILL_LIMIT,
+                 mailbox_enabled=MAILBOX_ENABLED, mailbox_dir=MAILBOX_DIR, mailbox_per_client=MAILBOX_PER_CLIENT,
+                 mailbox_total=MAILBOX_TOTAL, mailbox_ttl=MAILBOX_TTL, mailbox_batch=MAILBOX_BATCH,
+                 ticket_cache_size=TICKET_CACHE_SIZE, ticket_ttl=TICKET_TTL,
+                 group_max_members=GROUP_MAX_MEMBERS, groups_per_client=GROUPS_PER_CLIENT, max_targets=MAX_TARGETS,
+                 presence_window=PRESENCE_WINDOW, presence_max_subscriptions=PRESENCE_MAX_SUBSCRIPTIONS, client_batch_max=CLIENT_BATCH_MAX, max_streams=MAX_STREAMS,
+                 compression=COMPRESSION, compress_min_size=COMPRESS_MIN_SIZE, decompress_max_size=DECOMPRESS_MAX_SIZE, metrics_host=METRICS_HOST, metrics_port=METRICS_PORT,
+                 log_level=LOG_LEVEL, log_rate=LOG_RATE, router=None, reuse_port=False):
         self.host = host
         self.port = port
         self.server_rsa = server_rsa
         self.keepalive = keepalive
         self.nonce_history_size = nonce_history_size
+        self.counter_nonces = counter_nonces
+        self.rekey_frames = rekey_frames
+        self.rekey_seconds = rekey_seconds
         self.clients_map = {}
+        self.client_keys = ClientKeyRegistry(client_keys_file)
+        self.crypto_pool = CryptoPool(crypto_workers, crypto_pool_kind)
+        self.handshake_slots = asyncio.Semaphore(max_concurrent_handshakes)
+        self.handshake_timeout = handshake_timeout
+        self.admission = AdmissionController(max_connections, max_pending_handshakes, ip_connect_rate, ip_connect_burst, rate_table_size)
+        self.ed25519_identities = ed25519_identities
+        # Refilled only while handshakes in flight leave a crypto worker free
+        self.key_pool = HandshakeKeyPool(lambda data: self.crypto_pool.sign(server_rsa.priv, data), handshake_key_pool, handshake_key_ttl,
+                                         lambda: self.admission.pending_handshakes < self.crypto_pool.workers) if handshake_key_pool else None
+        # Keyed by client_id, so reconnecting does not refill them
+        self.message_limits = RateLimiter(client_message_rate, client_message_burst, rate_table_size) if client_message_rate else None
+        self.byte_limits = RateLimiter(client_byte_rate, client_byte_burst, rate_table_size) if client_byte_rate else None
+        self.outbound_queue_size = outbound_queue_size
+        self.outbound_policy = outbound_policy
+        self.outbound_spill_limit = outbound_spill_limit
+        self.mailbox = OfflineMailbox(mailbox_per_client, mailbox_total, mailbox_ttl, mailbox_dir) if mailbox_enabled else None
+        self.mailbox_batch = mailbox_batch
+        self.tickets = TicketCache(ticket_cache_size, ticket_ttl)
+        self.groups = GroupRegistry(group_max_members, groups_per_client)
+        self.presence = PresenceRegistry(self.send_presence, presence_window, presence_max_subscriptions)
+        self.max_targets = max_targets
+        self.client_batch_max = client_batch_max
+        self.max_streams = max_streams
+        self.compression = compression
+        self.compress_min_size = compress_min_size
+        self.decompress_max_size = decompress_max_size
+        self.router = router or LocalRouter()
+        self.reuse_port = reuse_port
+        self.metrics = ServerMetrics(self)
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        log.configure(log_level, log_rate)
+
+    def deliver(self, target_id, payload, forwarded=False):
+        """Route a payload to target_id on this or another worker; hold it if offline and the mailbox is on"""
+        delivered = self.metrics.delivered
+        if self.deliver_local(target_id, payload):
+            delivered["local"].inc()
+            return True
+        if not forwarded and self.router.forward(target_id, payload):
+            delivered["forwarded"].inc()
+            return True
+        # File stream control only makes sense live, so it is never stored
+        if self.mailbox is not None and payload.get("type") != "file" and target_id in self.client_keys:
+            self.mailbox.put(target_id, BinaryFraming.encode({**payload, "ts": time.time()}))
+            delivered["mailbox"].inc()
+            return False
+        delivered["dropped"].inc()
+        return False
+
+    def deliver_local(self, target_id, payload):
+        conn = self.clients_map.get(target_id)
+        if conn is None:
+            return False
+        conn.outbound.put(conn.session.seal(payload))
+        return True
+
+    def deliver_frame(self, target_id, frame, forwarded=False):
+        """Pass an already sealed binary frame (a file chunk) to target_id as is"""
+        delivered = self.metrics.delivered
+        conn = self.clients_map.get(target_id)
+        if conn is not None and conn.session.framing is BinaryFraming:
+            conn.outbound.put(frame)
+            delivered["local"].inc()
+        elif conn is None and not forwarded and self.router.forward_frame(target_id, frame):
+            delivered["forwarded"].inc()
+        else:
+            delivered["dropped"].inc()
+
+    def join_group(self, group_id, client_id):
+        if self.groups.join(group_id, client_id):
+            self.router.join(group_id, client_id)
+        return len(self.groups.members(group_id))
+
+    def leave_group(self, group_id, client_id):
+        if self.groups.leave(group_id, client_id):
+            self.router.leave(group_id, client_id)
+
+    def deliver_group(self, group_id, sender_id, text, allow=None):
+        if not self.groups.is_member(group_id, sender_id):
+            raise ValueError("Not a member of this group")
+        members = [member for member in self.groups.members(group_id) if member != sender_id]
+        if allow is not None:
+            members = members[:allow(len(members))]
+        self.fan_out(members, {"text": text, "sender": sender_id, "group": group_id})
+
+    def deliver_many(self, targets, payload, allow=None):
+        """One payload to an ad hoc list of clients, resolved and queued in a single pass.
+
+        allow(n), when given, says how many of the n recipients it may reach (the sender's rate limit).
+        """
+        if not isinstance(targets, list) or len(targets) > self.max_targets:
+            raise ValueError(f"Expected a list of at most {self.max_targets} targets")
+        members = list(dict.fromkeys(targets))
+        if allow is not None:
+            members = members[:allow(len(members))]
+        self.fan_out(members, payload)
+
+    def fan_out(self, members, payload, forwarded=False):
+        """Deliver one payload to many clients.
+
+        The payload is encoded and compressed once per session encoding and
+        only the AES-GCM seal is per recipient; each recipient's writer task
+        sends concurrently. Remote members get one forward per owning worker,
+        offline ones the mailbox.
+        """
+        encoded = {}
+        remote = {}
+        local = mailed = dropped = 0
+        stored = None
+        for member in members:
+            conn = self.clients_map.get(member)
+            if conn is not None:
+                encoding = conn.session.encoding
+                raw = encoded.get(encoding)
+                if raw is None:
+                    raw = encoded[encoding] = conn.session.prepare(payload)
+                conn.outbound.put(conn.session.seal_prepared(raw))
+                local += 1
+                continue
+            owner = None if forwarded else self.router.lookup(member)
+            if owner is not None:
+                remote.setdefault(owner, []).append(member)
+            elif self.mailbox is not None and member in self.client_keys:
+                if stored is None:
+                    stored = BinaryFraming.encode({**payload, "ts": time.time()})
+                self.mailbox.put(member, stored)
+                mailed += 1
+            else:
+                dropped += 1
+        for owner, ids in remote.items():
+            self.router.forward_many(owner, ids, payload)
+        delivered = self.metrics.delivered
+        delivered["local"].inc(local)
+        delivered["forwarded"].inc(sum(map(len, remote.values())))
+        delivered["mailbox"].inc(mailed)
+        delivered["dropped"].inc(dropped)
+
+    def is_online(self, client_id):
+        return client_id in self.clients_map or self.router.lookup(client_id) is not None
+
+    def send_presence(self, watcher, payload):
+        conn = self.clients_map.get(watcher)
+        if conn is not None:
+            conn.outbound.put(conn.session.seal(payload))
+            self.metrics.presence_pushed.inc()
+
+    def on_remote_down(self, client_id):
+        self.presence.changed(client_id, False)
+
+    def on_remote_up(self, client_id):
+        """A client came online on another worker: tell its watchers here, hand over the mail we hold for it"""
+        self.presence.changed(client_id, True)
+        if self.mailbox is not None:
+            backlog = self.mailbox.take(client_id)
+            if backlog and not self.router.forward_mail(client_id, backlog):
+                self.deliver_mail(client_id, backlog)
+
+    def deliver_mail(self, client_id, backlog):
+        conn = self.clients_map.get(client_id)
+        if conn is not None:
+            conn.queue_backlog(backlog)
+        elif self.mailbox is not None:
+            for raw in backlog:
+                self.mailbox.put(client_id, raw)
+
+    def queue_stats(self):
+        """Outbound queue depth and counters for every connected client"""
+        return {cid: conn.outbound.stats() for cid, conn in self.clients_map.items()}
+
+    def process_request(self, ws, request):
+        """Admission control on the HTTP upgrade: refusing here costs no crypto"""
+        reason = self.admission.check(ws.remote_address[0] if ws.remote_address else None)
+        if reason is None:
+            return None
+        self.metrics.admission_rejected[reason].inc()
+        log.warning("connection_refused", remote=ws.remote_address[0] if ws.remote_address else None, reason=reason)
+        if reason == "ip_rate":
+            return ws.respond(http.HTTPStatus.TOO_MANY_REQUESTS, "Too many connections\n")
+        return ws.respond(http.HTTPStatus.SERVICE_UNAVAILABLE, "Server busy\n")
 
     async def handle_client(self, ws):
+        admission = self.admission
+        admission.opened()
+        try:
+            connection = ServerConnection(ws, self)
+            admission.handshake_started()
+            try:
+                async with self.handshake_slots:
+                    await asyncio.wait_for(connection.handshake(), self.handshake_timeout)
+            except Exception as e:
+                self.metrics.handshakes_failed.inc()
+                log.info("handshake_failed", remote=ws.remote_address[0] if ws.remote_address else None, error=repr(e))
+                await ws.close(1008, "Handshake failed")
+                return
+            finally:
+                admission.handshake_done()
+            await connection.handle_messages()
+            if self.clients_map.get(connection.client_id) is connection:
+                del self.clients_map[connection.client_id]
+            log.debug("connection_closed", client_id=connection.client_id)
+        finally:
+            admission.closed()
+
+    async def sweep_mailbox(self, interval=60):
+        while True:
+            await asyncio.sleep(interval)
+            self.mailbox.sweep()
 
-        connection = ServerConnection(ws, self.server_rsa, self.clients_map)
-        await connection.handshake()
-        await connection.handle_messages()
-        if connection.client_id in self.clients_map:
-            del self.clients_map[connection.client_id]
-        print(f"[*] Connection with client {connection.client_id} closed")
+    async def start_metrics(self):
+        if self.metrics_port is None:
+            return None
+        try:
+            endpoint = await serve_metrics(self.metrics, self.metrics_host, self.metrics_port)
+        except OSError as e:
+            log.warning("metrics_unavailable", port=self.metrics_port, error=e)
+            return None
+        log.info("metrics", url=f"http://{self.metrics_host}:{self.metrics_port}/metrics")
+        return endpoint
 
     async def start(self):
-        print(f"[*] WebSocket server running on {self.host}:{self.port}")
+        log.info("listening", host=self.host, port=self.port)
+        await self.router.start(self)
+        metrics_endpoint = await self.start_metrics()
         async with websockets.serve(
             self.handle_client,
             self.host,
             self.port,
             ping_interval=self.keepalive,
-            ping_timeout=self.keepalive*2
+            ping_timeout=self.keepalive*2,
+            reuse_port=self.reuse_port,
+            process_request=self.process_request
         ):
-            await asyncio.Future()
+            sweeper = asyncio.create_task(self.sweep_mailbox()) if self.mailbox is not None else None
+            refiller = asyncio.create_task(self.key_pool.refill()) if self.key_pool is not None else None
+            stop = asyncio.get_running_loop().create_future()
+            try:
+                asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set_result, None)
+            except NotImplementedError:
+                pass
+            try:
+                await stop
+            finally:
+                if sweeper:
+                    sweeper.cancel()
+                    self.mailbox.close()
+                if refiller:
+                    refiller.cancel()
+                self.presence.close()
+                await self.router.stop()
+                if metrics_endpoint:
+                    metrics_endpoint.close()
+                await self.client_keys.flush()
+                self.crypto_pool.shutdown()
+
+def run_worker(worker_id, workers, server_rsa=None, **config):
+    if workers > 1:
+        config["router"] = UnixSocketRouter(worker_id, workers, RUN_DIR)
+        config["reuse_port"] = True
+        if config.get("metrics_port") is not None:
+            config["metrics_port"] += worker_id
+        if config.get("mailbox_dir"):
+            config["mailbox_dir"] = os.path.join(config["mailbox_dir"], f"worker-{worker_id}")
+    server = WebSocketServer(server_rsa=server_rsa or RSAKey(KEY_DIR), **config)
+    try:
+        asyncio.run(server.start())
+    except KeyboardInterrupt:
+        pass
+
+def run(workers=WORKERS, server_rsa=None, **config):
+    """Serve with one process, or `workers` processes that relay to each other"""
+    if workers <= 1:
+        run_worker(0, 1, server_rsa, **config)
+        return
+    procs = [multiprocessing.Process(target=run_worker, args=(i, workers), kwargs=config) for i in range(workers)]
+    for p in procs:
+        p.start()
+    signal.signal(signal.SIGTERM, lambda *_: [p.terminate() for p in procs])
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.join()
 
 if __name__ == "__main__":
     server_rsa = RSAKey(KEY_DIR)
@@ -46,11 +388,55 @@ if __name__ == "__main__":
         format=serialization.PublicFormat.SubjectPublicKeyInfo
     )
     print(f"[*] Server RSA public key:\n{server_rsa_key.decode()}")
-    server = WebSocketServer(
+    run(
+        WORKERS,
+        server_rsa=server_rsa,
         host=HOST,
         port=PORT,
-        server_rsa=server_rsa,
         keepalive=KEEPALIVE_INTERVAL,
-        nonce_history_size=NONCE_HISTORY_SIZE
-    )
-    asyncio.run(server.start())
\ No newline at end of file
+        nonce_history_size=NONCE_HISTORY_SIZE,
+        counter_nonces=COUNTER_NONCES,
+        rekey_frames=REKEY_FRAMES,
+        rekey_seconds=REKEY_SECONDS,
+        crypto_pool_kind=CRYPTO_POOL_KIND,
+        crypto_workers=CRYPTO_WORKERS,
+        max_concurrent_handshakes=MAX_CONCURRENT_HANDSHAKES,
+        handshake_timeout=HANDSHAKE_TIMEOUT,
+        ed25519_identities=ED25519_IDENTITIES,
+        handshake_key_pool=HANDSHAKE_KEY_POOL,
+        handshake_key_ttl=HANDSHAKE_KEY_TTL,
+        max_pending_handshakes=MAX_PENDING_HANDSHAKES,
+        max_connections=MAX_CONNECTIONS,
+        ip_connect_rate=IP_CONNECT_RATE,
+        ip_connect_burst=IP_CONNECT_BURST,
+        client_message_rate=CLIENT_MESSAGE_RATE,
+        client_message_burst=CLIENT_MESSAGE_BURST,
+        client_byte_rate=CLIENT_BYTE_RATE,
+        client_byte_burst=CLIENT_BYTE_BURST,
+        rate_table_size=RATE_TABLE_SIZE,
+        outbound_queue_size=OUTBOUND_QUEUE_SIZE,
+        outbound_policy=OUTBOUND_POLICY,
+        outbound_spill_limit=OUTBOUND_SPILL_LIMIT,
+        mailbox_enabled=MAILBOX_ENABLED,
+        mailbox_dir=MAILBOX_DIR,
+        mailbox_per_client=MAILBOX_PER_CLIENT,
+        mailbox_total=MAILBOX_TOTAL,
+        mailbox_ttl=MAILBOX_TTL,
+        mailbox_batch=MAILBOX_BATCH,
+        ticket_cache_size=TICKET_CACHE_SIZE,
+        ticket_ttl=TICKET_TTL,
+        group_max_members=GROUP_MAX_MEMBERS,
+        groups_per_client=GROUPS_PER_CLIENT,
+        max_targets=MAX_TARGETS,
+        presence_window=PRESENCE_WINDOW,
+        presence_max_subscriptions=PRESENCE_MAX_SUBSCRIPTIONS,
+        client_batch_max=CLIENT_BATCH_MAX,
+        max_streams=MAX_STREAMS,
+        compression=COMPRESSION,
+        compress_min_size=COMPRESS_MIN_SIZE,
+        decompress_max_size=DECOMPRESS_MAX_SIZE,
+        metrics_host=METRICS_HOST,
+        metrics_port=METRICS_PORT,
+        log_level=LOG_LEVEL,
+        log_rate=LOG_RATE
+    )
\ No newline at end of file
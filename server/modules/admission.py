@@ -0,0 +1,108 @@
+import time
+from collections import OrderedDict
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def take(self, n, now) -> bool:
+        """Take n tokens. A cost above the burst passes only on a full bucket and leaves it in debt."""
+        self.refill(now)
+        if self.tokens < min(n, self.burst):
+            return False
+        self.tokens -= n
+        return True
+
+    def debit(self, n, now) -> float:
+        """Take n tokens regardless; seconds until the bucket is out of debt"""
+        self.refill(now)
+        self.tokens -= n
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def take_up_to(self, n, now) -> int:
+        self.refill(now)
+        granted = max(0, min(n, int(self.tokens)))
+        self.tokens -= granted
+        return granted
+
+class RateLimiter:
+    """Token buckets keyed by IP or client_id, least recently used evicted past maxsize"""
+
+    def __init__(self, rate, burst=None, maxsize=100_000):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.maxsize = maxsize
+        self.buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def bucket(self, key, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.maxsize:
+                self.buckets.popitem(last=False)
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst, now)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def allow(self, key, n=1) -> bool:
+        now = time.monotonic()
+        return self.bucket(key, now).take(n, now)
+
+    def delay(self, key, n) -> float:
+        """Charge n units and return how long the caller should wait before the next"""
+        now = time.monotonic()
+        return self.bucket(key, now).debit(n, now)
+
+    def allow_up_to(self, key, n) -> int:
+        """How many of n units may pass now"""
+        now = time.monotonic()
+        return self.bucket(key, now).take_up_to(n, now)
+
+class AdmissionController:
+    """Decides whether to take a new socket, before it costs any crypto.
+
+    check() runs on the HTTP upgrade request; the handler reports sockets and
+    handshakes through the opened/closed and handshake_started/handshake_done
+    pairs. Any limit set to None is not enforced.
+    """
+
+    def __init__(self, max_connections=None, max_pending_handshakes=None, ip_rate=None, ip_burst=None, table_size=100_000):
+        self.max_connections = max_connections
+        self.max_pending_handshakes = max_pending_handshakes
+        self.ip_limits = RateLimiter(ip_rate, ip_burst, table_size) if ip_rate else None
+        self.connections = 0
+        self.pending_handshakes = 0  # running or waiting for a slot
+
+    def check(self, ip):
+        """None to admit, else the reason for turning the socket away"""
+        if self.max_connections is not None and self.connections >= self.max_connections:
+            return "connections"
+        if self.max_pending_handshakes is not None and self.pending_handshakes >= self.max_pending_handshakes:
+            return "handshakes"
+        if self.ip_limits is not None and not self.ip_limits.allow(ip):
+            return "ip_rate"
+        return None
+
+    def opened(self):
+        self.connections += 1
+
+    def closed(self):
+        self.connections -= 1
+
+    def handshake_started(self):
+        self.pending_handshakes += 1
+
+    def handshake_done(self):
+        self.pending_handshakes -= 1
@@ -1,8 +1,10 @@
-from cryptography.hazmat.primitives.asymmetric import x25519, padding
-from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import x25519, ed25519, rsa, padding
+from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import lru_cache
+import asyncio, os
 
 class X25519Key:
     """Ephemeral X25519 key"""
@@ -41,12 +43,93 @@ class RSAHandler:
         except Exception:
             return False
 
+class Ed25519Handler:
+    """Sign and verify data using Ed25519 (client identities)"""
+
+    @staticmethod
+    def sign(priv, data: bytes) -> bytes:
+        return priv.sign(data)
+
+    @staticmethod
+    def verify(pub, data: bytes, sig: bytes) -> bool:
+        try:
+            pub.verify(sig, data)
+            return True
+        except Exception:
+            return False
+
+IDENTITY_KEYS = {
+    "rsa": (rsa.RSAPrivateKey, rsa.RSAPublicKey, RSAHandler),
+    "ed25519": (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey, Ed25519Handler),
+}
+
+def key_kind(key):
+    """"rsa" or "ed25519" for a private or public identity key, None for anything else"""
+    for kind, types in IDENTITY_KEYS.items():
+        if isinstance(key, types[:2]):
+            return kind
+    return None
+
+def signer(key):
+    """The handler that signs or verifies with this key"""
+    return IDENTITY_KEYS[key_kind(key)][2]
+
+@lru_cache(maxsize=8)
+def _load_priv_der(der):
+    return serialization.load_der_private_key(der, password=None)
+
+@lru_cache(maxsize=1024)
+def _load_pub_der(der):
+    return serialization.load_der_public_key(der)
+
+def _sign_der(priv_der, data):
+    return RSAHandler.sign(_load_priv_der(priv_der), data)
+
+def _verify_der(pub_der, data, sig):
+    return RSAHandler.verify(_load_pub_der(pub_der), data, sig)
+
+class CryptoPool:
+    """Runs RSA sign/verify off the event loop on a thread or process pool"""
+
+    def __init__(self, workers=None, kind="thread"):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown crypto pool kind: {kind}")
+        self.kind = kind
+        self.executor = ProcessPoolExecutor(workers) if kind == "process" else ThreadPoolExecutor(workers, thread_name_prefix="crypto")
+        self.workers = self.executor._max_workers
+        self.priv_ders = {}
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def sign(self, priv, data: bytes) -> bytes:
+        if self.kind == "thread":
+            return await self.run(RSAHandler.sign, priv, data)
+        # Keys do not pickle: ship DER to the workers, which cache the parsed key
+        entry = self.priv_ders.get(id(priv))
+        if entry is None:
+            der = priv.private_bytes(serialization.Encoding.DER, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+            entry = self.priv_ders[id(priv)] = (priv, der)
+        return await self.run(_sign_der, entry[1], data)
+
+    async def verify(self, pub, data: bytes, sig: bytes) -> bool:
+        if isinstance(pub, ed25519.Ed25519PublicKey):
+            # Cheaper than the hop to a worker
+            return Ed25519Handler.verify(pub, data, sig)
+        if self.kind == "thread":
+            return await self.run(RSAHandler.verify, pub, data, sig)
+        der = pub.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+        return await self.run(_verify_der, der, data, sig)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
 class AESHandler:
     """AES-GCM encryption/decryption with random nonce"""
 
     @staticmethod
-    def derive_key(shared_secret: bytes) -> bytes:
-        return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"shield-chat").derive(shared_secret)
+    def derive_key(shared_secret: bytes, salt: bytes = None, info: bytes = b"shield-chat") -> bytes:
+        return HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=info).derive(shared_secret)
 
     @staticmethod
     def make(key: bytes) -> AESGCM:
@@ -65,3 +148,22 @@ class AESHandler:
     @staticmethod
     def decrypt(aesgcm, nonce: bytes, blob: bytes) -> str:
         return aesgcm.decrypt(nonce, blob, None).decode()
+
+    @staticmethod
+    def encrypt_bytes(aesgcm, data: bytes) -> tuple[bytes, bytes]:
+        """Any bytes-like data (memoryview slices included) is encrypted without copying it first"""
+        nonce = os.urandom(12)
+        return nonce, aesgcm.encrypt(nonce, data, None)
+
+    @staticmethod
+    def decrypt_bytes(aesgcm, nonce: bytes, blob: bytes) -> bytes:
+        return aesgcm.decrypt(nonce, blob, None)
+
+    @staticmethod
+    def encrypt_at(aesgcm, nonce: bytes, data: bytes, aad: bytes = None) -> bytes:
+        """Encrypt under a caller-derived nonce (e.g. a stream counter); never reuse one with the same key"""
+        return aesgcm.encrypt(nonce, data, aad)
+
+    @staticmethod
+    def decrypt_at(aesgcm, nonce: bytes, blob: bytes, aad: bytes = None) -> bytes:
+        return aesgcm.decrypt(nonce, blob, aad)
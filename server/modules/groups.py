@@ -0,0 +1,57 @@
+class GroupRegistry:
+    """Group membership, indexed both ways: group -> members and client -> groups.
+
+    Membership lives in memory until the client leaves; offline members stay
+    in their groups (their messages go to the mailbox when it is enabled).
+    """
+
+    def __init__(self, max_members=10_000, max_groups_per_client=256):
+        self.max_members = max_members
+        self.max_groups_per_client = max_groups_per_client
+        self.members_of = {}
+        self.groups_of = {}
+
+    def __len__(self):
+        return len(self.members_of)
+
+    @staticmethod
+    def check_id(group_id):
+        if not isinstance(group_id, str) or not 0 < len(group_id) <= 64:
+            raise ValueError("Invalid group id")
+
+    def join(self, group_id, client_id) -> bool:
+        """Add client_id to group_id. Returns False if it was already a member."""
+        self.check_id(group_id)
+        members = self.members_of.get(group_id, ())
+        if client_id in members:
+            return False
+        if len(members) >= self.max_members:
+            raise ValueError("Group is full")
+        groups = self.groups_of.setdefault(client_id, set())
+        if len(groups) >= self.max_groups_per_client:
+            raise ValueError("Too many groups")
+        self.members_of.setdefault(group_id, set()).add(client_id)
+        groups.add(group_id)
+        return True
+
+    def leave(self, group_id, client_id) -> bool:
+        members = self.members_of.get(group_id)
+        if not members or client_id not in members:
+            return False
+        members.discard(client_id)
+        if not members:
+            del self.members_of[group_id]
+        groups = self.groups_of[client_id]
+        groups.discard(group_id)
+        if not groups:
+            del self.groups_of[client_id]
+        return True
+
+    def members(self, group_id):
+        return self.members_of.get(group_id, frozenset())
+
+    def is_member(self, group_id, client_id):
+        return client_id in self.members_of.get(group_id, ())
+
+    def snapshot(self):
+        return {group_id: list(members) for group_id, members in self.members_of.items()}
@@ -0,0 +1,63 @@
+import asyncio, time
+from collections import deque
+from .crypto_utils import X25519Key
+from .log import log
+
+class HandshakeKeyPool:
+    """Ephemeral X25519 keys signed ahead of time, so a full handshake skips the RSA sign.
+
+    The server hello signs nothing but the ephemeral public key, so the pair
+    can be made before the client arrives. Each key is handed out once and
+    dropped, and keys older than ttl are thrown away unused, which bounds how
+    long a private key sits in memory. refill() tops the pool up in the
+    background, one sign at a time and only while idle() says the crypto
+    workers have room; a storm that drains it falls back to signing inline.
+    """
+
+    def __init__(self, sign, size=64, ttl=300, idle=lambda: True, poll=0.05):
+        self.sign = sign  # async (data) -> signature
+        self.size = size
+        self.ttl = ttl
+        self.idle = idle
+        self.poll = poll
+        self.keys = deque()  # (expires, X25519Key, signature), oldest first
+        self.wanted = asyncio.Event()
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def take(self):
+        """(X25519Key, signature) never handed out before, or None when the pool is dry"""
+        now = time.monotonic()
+        self.wanted.set()
+        while self.keys:
+            expires, xkey, sig = self.keys.popleft()
+            if expires > now:
+                return xkey, sig
+            self.expired += 1
+        return None
+
+    async def refill(self):
+        keys = self.keys
+        while True:
+            now = time.monotonic()
+            while keys and keys[0][0] <= now:
+                keys.popleft()
+                self.expired += 1
+            if len(keys) >= self.size:
+                self.wanted.clear()
+                try:
+                    await asyncio.wait_for(self.wanted.wait(), keys[0][0] - now)
+                except asyncio.TimeoutError:
+                    pass
+            elif not self.idle():
+                await asyncio.sleep(self.poll)
+            else:
+                xkey = X25519Key()
+                try:
+                    sig = await self.sign(xkey.pub_bytes)
+                except Exception as e:
+                    log.warning("key_pool_failed", error=e)
+                    return
+                keys.append((time.monotonic() + self.ttl, xkey, sig))
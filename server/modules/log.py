@@ -0,0 +1,65 @@
+import sys, time
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40, "off": 100}
+
+class Logger:
+    """Leveled key=value logging, rate limited per event.
+
+    Each event name gets a token bucket of `rate` lines/sec (burst `rate`);
+    lines over the limit are counted and reported as `suppressed=N` on the
+    next line that gets through. Disabled levels cost one comparison, so hot
+    paths can guard with `if log.enabled(...)` or just call through.
+    """
+
+    def __init__(self, level="info", rate=20, stream=None):
+        self.stream = stream or sys.stdout
+        self.buckets = {}
+        self.configure(level, rate)
+
+    def configure(self, level="info", rate=20):
+        if level not in LEVELS:
+            raise ValueError(f"Unknown log level: {level}")
+        self.level = LEVELS[level]
+        self.rate = rate
+        self.buckets.clear()
+
+    def enabled(self, level):
+        return LEVELS[level] >= self.level
+
+    def allow(self, event):
+        """Token bucket per event. Returns the number of lines suppressed since the last one, or None to drop."""
+        if not self.rate:
+            return 0
+        now = time.monotonic()
+        tokens, last, suppressed = self.buckets.get(event, (self.rate, now, 0))
+        tokens = min(self.rate, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self.buckets[event] = (tokens, now, suppressed + 1)
+            return None
+        self.buckets[event] = (tokens - 1, now, 0)
+        return suppressed
+
+    def log(self, level, event, **fields):
+        if LEVELS[level] < self.level:
+            return
+        suppressed = self.allow(event)
+        if suppressed is None:
+            return
+        if suppressed:
+            fields["suppressed"] = suppressed
+        line = " ".join(f"{k}={format_value(v)}" for k, v in fields.items())
+        self.stream.write(f"{time.strftime('%Y-%m-%dT%H:%M:%S')} level={level} event={event}{' ' + line if line else ''}\n")
+        self.stream.flush()
+
+    def debug(self, event, **fields): self.log("debug", event, **fields)
+    def info(self, event, **fields): self.log("info", event, **fields)
+    def warning(self, event, **fields): self.log("warning", event, **fields)
+    def error(self, event, **fields): self.log("error", event, **fields)
+
+def format_value(value):
+    text = str(value)
+    if not text or any(c in text for c in ' "=\n'):
+        return '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+    return text
+
+log = Logger()
@@ -0,0 +1,164 @@
+import os, struct, time
+from collections import deque
+from .crypto_utils import AESHandler
+
+RECORD = struct.Struct("!BdHI")
+OP_PUT, OP_TAKE = 1, 2
+
+class OfflineMailbox:
+    """Opt-in store-and-forward for offline recipients.
+
+    Payloads are held sealed under a mailbox key, bounded per recipient and in
+    total, and evicted after `ttl` seconds. With `log_dir` set, every change is
+    appended to a segment log (and the key kept next to it) so mail survives
+    restarts; segments are compacted on startup and once too many accumulate.
+    """
+
+    def __init__(self, per_client=1000, total=100_000, ttl=7 * 86400, log_dir=None,
+                 segment_size=16 * 1024 * 1024, max_segments=4):
+        self.per_client = per_client
+        self.total_limit = total
+        self.ttl = ttl
+        self.log_dir = log_dir
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.boxes = {}
+        self.total = 0
+        self.dropped = 0
+        self.segment = None
+        self.segment_seq = 0
+        key = self.load_key() if log_dir else os.urandom(32)
+        self.aesgcm = AESHandler.make(key)
+        if log_dir:
+            self.load_segments()
+
+    def __len__(self):
+        return self.total
+
+    def put(self, client_id, payload: bytes) -> bool:
+        nonce, ct = AESHandler.encrypt_bytes(self.aesgcm, payload)
+        expires = time.time() + self.ttl
+        if not self.store(client_id, expires, nonce, ct):
+            return False
+        self.log(OP_PUT, client_id, expires, nonce + ct)
+        return True
+
+    def store(self, client_id, expires, nonce, ct) -> bool:
+        box = self.boxes.get(client_id)
+        if box is None:
+            box = self.boxes[client_id] = deque()
+        self.expire_box(box)
+        if len(box) >= self.per_client:
+            box.popleft()
+            self.total -= 1
+            self.dropped += 1
+        if self.total >= self.total_limit:
+            self.dropped += 1
+            return False
+        box.append((expires, nonce, ct))
+        self.total += 1
+        return True
+
+    def take(self, client_id) -> list[bytes]:
+        """Remove and return every unexpired payload held for client_id, oldest first"""
+        box = self.boxes.pop(client_id, None)
+        if not box:
+            return []
+        self.total -= len(box)
+        self.log(OP_TAKE, client_id, 0, b"")
+        now = time.time()
+        return [AESHandler.decrypt_bytes(self.aesgcm, n, ct) for expires, n, ct in box if expires > now]
+
+    def expire_box(self, box, now=None):
+        now = now or time.time()
+        while box and box[0][0] <= now:
+            box.popleft()
+            self.total -= 1
+
+    def sweep(self):
+        """Evict expired mail everywhere; entries share one TTL, so only box heads are checked"""
+        now = time.time()
+        for client_id in list(self.boxes):
+            box = self.boxes[client_id]
+            self.expire_box(box, now)
+            if not box:
+                del self.boxes[client_id]
+
+    # Disk-backed segment log
+
+    def load_key(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        path = os.path.join(self.log_dir, "mailbox.key")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return f.read()
+        key = os.urandom(32)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(key)
+        return key
+
+    def segment_paths(self):
+        names = sorted(n for n in os.listdir(self.log_dir) if n.startswith("segment-") and n.endswith(".log"))
+        return [os.path.join(self.log_dir, n) for n in names]
+
+    def load_segments(self):
+        paths = self.segment_paths()
+        for path in paths:
+            with open(path, "rb") as f:
+                data = f.read()
+            pos = 0
+            while pos + RECORD.size <= len(data):
+                op, expires, idlen, blen = RECORD.unpack_from(data, pos)
+                pos += RECORD.size
+                if pos + idlen + blen > len(data):
+                    break  # torn tail write
+                client_id = data[pos:pos + idlen].decode()
+                blob = data[pos + idlen:pos + idlen + blen]
+                pos += idlen + blen
+                if op == OP_PUT:
+                    self.store(client_id, expires, blob[:12], blob[12:])
+                elif op == OP_TAKE and client_id in self.boxes:
+                    self.total -= len(self.boxes.pop(client_id))
+        self.sweep()
+        if paths:
+            self.segment_seq = int(os.path.basename(paths[-1])[8:-4])
+        self.compact(paths)
+
+    def open_segment(self):
+        self.segment_seq += 1
+        self.segment = open(os.path.join(self.log_dir, f"segment-{self.segment_seq:08d}.log"), "ab")
+
+    def log(self, op, client_id, expires, blob):
+        if not self.log_dir:
+            return
+        if self.segment is None:
+            self.open_segment()
+        raw_id = client_id.encode()
+        self.segment.write(RECORD.pack(op, expires, len(raw_id), len(blob)) + raw_id + blob)
+        self.segment.flush()
+        if self.segment.tell() >= self.segment_size:
+            self.segment.close()
+            self.segment = None
+            old = self.segment_paths()
+            if len(old) >= self.max_segments:
+                self.compact(old)
+
+    def compact(self, old_paths):
+        """Rewrite live mail into a fresh segment, then drop the segments it replaces"""
+        if self.segment:
+            self.segment.close()
+        self.open_segment()
+        for client_id, box in self.boxes.items():
+            raw_id = client_id.encode()
+            for expires, nonce, ct in box:
+                self.segment.write(RECORD.pack(OP_PUT, expires, len(raw_id), 12 + len(ct)) + raw_id + nonce + ct)
+        self.segment.flush()
+        os.fsync(self.segment.fileno())
+        for path in old_paths:
+            os.remove(path)
+
+    def close(self):
+        if self.segment:
+            self.segment.close()
+            self.segment = None
@@ -0,0 +1,155 @@
+import asyncio, time
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Counter:
+    __slots__ = ("labels", "value")
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def samples(self, name):
+        yield name, self.labels, self.value
+
+class Histogram:
+    __slots__ = ("labels", "buckets", "counts", "sum", "count")
+
+    def __init__(self, labels, buckets):
+        self.labels = labels
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name):
+        total = 0
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            yield f"{name}_bucket", {**self.labels, "le": f"{bound:g}"}, total
+        yield f"{name}_bucket", {**self.labels, "le": "+Inf"}, self.count
+        yield f"{name}_sum", self.labels, self.sum
+        yield f"{name}_count", self.labels, self.count
+
+class Gauge:
+    """Read at scrape time: fn() returns a number, or (labels, value) pairs"""
+    __slots__ = ("labels", "fn")
+
+    def __init__(self, labels, fn):
+        self.labels = labels
+        self.fn = fn
+
+    def samples(self, name):
+        value = self.fn()
+        if isinstance(value, (int, float)):
+            yield name, self.labels, value
+        else:
+            for labels, v in value:
+                yield name, {**self.labels, **labels}, v
+
+class Metrics:
+    """Registry rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.families = {}
+
+    def add(self, kind, name, help, instrument):
+        family = self.families.setdefault(name, (kind, help, []))
+        family[2].append(instrument)
+        return instrument
+
+    def counter(self, name, help, **labels):
+        return self.add("counter", name, help, Counter(labels))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, **labels):
+        return self.add("histogram", name, help, Histogram(labels, buckets))
+
+    def gauge(self, name, help, fn, **labels):
+        return self.add("gauge", name, help, Gauge(labels, fn))
+
+    def render(self):
+        lines = []
+        for name, (kind, help, instruments) in self.families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for instrument in instruments:
+                for sample, labels, value in instrument.samples(name):
+                    label_text = ",".join(f'{k}="{escape(v)}"' for k, v in labels.items())
+                    lines.append(f"{sample}{{{label_text}}} {value:g}" if label_text else f"{sample} {value:g}")
+        return "\n".join(lines) + "\n"
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class ServerMetrics(Metrics):
+    """Everything WebSocketServer and ServerConnection record"""
+
+    def __init__(self, server):
+        super().__init__()
+        self.started = time.time()
+        self.handshakes_full = self.counter("shieldchat_handshakes_total", "Completed handshakes", kind="full")
+        self.handshakes_resumed = self.counter("shieldchat_handshakes_total", "Completed handshakes", kind="resumed")
+        self.handshakes_failed = self.counter("shieldchat_handshake_failures_total", "Handshakes that failed or timed out")
+        self.handshake_keys = {source: self.counter("shieldchat_handshake_keys_total", "Server ephemeral keys used by full handshakes, "
+                                                     "by whether they came pre-signed from the pool", source=source) for source in ("pool", "inline")}
+        self.handshake_seconds = self.histogram("shieldchat_handshake_seconds", "Handshake duration")
+        self.handshake_phase = {phase: self.histogram("shieldchat_handshake_phase_seconds", "Handshake time by phase", phase=phase)
+                                for phase in ("rsa", "x25519", "io")}
+        self.relay_seconds = self.histogram("shieldchat_relay_seconds", "Frame received to queued for its recipient")
+        self.frames_in = self.counter("shieldchat_frames_received_total", "Frames received from clients")
+        self.bytes_in = self.counter("shieldchat_bytes_received_total", "Bytes received from clients")
+        self.frames_out = self.counter("shieldchat_frames_sent_total", "Frames sent to clients")
+        self.bytes_out = self.counter("shieldchat_bytes_sent_total", "Bytes sent to clients")
+        self.delivered = {route: self.counter("shieldchat_deliveries_total", "Payloads routed, by outcome", route=route)
+                          for route in ("local", "forwarded", "mailbox", "dropped")}
+        self.decrypt_failures = self.counter("shieldchat_decrypt_failures_total", "Frames that failed to decrypt or parse")
+        self.replays = self.counter("shieldchat_replay_rejections_total", "Frames rejected as replays")
+        self.admission_rejected = {reason: self.counter("shieldchat_admission_rejections_total", "Connections refused before the handshake",
+                                                        reason=reason) for reason in ("connections", "handshakes", "ip_rate")}
+        self.rate_limited = {limit: self.counter("shieldchat_rate_limited_total", "Payloads dropped (messages) or frames delayed (bytes) "
+                                                 "by per-client rate limits", limit=limit) for limit in ("messages", "bytes")}
+        self.presence_pushed = self.counter("shieldchat_presence_pushed_total", "Presence change payloads pushed to watchers")
+        self.gauge("shieldchat_connections", "Connected clients", lambda: len(server.clients_map))
+        self.gauge("shieldchat_sockets", "Open sockets, handshaking or not", lambda: server.admission.connections)
+        self.gauge("shieldchat_handshakes_pending", "Handshakes running or waiting for a slot", lambda: server.admission.pending_handshakes)
+        self.gauge("shieldchat_outbound_queue_depth", "Frames waiting per recipient (non-empty queues only)",
+                   lambda: [({"client_id": cid}, len(conn.outbound)) for cid, conn in list(server.clients_map.items()) if len(conn.outbound)])
+        self.gauge("shieldchat_outbound_dropped", "Frames dropped by the outbound queues of connected clients",
+                   lambda: sum(conn.outbound.dropped for conn in list(server.clients_map.values())))
+        self.gauge("shieldchat_groups", "Groups with at least one member", lambda: len(server.groups))
+        self.gauge("shieldchat_presence_subscriptions", "Presence subscriptions held by this worker's clients", lambda: len(server.presence))
+        self.gauge("shieldchat_handshake_key_pool", "Pre-signed ephemeral keys ready", lambda: len(server.key_pool) if server.key_pool else 0)
+        self.gauge("shieldchat_handshake_keys_expired", "Pre-signed keys discarded unused",
+                   lambda: server.key_pool.expired if server.key_pool else 0)
+        self.gauge("shieldchat_tickets", "Outstanding session resumption tickets", lambda: len(server.tickets))
+        if server.mailbox is not None:
+            self.gauge("shieldchat_mailbox_messages", "Messages held for offline clients", lambda: len(server.mailbox))
+        self.gauge("shieldchat_uptime_seconds", "Seconds since the worker started", lambda: time.time() - self.started)
+
+async def serve_metrics(metrics, host, port):
+    """Minimal HTTP endpoint: GET /metrics"""
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            path = request.split(b" ", 2)[1] if request.count(b" ") >= 2 else b""
+            if path.split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", metrics.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, host, port)
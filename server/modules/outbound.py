@@ -0,0 +1,129 @@
+import asyncio, struct, tempfile
+from collections import deque
+
+SPILL_RECORD = struct.Struct("!BI")
+
+class OutboundQueue:
+    """Bounded send queue for one connection, drained by its own writer task.
+
+    When the queue is full, frames are handled by `policy`:
+    "drop" discards the new frame, "disconnect" closes the slow peer,
+    "spill" appends it to a temp file that is read back in order once the
+    queue drains (up to `spill_limit` bytes, then frames are dropped).
+    """
+    POLICIES = ("drop", "disconnect", "spill")
+
+    def __init__(self, ws, maxsize=1024, policy="drop", spill_limit=64 * 1024 * 1024, metrics=None):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.ws = ws
+        self.maxsize = maxsize
+        self.policy = policy
+        self.spill_limit = spill_limit
+        self.metrics = metrics  # ServerMetrics: frames/bytes sent
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.drained = asyncio.Event()
+        self.spill_file = None
+        self.spill_pending = 0
+        self.spill_bytes = 0
+        self.spill_read_pos = 0
+        self.sent = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.closed = False
+        self.task = None
+
+    def __len__(self):
+        return len(self.queue) + self.spill_pending
+
+    def start(self):
+        self.task = asyncio.create_task(self.writer())
+
+    async def stop(self):
+        self.closed = True
+        self.drained.set()
+        if self.task:
+            self.task.cancel()
+            try: await self.task
+            except asyncio.CancelledError: pass
+        if self.spill_file:
+            self.spill_file.close()
+            self.spill_file = None
+
+    def put(self, frame) -> bool:
+        """Queue a frame without waiting. Returns False if it was not accepted."""
+        if self.closed:
+            self.dropped += 1
+            return False
+        if len(self.queue) < self.maxsize and not self.spill_pending:
+            self.queue.append(frame)
+            self.wakeup.set()
+            return True
+        if self.policy == "spill" and self.spill_bytes + len(frame) <= self.spill_limit:
+            self.spill(frame)
+            return True
+        self.dropped += 1
+        if self.policy == "disconnect":
+            self.closed = True
+            asyncio.create_task(self.ws.close(1008, "Outbound queue overflow"))
+        return False
+
+    async def put_wait(self, frame) -> bool:
+        """Queue a frame once there is room for it, for bulk senders that can wait"""
+        while len(self) >= self.maxsize and not self.closed:
+            self.drained.clear()
+            await self.drained.wait()
+        return self.put(frame)
+
+    def spill(self, frame):
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile()
+        raw = frame.encode() if isinstance(frame, str) else frame
+        self.spill_file.seek(0, 2)
+        self.spill_file.write(SPILL_RECORD.pack(isinstance(frame, str), len(raw)) + raw)
+        self.spill_pending += 1
+        self.spill_bytes += len(raw)
+        self.spilled += 1
+
+    def unspill(self):
+        """Move up to maxsize spilled frames back into the queue, oldest first"""
+        f = self.spill_file
+        f.seek(self.spill_read_pos)
+        while self.spill_pending and len(self.queue) < self.maxsize:
+            is_text, n = SPILL_RECORD.unpack(f.read(SPILL_RECORD.size))
+            raw = f.read(n)
+            self.queue.append(raw.decode() if is_text else raw)
+            self.spill_pending -= 1
+            self.spill_bytes -= n
+        self.spill_read_pos = f.tell()
+        if not self.spill_pending:
+            f.seek(0)
+            f.truncate()
+            self.spill_read_pos = 0
+
+    async def writer(self):
+        while True:
+            if not self.queue:
+                if self.spill_pending:
+                    self.unspill()
+                    continue
+                self.drained.set()
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            frame = self.queue.popleft()
+            try:
+                await self.ws.send(frame)
+            except Exception:
+                # Peer is gone; its receive loop handles the cleanup
+                self.closed = True
+                self.drained.set()
+                return
+            self.sent += 1
+            if self.metrics:
+                self.metrics.frames_out.inc()
+                self.metrics.bytes_out.inc(len(frame))
+
+    def stats(self):
+        return {"depth": len(self), "sent": self.sent, "dropped": self.dropped, "spilled": self.spilled}
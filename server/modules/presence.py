@@ -0,0 +1,101 @@
+import asyncio
+
+class PresenceRegistry:
+    """Presence subscriptions, indexed both ways: client -> watchers and watcher -> clients.
+
+    Online/offline changes of watched clients are collected for `window`
+    seconds, then each watcher with something to hear gets one
+    {"type": "presence", "on": [...], "off": [...]} payload through `send`.
+    A wave of reconnects thus costs a watcher one frame per window however
+    many of its contacts came back, and a client that drops and returns
+    within the window is not announced at all. Changes of clients nobody
+    watches cost a dict lookup. Subscriptions belong to the watcher's
+    connection and go when it does.
+    """
+
+    def __init__(self, send, window=0.5, max_subscriptions=1000):
+        self.send = send  # (watcher, payload)
+        self.window = window
+        self.max_subscriptions = max_subscriptions
+        self.watchers_of = {}
+        self.watching = {}
+        self.subscriptions = 0
+        self.pending = {}  # client -> [state before the window, state now]
+        self.flush_handle = None
+
+    def __len__(self):
+        return self.subscriptions
+
+    def subscribe(self, watcher, client_ids) -> list:
+        """Watch client_ids; returns those now watched, short of the per-watcher limit"""
+        watched = self.watching.setdefault(watcher, set())
+        accepted = []
+        for client_id in client_ids:
+            if not isinstance(client_id, str) or client_id == watcher:
+                continue
+            if client_id not in watched:
+                if len(watched) >= self.max_subscriptions:
+                    break
+                watched.add(client_id)
+                self.watchers_of.setdefault(client_id, set()).add(watcher)
+                self.subscriptions += 1
+            accepted.append(client_id)
+        if not watched:
+            del self.watching[watcher]
+        return accepted
+
+    def unsubscribe(self, watcher, client_ids):
+        watched = self.watching.get(watcher)
+        if not watched:
+            return
+        for client_id in client_ids:
+            if client_id in watched:
+                watched.discard(client_id)
+                self.forget(client_id, watcher)
+        if not watched:
+            del self.watching[watcher]
+
+    def drop(self, watcher):
+        """Remove all of a watcher's subscriptions"""
+        for client_id in self.watching.pop(watcher, ()):
+            self.forget(client_id, watcher)
+
+    def forget(self, client_id, watcher):
+        watchers = self.watchers_of[client_id]
+        watchers.discard(watcher)
+        if not watchers:
+            del self.watchers_of[client_id]
+        self.subscriptions -= 1
+
+    def changed(self, client_id, online):
+        if client_id not in self.watchers_of:
+            return
+        entry = self.pending.get(client_id)
+        if entry is None:
+            self.pending[client_id] = [not online, online]
+        else:
+            entry[1] = online
+        if self.window <= 0:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def flush(self) -> int:
+        """Push the changes collected so far; returns the number of payloads sent"""
+        self.flush_handle = None
+        pending, self.pending = self.pending, {}
+        deltas = {}
+        for client_id, (before, now) in pending.items():
+            if before == now:
+                continue
+            key = "on" if now else "off"
+            for watcher in self.watchers_of.get(client_id, ()):
+                deltas.setdefault(watcher, {}).setdefault(key, []).append(client_id)
+        for watcher, delta in deltas.items():
+            self.send(watcher, {"type": "presence", **delta})
+        return len(deltas)
+
+    def close(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
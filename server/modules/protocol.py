@@ -1,40 +1,222 @@
-import json
+import hashlib, hmac, json, time
+from contextlib import contextmanager
 from .crypto_utils import X25519Key, AESHandler, RSAHandler
+from .session import Session, JSONFraming, FRAMINGS, NONCE_MODES, RatchetNonces, REKEY_FRAMES, REKEY_SECONDS
+from .compression import Compressor, available, MIN_SIZE, MAX_SIZE
+
+RESUME_HEADER = "X-Shield-Resume"
+
+def resume_mac(secret: bytes, *parts: bytes) -> bytes:
+    return hmac.new(secret, b"|".join(parts), hashlib.sha256).digest()
 
 class Handshake:
-    """Secure handshake using ephemeral X25519 signed by server RSA"""
+    """Secure handshake using ephemeral X25519 signed by server RSA.
+
+    A client holding a session ticket can instead resume: its X25519 key and a
+    MAC under the ticket secret ride in the upgrade request (RESUME_HEADER),
+    the server answers with its own key and MAC, and the session key mixes the
+    fresh exchange with the ticket secret. One round trip, no RSA. Servers that
+    reject the ticket simply send the normal signed hello.
+
+    Compression and counter nonces (optionally with in-session rekeying, see
+    RatchetNonces) are negotiated like framing: the server lists what it
+    accepts, the client answers with its pick (or nothing). A resumed session
+    keeps the settings of the session that earned the ticket.
+    """
 
-    def __init__(self, ws, rsa_priv, rsa_pub, peer_rsa_pub=None, is_server=False):
+    def __init__(self, ws, rsa_priv, rsa_pub, peer_rsa_pub=None, is_server=False, crypto_pool=None, framings=("binary", "json"),
+                 ticket=None, tickets=None, resume_request=None, features=(), compression=(),
+                 compress_min=MIN_SIZE, decompress_max=MAX_SIZE, nonces=(),
+                 rekey_frames=REKEY_FRAMES, rekey_seconds=REKEY_SECONDS, key_pool=None):
         self.ws = ws
         self.rsa_priv = rsa_priv
         self.rsa_pub = rsa_pub
         self.peer_rsa_pub = peer_rsa_pub
         self.is_server = is_server
+        self.crypto_pool = crypto_pool
+        self.framings = framings
         self.aesgcm = None
+        self.framing = JSONFraming
+        self.ticket = ticket  # client: {"id": hex, "secret": hex} from the server
+        self.tickets = tickets  # server: TicketCache
+        self.resume_request_value = resume_request  # server: RESUME_HEADER value, if any
+        self.resume_xkey = None
+        self.resumed = None  # server: redeemed ticket entry, client: True
+        self.timings = {"rsa": 0.0, "x25519": 0.0}  # seconds spent in each kind of crypto
+        self.features = features  # server: what it accepts from clients, announced in its hello
+        self.peer_features = set()  # client: what the server announced
+        self.compression = available(compression)  # codec names, most preferred first
+        self.compress_min = compress_min
+        self.decompress_max = decompress_max
+        self.codec = None  # the negotiated one
+        self.nonce_modes = [m for m in nonces if m in NONCE_MODES]  # random nonces need no negotiation
+        self.nonce_mode = None  # "ratchet" or "counter" when negotiated
+        self.rekey_frames = rekey_frames  # our sending key's lifetime under "ratchet"
+        self.rekey_seconds = rekey_seconds
+        self.key = None
+        self.key_pool = key_pool  # server: pre-signed ephemeral keys (HandshakeKeyPool)
+        self.pooled = False  # server: whether the hello used one
+
+    def session(self):
+        compressor = Compressor(self.codec, self.compress_min, self.decompress_max) if self.codec else None
+        if self.nonce_mode == RatchetNonces.name:
+            # Not self.aesgcm: a session holding the handshake key would undo the ratchet
+            nonces = RatchetNonces(self.is_server, self.key, self.rekey_frames, self.rekey_seconds)
+            return Session(None, self.framing, compressor=compressor, nonces=nonces)
+        nonces = NONCE_MODES[self.nonce_mode](self.is_server) if self.nonce_mode else None
+        return Session(self.aesgcm, self.framing, compressor=compressor, nonces=nonces)
+
+    def accept_nonce_mode(self, mode):
+        if mode is not None and mode not in self.nonce_modes:
+            raise ValueError(f"Unsupported nonce mode: {mode}")
+        self.nonce_mode = mode
+
+    @contextmanager
+    def timed(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[phase] += time.perf_counter() - start
+
+    async def sign(self, data):
+        with self.timed("rsa"):
+            if self.crypto_pool:
+                return await self.crypto_pool.sign(self.rsa_priv, data)
+            return RSAHandler.sign(self.rsa_priv, data)
+
+    async def verify(self, data, sig):
+        with self.timed("rsa"):
+            if self.crypto_pool:
+                return await self.crypto_pool.verify(self.peer_rsa_pub, data, sig)
+            return RSAHandler.verify(self.peer_rsa_pub, data, sig)
+
+    def session_parts(self) -> tuple:
+        """Negotiated session settings as MAC input; defaults add nothing, as before they existed"""
+        parts = (self.codec.encode(),) if self.codec else ()
+        return parts + ((b"nonces=" + self.nonce_mode.encode(),) if self.nonce_mode else ())
+
+    def resume_request(self) -> str:
+        """Client: header value offering to resume with self.ticket"""
+        self.resume_xkey = X25519Key()
+        ticket_id, secret = bytes.fromhex(self.ticket["id"]), bytes.fromhex(self.ticket["secret"])
+        choice = self.framings[0]
+        mac = resume_mac(secret, b"resume", ticket_id, self.resume_xkey.pub_bytes, choice.encode())
+        return ".".join((ticket_id.hex(), self.resume_xkey.pub_bytes.hex(), choice, mac.hex()))
+
+    def try_resume(self):
+        """Server: redeem a valid resume request. Returns (entry, client xpub) or None."""
+        if not self.resume_request_value or self.tickets is None:
+            return None
+        try:
+            ticket_id, xpub, choice, mac = self.resume_request_value.split(".")
+            ticket_id, xpub, mac = bytes.fromhex(ticket_id), bytes.fromhex(xpub), bytes.fromhex(mac)
+        except ValueError:
+            return None
+        if choice not in self.framings or choice not in FRAMINGS:
+            return None
+        entry = self.tickets.redeem(ticket_id)
+        if entry is None or not hmac.compare_digest(mac, resume_mac(entry.secret, b"resume", ticket_id, xpub, choice.encode())):
+            return None
+        if entry.compression and entry.compression not in self.compression or entry.nonces and entry.nonces not in self.nonce_modes:
+            return None
+        self.framing = FRAMINGS[choice]
+        self.codec = entry.compression
+        self.nonce_mode = entry.nonces
+        return entry, ticket_id, xpub
 
     async def run(self):
         if self.is_server:
-            # Server: ephemeral X25519, sign, send
-            xkey = X25519Key()
-            sig = RSAHandler.sign(self.rsa_priv, xkey.pub_bytes)
-            await self.ws.send(json.dumps({"xpub": xkey.pub_bytes.hex(), "sig": sig.hex()}))
+            resume = self.try_resume()
+            if resume:
+                entry, ticket_id, peer_xpub = resume
+                with self.timed("x25519"):
+                    xkey = X25519Key()
+                mac = resume_mac(entry.secret, b"resumed", ticket_id, peer_xpub, xkey.pub_bytes, *self.session_parts())
+                reply = {"resume": "ok", "xpub": xkey.pub_bytes.hex(), "mac": mac.hex(), "features": list(self.features)}
+                if self.codec:
+                    reply["compression"] = self.codec
+                if self.nonce_mode:
+                    reply["nonces"] = self.nonce_mode
+                await self.ws.send(json.dumps(reply))
+                with self.timed("x25519"):
+                    shared = xkey.exchange(X25519Key.load_pub(peer_xpub))
+                    self.key = AESHandler.derive_key(shared, salt=entry.secret, info=b"shield-chat resume")
+                    self.aesgcm = AESHandler.make(self.key)
+                self.resumed = entry
+                return self.session()
 
-            # Receive ephemeral X25519 from client
+            # Server: ephemeral X25519, sign (or take a pre-signed one), send
+            material = self.key_pool.take() if self.key_pool is not None else None
+            if material:
+                xkey, sig = material
+                self.pooled = True
+            else:
+                with self.timed("x25519"):
+                    xkey = X25519Key()
+                sig = await self.sign(xkey.pub_bytes)
+            await self.ws.send(json.dumps({"xpub": xkey.pub_bytes.hex(), "sig": sig.hex(), "framing": list(self.framings), "features": list(self.features),
+                                           "compression": self.compression, "nonces": self.nonce_modes}))
+
+            # Receive ephemeral X25519 from client, plus its framing choice (absent: JSON)
             peer_data = json.loads(await self.ws.recv())
             peer_xpub = bytes.fromhex(peer_data["xpub"])
+            choice = peer_data.get("framing", JSONFraming.name)
+            if choice not in self.framings or choice not in FRAMINGS:
+                raise ValueError(f"Unsupported framing: {choice}")
+            self.framing = FRAMINGS[choice]
+            self.codec = peer_data.get("compression")
+            if self.codec is not None and self.codec not in self.compression:
+                raise ValueError(f"Unsupported compression: {self.codec}")
+            self.accept_nonce_mode(peer_data.get("nonces"))
         else:
-            # Client: receive server ephemeral key + signature
+            # Client: receive server ephemeral key + signature (or the answer to our resume request)
             peer_data = json.loads(await self.ws.recv())
             peer_xpub = bytes.fromhex(peer_data["xpub"])
+            self.peer_features = set(peer_data.get("features", ()))
+            if self.resume_xkey and peer_data.get("resume") == "ok":
+                ticket_id, secret = bytes.fromhex(self.ticket["id"]), bytes.fromhex(self.ticket["secret"])
+                self.codec = peer_data.get("compression")
+                if self.codec is not None and self.codec not in self.compression:
+                    raise ValueError(f"Unsupported compression: {self.codec}")
+                self.accept_nonce_mode(peer_data.get("nonces"))
+                expected = resume_mac(secret, b"resumed", ticket_id, self.resume_xkey.pub_bytes, peer_xpub, *self.session_parts())
+                if not hmac.compare_digest(bytes.fromhex(peer_data["mac"]), expected):
+                    raise ValueError("Invalid resumption proof from server!")
+                with self.timed("x25519"):
+                    shared = self.resume_xkey.exchange(X25519Key.load_pub(peer_xpub))
+                    self.key = AESHandler.derive_key(shared, salt=secret, info=b"shield-chat resume")
+                    self.aesgcm = AESHandler.make(self.key)
+                self.resumed = True
+                self.framing = FRAMINGS[self.framings[0]]
+                return self.session()
+
             peer_sig = bytes.fromhex(peer_data["sig"])
-            if not RSAHandler.verify(self.peer_rsa_pub, peer_xpub, peer_sig):
+            if not await self.verify(peer_xpub, peer_sig):
                 raise ValueError("Invalid server signature!")
 
+            # Pick our most preferred framing the server offers (older servers offer none: JSON)
+            offered = peer_data.get("framing", [JSONFraming.name])
+            choice = next((f for f in self.framings if f in offered and f in FRAMINGS), JSONFraming.name)
+            self.framing = FRAMINGS[choice]
+            offered = peer_data.get("compression", [])
+            self.codec = next((c for c in self.compression if c in offered), None)
+            offered = peer_data.get("nonces", [])
+            self.nonce_mode = next((m for m in self.nonce_modes if m in offered), None)
+
             # Client generates ephemeral X25519 and sends to server
-            xkey = X25519Key()
-            await self.ws.send(json.dumps({"xpub": xkey.pub_bytes.hex()}))
+            with self.timed("x25519"):
+                xkey = X25519Key()
+            reply = {"xpub": xkey.pub_bytes.hex(), "framing": choice}
+            if self.codec:
+                reply["compression"] = self.codec
+            if self.nonce_mode:
+                reply["nonces"] = self.nonce_mode
+            await self.ws.send(json.dumps(reply))
 
         # Derive shared AES key
-        shared = xkey.exchange(X25519Key.load_pub(peer_xpub))
-        self.aesgcm = AESHandler.make(AESHandler.derive_key(shared))
-        return self.aesgcm
+        with self.timed("x25519"):
+            shared = xkey.exchange(X25519Key.load_pub(peer_xpub))
+            self.key = AESHandler.derive_key(shared)
+            self.aesgcm = AESHandler.make(self.key)
+        return self.session()
@@ -0,0 +1,124 @@
+import asyncio, json, os, time
+from cryptography.hazmat.primitives import serialization
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class ClientKeyRegistry:
+    """Process-wide client_id -> public key registry, persisted in the background.
+
+    Several worker processes may share the file: misses re-read it on a
+    worker thread when it changed (at most every `refresh_interval` seconds)
+    and writes merge with what is on disk under a lock. Synchronous lookups
+    answer from memory and leave the re-read to the background.
+    """
+
+    def __init__(self, path, flush_delay=0.5, refresh_interval=1.0):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.refresh_interval = refresh_interval
+        self.pems = {}
+        self.keys = {}
+        self.flush_task = None
+        self.dirty = False
+        self.mtime = None
+        self.checked = 0
+        self.refresh_task = None
+        self.merge(self.read())
+
+    def read(self):
+        """(mtime, client_id -> pem) of the file, or None if it is missing, unchanged or unreadable"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self.mtime:
+                return None
+            with open(self.path, "r") as f:
+                return mtime, json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def merge(self, loaded):
+        if loaded is not None:
+            self.mtime, pems = loaded
+            for client_id, pem in pems.items():
+                self.pems.setdefault(client_id, pem)
+
+    async def refresh(self):
+        """Pick up keys registered by other workers since we last looked"""
+        now = time.monotonic()
+        if now - self.checked < self.refresh_interval:
+            return
+        self.checked = now
+        self.merge(await asyncio.to_thread(self.read))
+
+    def missed(self):
+        """A lookup missed: refresh in the background, later lookups see the result"""
+        if time.monotonic() - self.checked >= self.refresh_interval and (self.refresh_task is None or self.refresh_task.done()):
+            self.refresh_task = asyncio.create_task(self.refresh())
+
+    def __contains__(self, client_id):
+        if client_id not in self.pems:
+            self.missed()
+        return client_id in self.pems
+
+    def get(self, client_id):
+        """Parsed public key of a registered client, or None. PEMs are parsed once."""
+        key = self.keys.get(client_id)
+        if key is None and client_id not in self.pems:
+            self.missed()
+        if key is None and client_id in self.pems:
+            key = self.keys[client_id] = serialization.load_pem_public_key(self.pems[client_id].encode())
+        return key
+
+    async def lookup(self, client_id):
+        """get(), waiting for a refresh first on a miss"""
+        if client_id not in self.pems:
+            await self.refresh()
+        return self.get(client_id)
+
+    def remember(self, client_id, pem: str):
+        """Learn a key another worker registered, without persisting it again"""
+        self.pems.setdefault(client_id, pem)
+
+    def pem(self, client_id):
+        return self.pems.get(client_id)
+
+    def register(self, client_id, pem: str, key):
+        """Register a new client key. Returns the key now bound to client_id (first writer wins)."""
+        if client_id in self.pems:
+            return self.get(client_id)
+        self.pems[client_id] = pem
+        self.keys[client_id] = key
+        self.dirty = True
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self.flush_later())
+        return key
+
+    async def flush_later(self):
+        # Keys registered while a write is in flight go out with the next round
+        while self.dirty:
+            await asyncio.sleep(self.flush_delay)
+            await self.flush()
+
+    async def flush(self):
+        """Write pending registrations atomically, off the event loop"""
+        if not self.dirty:
+            return
+        self.dirty = False
+        await asyncio.to_thread(self.write, dict(self.pems))
+
+    def write(self, snapshot):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "w") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(self.path):
+                with open(self.path, "r") as f:
+                    snapshot = {**snapshot, **json.load(f)}
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(snapshot, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
@@ -0,0 +1,242 @@
+import asyncio, os, struct
+from collections import deque
+from .session import BinaryFraming
+from .log import log
+
+LENGTH = struct.Struct("!I")
+
+class LocalRouter:
+    """Single-process stand-in: every client is local, nothing is forwarded"""
+
+    async def start(self, server):
+        pass
+
+    async def stop(self):
+        pass
+
+    def register(self, client_id):
+        pass
+
+    def unregister(self, client_id):
+        pass
+
+    def lookup(self, client_id):
+        return None
+
+    def forward(self, client_id, payload) -> bool:
+        return False
+
+    def forward_mail(self, client_id, items) -> bool:
+        return False
+
+    def forward_many(self, owner, client_ids, payload):
+        pass
+
+    def forward_frame(self, client_id, frame) -> bool:
+        return False
+
+    def join(self, group_id, client_id):
+        pass
+
+    def leave(self, group_id, client_id):
+        pass
+
+class PeerLink:
+    """Outgoing stream to one peer worker, reconnected as needed, with a bounded backlog"""
+
+    def __init__(self, path, on_connect, maxsize=100_000):
+        self.path = path
+        self.on_connect = on_connect
+        self.maxsize = maxsize
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.dropped = 0
+        self.task = asyncio.create_task(self.run())
+
+    def send(self, message: dict):
+        if len(self.queue) >= self.maxsize:
+            self.dropped += 1
+            return
+        # Encoded here, so a message the codec cannot carry is dropped instead of killing the link
+        try:
+            frame = self.frame(message)
+        except (struct.error, ValueError, TypeError) as e:
+            self.dropped += 1
+            log.warning("forward_failed", op=message.get("op"), error=e)
+            return
+        self.queue.append(frame)
+        self.wakeup.set()
+
+    async def run(self):
+        delay = 0.05
+        while True:
+            try:
+                _, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 2.0)
+                continue
+            delay = 0.05
+            try:
+                for message in self.on_connect():
+                    writer.write(self.frame(message))
+                while True:
+                    while self.queue:
+                        writer.write(self.queue.popleft())
+                    await writer.drain()
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+            except (ConnectionError, OSError):
+                writer.close()
+
+    @staticmethod
+    def frame(message) -> bytes:
+        raw = BinaryFraming.encode(message)
+        return LENGTH.pack(len(raw)) + raw
+
+    async def stop(self):
+        self.task.cancel()
+        try: await self.task
+        except asyncio.CancelledError: pass
+
+class UnixSocketRouter(LocalRouter):
+    """Routes between worker processes on one host over Unix sockets.
+
+    Each worker announces the clients it owns to every peer ("up"/"down",
+    plus a full "sync" whenever a link (re)connects), so lookups are a local
+    dict hit, and every worker can tell its clients' presence watchers. Messages for a remote client are forwarded to its owner, which
+    seals them for the recipient's session. Group membership is replicated
+    the same way ("join"/"leave", merged from "sync"), and a group message
+    goes to each owning worker once with the list of its members.
+    """
+
+    def __init__(self, worker_id, workers, run_dir):
+        self.worker_id = worker_id
+        self.workers = workers
+        self.run_dir = run_dir
+        self.owners = {}
+        self.peers = {}
+        self.server = None
+        self.unix_server = None
+
+    def path(self, worker):
+        return os.path.join(self.run_dir, f"worker-{worker}.sock")
+
+    async def start(self, server):
+        self.server = server
+        os.makedirs(self.run_dir, exist_ok=True)
+        path = self.path(self.worker_id)
+        if os.path.exists(path):
+            os.remove(path)
+        self.unix_server = await asyncio.start_unix_server(self.handle_peer, path)
+        for w in range(self.workers):
+            if w != self.worker_id:
+                self.peers[w] = PeerLink(self.path(w), self.sync_messages)
+
+    async def stop(self):
+        for link in self.peers.values():
+            await link.stop()
+        if self.unix_server:
+            self.unix_server.close()
+
+    def sync_messages(self):
+        return [{"op": "sync", "w": self.worker_id, "ids": list(self.server.clients_map), "groups": self.server.groups.snapshot()}]
+
+    def broadcast(self, message):
+        for link in self.peers.values():
+            link.send(message)
+
+    def register(self, client_id):
+        pem = self.server.client_keys.pem(client_id)
+        self.broadcast({"op": "up", "w": self.worker_id, "id": client_id, "pem": pem})
+
+    def unregister(self, client_id):
+        self.broadcast({"op": "down", "w": self.worker_id, "id": client_id})
+
+    def lookup(self, client_id):
+        return self.owners.get(client_id)
+
+    def forward(self, client_id, payload) -> bool:
+        owner = self.owners.get(client_id)
+        if owner is None:
+            return False
+        self.peers[owner].send({"op": "msg", "target": client_id, "payload": payload})
+        return True
+
+    def forward_mail(self, client_id, items) -> bool:
+        owner = self.owners.get(client_id)
+        if owner is None:
+            return False
+        self.peers[owner].send({"op": "mail", "target": client_id, "items": items})
+        return True
+
+    def forward_many(self, owner, client_ids, payload):
+        self.peers[owner].send({"op": "fanout", "targets": client_ids, "payload": payload})
+
+    def forward_frame(self, client_id, frame) -> bool:
+        owner = self.owners.get(client_id)
+        if owner is None:
+            return False
+        self.peers[owner].send({"op": "frame", "target": client_id, "frame": frame})
+        return True
+
+    def join(self, group_id, client_id):
+        self.broadcast({"op": "join", "group": group_id, "id": client_id})
+
+    def leave(self, group_id, client_id):
+        self.broadcast({"op": "leave", "group": group_id, "id": client_id})
+
+    def merge_member(self, group_id, client_id):
+        try:
+            self.server.groups.join(group_id, client_id)
+        except ValueError:
+            pass
+
+    async def handle_peer(self, reader, writer):
+        peer = None
+        try:
+            while True:
+                (n,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+                message = BinaryFraming.decode(await reader.readexactly(n))
+                op = message.get("op")
+                if op == "msg":
+                    self.server.deliver(message["target"], message["payload"], forwarded=True)
+                elif op == "up":
+                    self.owners[message["id"]] = peer = message["w"]
+                    if message.get("pem"):
+                        self.server.client_keys.remember(message["id"], message["pem"])
+                    self.server.on_remote_up(message["id"])
+                elif op == "down":
+                    if self.owners.get(message["id"]) == message["w"]:
+                        del self.owners[message["id"]]
+                        self.server.on_remote_down(message["id"])
+                elif op == "sync":
+                    peer = message["w"]
+                    self.drop_peer(peer)
+                    for client_id in message["ids"]:
+                        self.owners[client_id] = peer
+                        self.server.on_remote_up(client_id)
+                    for group_id, members in message.get("groups", {}).items():
+                        for client_id in members:
+                            self.merge_member(group_id, client_id)
+                elif op == "mail":
+                    self.server.deliver_mail(message["target"], message["items"])
+                elif op == "frame":
+                    self.server.deliver_frame(message["target"], message["frame"], forwarded=True)
+                elif op == "fanout":
+                    self.server.fan_out(message["targets"], message["payload"], forwarded=True)
+                elif op == "join":
+                    self.merge_member(message["group"], message["id"])
+                elif op == "leave":
+                    self.server.groups.leave(message["group"], message["id"])
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            if peer is not None:
+                self.drop_peer(peer)
+            writer.close()
+
+    def drop_peer(self, worker):
+        for client_id in [c for c, w in self.owners.items() if w == worker]:
+            del self.owners[client_id]
+            self.server.on_remote_down(client_id)
@@ -0,0 +1,43 @@
+import os, time
+from collections import OrderedDict
+
+class Ticket:
+    __slots__ = ("client_id", "secret", "features", "compression", "nonces", "expires")
+
+    def __init__(self, client_id, secret, features, compression, nonces, expires):
+        self.client_id = client_id
+        self.secret = secret
+        self.features = features
+        self.compression = compression
+        self.nonces = nonces
+        self.expires = expires
+
+class TicketCache:
+    """Bounded, expiring store of single-use session resumption tickets"""
+
+    def __init__(self, maxsize=100_000, ttl=24 * 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.tickets = OrderedDict()
+
+    def __len__(self):
+        return len(self.tickets)
+
+    def issue(self, client_id, features=(), compression=None, nonces=None) -> tuple[bytes, bytes]:
+        """New (ticket_id, secret) for client_id; the oldest tickets make room"""
+        now = time.time()
+        while self.tickets:
+            oldest = next(iter(self.tickets.values()))
+            if len(self.tickets) < self.maxsize and oldest.expires > now:
+                break
+            self.tickets.popitem(last=False)
+        ticket_id, secret = os.urandom(16), os.urandom(32)
+        self.tickets[ticket_id] = Ticket(client_id, secret, frozenset(features), compression, nonces, now + self.ttl)
+        return ticket_id, secret
+
+    def redeem(self, ticket_id: bytes):
+        """Consume a ticket. Returns its entry, or None if unknown or expired."""
+        entry = self.tickets.pop(ticket_id, None)
+        if entry is None or entry.expires <= time.time():
+            return None
+        return entry
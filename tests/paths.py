@@ -0,0 +1,15 @@
+"""server/ and client/ both have a `modules` package (with differing keys.py) and a
+connection module, so a test says which side it imports from"""
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def use(side):
+    """Put server/ or client/ first on sys.path, forgetting what was imported from the other"""
+    path = os.path.join(ROOT, side)
+    other = os.path.join(ROOT, "client" if side == "server" else "server")
+    for name, module in list(sys.modules.items()):
+        if (getattr(module, "__file__", None) or "").startswith(other + os.sep):
+            del sys.modules[name]
+    sys.path[:] = [p for p in sys.path if os.path.abspath(p) not in (path, other)]
+    sys.path.insert(0, path)
@@ -0,0 +1,78 @@
+"""Payload compression limits: a peer chooses what we inflate, so nothing past max_size is ever produced."""
+import os, unittest
+from paths import use
+
+use("server")
+from modules.compression import Compressor, CompressionError, CODECS, RAW, COMPRESSED, zstandard
+from modules.session import Session, BinaryFraming
+from modules.crypto_utils import AESHandler
+
+LIMIT = 64 * 1024
+
+class LimitTest(unittest.TestCase):
+    def test_exactly_at_the_limit(self):
+        data = (os.urandom(1000) * LIMIT)[:LIMIT]
+        for name in CODECS:
+            with self.subTest(codec=name):
+                c = Compressor(name, min_size=0, max_size=LIMIT)
+                wrapped = c.wrap(data)
+                self.assertEqual(wrapped[:1], COMPRESSED)
+                self.assertEqual(bytes(c.unwrap(wrapped)), data)
+
+    def test_one_past_the_limit(self):
+        data = bytes(LIMIT + 1)
+        for name in CODECS:
+            with self.subTest(codec=name):
+                c = Compressor(name, min_size=0, max_size=LIMIT)
+                with self.assertRaises(CompressionError):
+                    c.unwrap(c.wrap(data))
+
+    def test_bomb(self):
+        data = bytes(64 * 1024 * 1024)
+        for name in CODECS:
+            with self.subTest(codec=name):
+                c = Compressor(name, min_size=0, max_size=LIMIT)
+                wrapped = c.wrap(data)
+                with self.assertRaises(CompressionError):
+                    c.unwrap(wrapped)
+
+    def test_truncated_and_corrupt(self):
+        data = b"hello " * 1000
+        for name in CODECS:
+            with self.subTest(codec=name):
+                c = Compressor(name, min_size=0, max_size=LIMIT)
+                wrapped = c.wrap(data)
+                for bad in (wrapped[:len(wrapped) // 2], COMPRESSED + os.urandom(64), COMPRESSED):
+                    with self.assertRaises(CompressionError):
+                        c.unwrap(bad)
+
+    def test_flags(self):
+        c = Compressor("zlib", min_size=128, max_size=LIMIT)
+        self.assertEqual(c.wrap(b"short"), RAW + b"short")
+        self.assertEqual(c.store(b"a" * 1000), RAW + b"a" * 1000)
+        self.assertEqual(c.unwrap(RAW + b"as is"), b"as is")
+        with self.assertRaises(CompressionError):
+            c.unwrap(b"\x02data")
+        with self.assertRaises(CompressionError):
+            c.unwrap(b"")
+
+    @unittest.skipIf(zstandard is None, "zstandard not installed")
+    def test_zstd_without_content_size(self):
+        c = Compressor("zstd", min_size=0, max_size=LIMIT)
+        packed = zstandard.ZstdCompressor(write_content_size=False).compress(bytes(1000))
+        with self.assertRaises(CompressionError):
+            c.unwrap(COMPRESSED + packed)
+
+class MixedTest(unittest.TestCase):
+    def test_seal_mixed_is_not_compressed(self):
+        aesgcm = AESHandler.make(os.urandom(32))
+        payload = {"type": "batch", "items": [{"text": "same text " * 50, "sender": str(i)} for i in range(8)]}
+        sender = Session(aesgcm, BinaryFraming, compressor=Compressor("zlib"))
+        receiver = Session(aesgcm, BinaryFraming, compressor=Compressor("zlib"))
+        mixed = sender.seal_mixed(payload)
+        self.assertGreater(len(mixed), len(BinaryFraming.encode(payload)))
+        self.assertLess(len(sender.seal(payload)), len(mixed))
+        self.assertEqual(receiver.open(mixed), payload)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+"""Binary payload codec and frame header: what a peer sends is parsed here before anything else."""
+import random, struct, unittest
+from paths import use
+
+use("server")
+from modules.session import BinaryFraming, FRAME_HEADER, FRAME_VERSION, FRAME_DATA, FRAME_CHUNK
+
+PAYLOAD = {"text": "héllo", "long": "x" * 300, "n": -2**63, "f": 1.5, "ok": True, "no": False, "none": None,
+           "raw": b"\x00\xff", "items": [{"target": "a"}, [1, 2]] + list(range(300)), "k" * 255: {}}
+
+class DecodeTest(unittest.TestCase):
+    def test_round_trip(self):
+        self.assertEqual(BinaryFraming.decode(BinaryFraming.encode(PAYLOAD)), PAYLOAD)
+
+    def test_every_truncation_rejected(self):
+        raw = BinaryFraming.encode(PAYLOAD)
+        for n in range(len(raw)):
+            with self.assertRaises(ValueError, msg=n):
+                BinaryFraming.decode(raw[:n])
+
+    def test_trailing_bytes_rejected(self):
+        with self.assertRaises(ValueError):
+            BinaryFraming.decode(BinaryFraming.encode({"a": 1}) + b"N")
+
+    def test_top_level_must_be_a_map(self):
+        for raw in (b"N", b"s\x01a", b"l\x00", b"I" + bytes(8)):
+            with self.assertRaises(ValueError):
+                BinaryFraming.decode(raw)
+
+    def test_lengths_past_the_end(self):
+        for raw in (b"M" + struct.pack("!I", 2**32 - 1), b"m\x01\x01aS" + struct.pack("!I", 2**31), b"m\x01\xffa", b"m\x01\x01aL\xff\xff\xff\xff"):
+            with self.assertRaises(ValueError):
+                BinaryFraming.decode(raw)
+
+    def test_bad_tag_and_text(self):
+        for raw in (b"m\x01\x01aZ", b"m\x01\x01as\x02\xff\xfe", b"m\x01\x02\xff\xfeN"):
+            with self.assertRaises(ValueError):
+                BinaryFraming.decode(raw)
+
+    def test_deep_nesting(self):
+        with self.assertRaises(ValueError):
+            BinaryFraming.decode(b"m\x01\x01a" + b"l\x01" * 100_000 + b"N")
+
+    def test_random_input_only_raises_value_error(self):
+        rng = random.Random(4)
+        valid = BinaryFraming.encode(PAYLOAD)
+        for _ in range(5000):
+            raw = bytearray(valid[:rng.randrange(len(valid))])
+            for _ in range(rng.randrange(4)):
+                if raw:
+                    raw[rng.randrange(len(raw))] = rng.randrange(256)
+            try:
+                BinaryFraming.decode(bytes(raw))
+            except ValueError:
+                pass
+
+    def test_unencodable_values(self):
+        for payload in ({"n": 2**63}, {"k" * 256: 1}, {"x": object()}):
+            with self.assertRaises((struct.error, TypeError)):
+                BinaryFraming.encode(payload)
+
+class FrameTest(unittest.TestCase):
+    def test_unpack(self):
+        nonce = bytes(range(12))
+        nonce_out, ct = BinaryFraming.unpack(BinaryFraming.pack(nonce, b"ct"))
+        self.assertEqual((nonce_out, bytes(ct)), (nonce, b"ct"))
+
+    def test_malformed_frames(self):
+        good = FRAME_HEADER.pack(FRAME_VERSION, FRAME_DATA, bytes(12))
+        for message in (good[:-1], b"", good.hex(), FRAME_HEADER.pack(FRAME_VERSION + 1, FRAME_DATA, bytes(12)),
+                        FRAME_HEADER.pack(FRAME_VERSION, FRAME_CHUNK, bytes(12))):
+            with self.assertRaises(ValueError):
+                BinaryFraming.unpack(message)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Client outbox across a dropped socket: every payload is sent once, in order."""
+import asyncio, types, unittest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from paths import use
+
+use("client")
+import websockets
+import connection
+from channel import Channel
+
+SERVER_PEM = rsa.generate_private_key(public_exponent=65537, key_size=2048).public_key().public_bytes(
+    serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+        self.open = True
+
+    async def send(self, frame):
+        if not self.open:
+            raise websockets.ConnectionClosed(None, None)
+        self.sent.append(frame)
+
+    async def close(self):
+        self.open = False
+
+class FakeChannel(Channel):
+    """A resumed channel that seals nothing, over a FakeSocket"""
+    sockets = []
+
+    async def connect(self, url, **kwargs):
+        self.ws = FakeSocket()
+        self.sockets.append(self.ws)
+        self.session = types.SimpleNamespace(seal=lambda payload: payload)
+        self.resumed = True
+        self.server_features = {"batch"}
+        return self.ws
+
+    async def receive_loop(self, on_message, on_disconnect, on_chunk=None):
+        await asyncio.Event().wait()
+
+class OutboxTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.patched = connection.Channel, connection.server_pub
+        connection.Channel, connection.server_pub = FakeChannel, lambda: SERVER_PEM
+        FakeChannel.sockets = []
+
+    def tearDown(self):
+        connection.Channel, connection.server_pub = self.patched
+
+    async def test_failed_batch_is_sent_once_after_reconnect(self):
+        client = connection.ClientConnection(batch_window=60, batch_size=2, identity=object(), reconnect=False)
+        client.client_id = "me"
+        await client.connect()
+        first = FakeChannel.sockets[0]
+        first.open = False
+        client.queue({"target": "peer", "text": "m1"})
+        client.queue({"target": "peer", "text": "m2"})
+        await asyncio.sleep(0.05)
+        self.assertEqual(first.sent, [])
+
+        await client.connect()
+        await asyncio.sleep(0.05)
+        await client.channel.flush()
+        self.assertEqual(FakeChannel.sockets[1].sent, [{"type": "batch", "items": [{"target": "peer", "text": "m1"}, {"target": "peer", "text": "m2"}]}])
+        self.assertFalse(client.outbox)
+        client.writer_task.cancel()
+        client.receive_task.cancel()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""Client key registry persistence: a client_id stays bound to the first key it registered with."""
+import asyncio, json, os, tempfile, unittest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from paths import use
+
+use("server")
+from modules.registry import ClientKeyRegistry
+
+def new_key():
+    key = ed25519.Ed25519PrivateKey.generate().public_key()
+    return key.public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode(), key
+
+class RegistryTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "client_keys.json")
+
+    def on_disk(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+    async def settle(self, registry):
+        while registry.flush_task is not None and not registry.flush_task.done():
+            await registry.flush_task
+
+    async def test_survives_a_restart(self):
+        registry = ClientKeyRegistry(self.path, flush_delay=0.01)
+        pem, key = new_key()
+        self.assertIs(registry.register("alice", pem, key), key)
+        await self.settle(registry)
+        reloaded = ClientKeyRegistry(self.path)
+        self.assertEqual(reloaded.pem("alice"), pem)
+        self.assertEqual(reloaded.get("alice"), key)
+
+    async def test_registered_during_a_write(self):
+        registry = ClientKeyRegistry(self.path, flush_delay=0.01)
+        registry.register("a", *new_key())
+        write = registry.write
+        started = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        def slow_write(snapshot):
+            loop.call_soon_threadsafe(started.set)
+            write(snapshot)
+        registry.write = slow_write
+        await started.wait()  # the write of "a" is in flight
+        registry.register("b", *new_key())
+        await self.settle(registry)
+        self.assertEqual(set(self.on_disk()), {"a", "b"})
+        self.assertFalse(registry.dirty)
+
+    async def test_first_key_wins(self):
+        registry = ClientKeyRegistry(self.path, flush_delay=0.01)
+        pem, key = new_key()
+        registry.register("alice", pem, key)
+        self.assertIs(registry.register("alice", *new_key()), key)
+        await self.settle(registry)
+        self.assertEqual(self.on_disk(), {"alice": pem})
+
+    async def test_workers_share_the_file(self):
+        one = ClientKeyRegistry(self.path, flush_delay=0.01, refresh_interval=0)
+        two = ClientKeyRegistry(self.path, flush_delay=0.01, refresh_interval=0)
+        pem_a, key_a = new_key()
+        pem_b, key_b = new_key()
+        one.register("a", pem_a, key_a)
+        await self.settle(one)
+        two.register("b", pem_b, key_b)
+        await self.settle(two)
+        self.assertEqual(self.on_disk(), {"a": pem_a, "b": pem_b})
+        self.assertEqual(await two.lookup("a"), key_a)
+        self.assertIsNone(await two.lookup("nobody"))
+        # The other worker claimed "a" first: a late registration there yields its key
+        self.assertEqual(two.register("a", *new_key()), key_a)
+
+    async def test_unreadable_file(self):
+        with open(self.path, "w") as f:
+            f.write("{not json")
+        registry = ClientKeyRegistry(self.path)
+        self.assertNotIn("alice", registry)
+        self.assertIsNone(await registry.lookup("alice"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+"""Replay window and key ratchet of server/modules (the client keeps identical copies).
+
+    python -m pytest -q tests
+"""
+import os, unittest
+from paths import use
+
+use("server")
+from modules.replay import SequenceWindow
+from modules.session import Session, BinaryFraming, RatchetNonces, ReplayError, MAX_EPOCH_SKIP
+
+def epoch(frame) -> int:
+    """Key epoch a binary frame was sealed under"""
+    return int.from_bytes(frame[4:6], "big")
+
+class SequenceWindowTest(unittest.TestCase):
+    def test_accepts_each_number_once(self):
+        window = SequenceWindow(8)
+        for seq in (0, 2, 1):
+            self.assertNotIn(seq, window)
+            window.add(seq)
+            self.assertIn(seq, window)
+        self.assertNotIn(3, window)
+
+    def test_edge_of_window(self):
+        window = SequenceWindow(8)
+        window.add(20)
+        self.assertNotIn(13, window)  # size - 1 below the highest: still tracked
+        self.assertIn(12, window)  # size below: too old to tell, rejected
+        window.add(13)
+        self.assertIn(13, window)
+
+    def test_jump_past_the_window(self):
+        window = SequenceWindow(8)
+        for seq in range(5):
+            window.add(seq)
+        window.add(100)
+        self.assertIn(4, window)
+        for seq in range(93, 100):
+            self.assertNotIn(seq, window)
+
+    def test_stale_bits_do_not_come_back(self):
+        window = SequenceWindow(8)
+        for seq in range(0, 40, 2):
+            window.add(seq)
+        for seq in range(32, 40):
+            self.assertEqual(seq in window, seq % 2 == 0)
+
+class RatchetTest(unittest.TestCase):
+    def pair(self, rekey_frames):
+        key = os.urandom(32)
+        client = Session(None, BinaryFraming, nonces=RatchetNonces(False, key, rekey_frames=rekey_frames))
+        server = Session(None, BinaryFraming, nonces=RatchetNonces(True, key))
+        return client, server
+
+    def frames(self, session, n):
+        return [session.seal_bytes(b"frame %d" % i) for i in range(n)]
+
+    def test_receiver_follows_rotations(self):
+        client, server = self.pair(rekey_frames=3)
+        frames = self.frames(client, 10)
+        self.assertEqual([epoch(f) for f in frames], [0, 0, 0, 1, 1, 1, 2, 2, 2, 3])
+        for i, frame in enumerate(frames):
+            self.assertEqual(server.open_bytes(frame), b"frame %d" % i)
+        self.assertEqual(server.nonces.recv_epoch, 3)
+
+    def test_previous_key_accepted(self):
+        client, server = self.pair(rekey_frames=2)
+        frames = self.frames(client, 6)
+        server.open_bytes(frames[2])  # epoch 1 first
+        self.assertEqual(server.open_bytes(frames[1]), b"frame 1")
+        server.open_bytes(frames[4])  # epoch 2: epoch 0 is gone
+        self.assertEqual(server.open_bytes(frames[3]), b"frame 3")
+        with self.assertRaises(ValueError):
+            server.open_bytes(frames[0])
+
+    def test_previous_key_dropped_after_a_skip(self):
+        client, server = self.pair(rekey_frames=1)
+        frames = self.frames(client, 3)
+        server.open_bytes(frames[2])  # epoch 2, skipping epoch 1
+        self.assertIsNone(server.nonces.prev_aesgcm)
+        with self.assertRaises(ReplayError):
+            server.open_bytes(frames[1])
+
+    def test_epoch_skip_limit(self):
+        client, server = self.pair(rekey_frames=1)
+        frames = self.frames(client, MAX_EPOCH_SKIP + 2)
+        with self.assertRaises(ValueError):
+            server.open_bytes(frames[MAX_EPOCH_SKIP + 1])
+        self.assertEqual(server.nonces.recv_epoch, 0)
+        self.assertEqual(server.open_bytes(frames[MAX_EPOCH_SKIP]), b"frame %d" % MAX_EPOCH_SKIP)
+        self.assertEqual(server.nonces.recv_epoch, MAX_EPOCH_SKIP)
+
+    def test_forged_frame_does_not_advance(self):
+        client, server = self.pair(rekey_frames=1)
+        frame = bytearray(self.frames(client, 2)[1])
+        frame[-1] ^= 1
+        with self.assertRaises(Exception):
+            server.open_bytes(bytes(frame))
+        self.assertEqual(server.nonces.recv_epoch, 0)
+
+    def test_replay_and_reflection_rejected(self):
+        client, server = self.pair(rekey_frames=2)
+        frames = self.frames(client, 3)
+        for frame in frames:
+            server.open_bytes(frame)
+        with self.assertRaises(ReplayError):
+            server.open_bytes(frames[2])
+        with self.assertRaises(ReplayError):
+            server.open_bytes(server.seal_bytes(b"reflected"))
+
+if __name__ == "__main__":
+    unittest.main()